@@ -1,10 +1,11 @@
-"""Wrapper to run initializers/code in various modules.
+"""Run the storage API on Flask's development server.
 
-Also creates some output folders for CAs and IPMs."""
-import api.StorageApi
-import services.DatabaseService
-import os
+Also creates some output folders for CAs and IPMs. Production deployments
+should use the WSGI entry point in wsgi.py instead (see startup.sh)."""
+from persistence.Migrations import upgrade_database
+from services.ConfigParser import SERVICE_PORT
+from wsgi import app
 
-os.makedirs("CT", exist_ok=True)
-os.makedirs(os.path.join("CT", "CAs"), exist_ok=True)
-os.makedirs(os.path.join("CT", "IPMs"), exist_ok=True)
+if __name__ == "__main__":
+    upgrade_database()
+    app.run(host="0.0.0.0", port=SERVICE_PORT)
@@ -1,46 +1,154 @@
 """A Flask application exposing the storage API."""
-from flask import Flask, request, Response
-from services import DatabaseService
+import csv
+import io
+import json
+import logging
+import tempfile
+import zlib
+from flask import Flask, request, Response, send_file
+from services import (BlobCodec, DatabaseService, FaultLocalization, Instrumentation,
+                      OracleRegistry, Profiling)
+from services.ArrowConverter import FORMATS
+from services.ConfigParser import ORACLE_CHUNK_SIZE, ORACLE_WORKERS
 from entities import ModelParameter, TestQuery, TestSentence
-from services.ConfigParser import *
-import threading
+
+# Optional per-query statistics accepted by /store/test_query, in order
+QUERY_TIMING = ("wall_time", "eval_count", "prompt_eval_count",
+                "total_duration", "cache_hit")
 
 app = Flask(__name__)
+Instrumentation.instrument(app)
+Profiling.start()
+
+
+@app.route("/health", methods=['GET'])
+def health():
+    """Report whether the service can reach its database."""
+    try:
+        healthy = DatabaseService.check_health()
+    except Exception:
+        healthy = False
+    if healthy:
+        return {"status": "ok", "database": "reachable"}
+    return {"status": "error", "database": "unreachable"}, 503
 
 @app.route("/store/test_sentence", methods=['POST'])
 def store_test_sentence():
-    """Store a tested sentence including its synonym IPM and resulting CA."""
+    """Store a tested sentence including its synonym IPM and resulting CA.
+
+    The CA and IPM are either referenced by the hashes of previously
+    uploaded blobs (`ca_hash`, `ipm_hash`, see /blob/<hash>) or sent
+    inline (`ca_file`, `ipm_file`), in which case they are stored as
+    blobs as well.
+
+    Returns the ID of the new sentence, which callers should pass along
+    when storing the associated queries and model parameters."""
     req = request.json
-    DatabaseService.save_test_sentence(
+    for key in ("ca_hash", "ipm_hash"):
+        if req.get(key) and not DatabaseService.has_blob(req[key]):
+            return Response(f"Unknown {key} {req[key]}", status=400,
+                            mimetype='text/plain')
+    sentence_id = DatabaseService.save_test_sentence(
         TestSentence(-1, req["sentence"], req["correct_answer_label"],
                      req["ipm_vector_notation"], req["source_data_name"],
-                     req["model_name"], req["ca_file"], req["ipm_file"],
-                     req["ipm_description_file"], req["strength"], req["note"])
+                     req["model_name"], req.get("ca_file", ""),
+                     req.get("ipm_file", ""), req["ipm_description_file"],
+                     req["strength"], req["note"], req.get("ca_hash"),
+                     req.get("ipm_hash"))
     )
-    return "Success"
+    return {"id": sentence_id}
+
+
+@app.route("/blob/<blob_hash>", methods=['GET', 'HEAD'])
+def load_blob(blob_hash):
+    """Retrieve a blob (e.g. a CA or IPM) by the SHA-256 of its content.
+
+    HEAD requests only check whether the blob exists. Clients accepting
+    the `deflate` encoding receive zlib-compressed blobs as stored."""
+    if request.method == 'HEAD':
+        found = DatabaseService.has_blob(blob_hash)
+        Instrumentation.count_blob_lookup(found)
+        return Response(status=200 if found else 404)
+    blob = DatabaseService.get_blob(blob_hash)
+    if blob is None:
+        return Response(status=404)
+    compression, data = blob
+    if compression == "zlib" and "deflate" in request.accept_encodings:
+        return Response(data, mimetype='text/plain',
+                        headers={"Content-Encoding": "deflate"})
+    return Response(BlobCodec.decompress(data, compression), mimetype='text/plain')
+
+
+@app.route("/blob/<blob_hash>", methods=['PUT'])
+def store_blob(blob_hash):
+    """Upload a blob addressed by the hex SHA-256 of its content.
+
+    The body may be zlib-compressed (`Content-Encoding: deflate`) and is
+    then stored as it is. Responds with 201 if the blob was added and
+    with 200 if it already existed."""
+    try:
+        if request.content_encoding == "deflate":
+            added = DatabaseService.save_compressed_blob(blob_hash, request.get_data())
+        elif request.content_encoding:
+            return Response(f"Unsupported encoding {request.content_encoding}",
+                            status=415, mimetype='text/plain')
+        else:
+            content = request.get_data()
+            if BlobCodec.content_hash(content) != blob_hash:
+                raise ValueError("Blob content does not match its hash")
+            added = not DatabaseService.has_blob(blob_hash)
+            DatabaseService.save_blob(content)
+    except (ValueError, zlib.error) as e:
+        return Response(str(e), status=400, mimetype='text/plain')
+    return {"hash": blob_hash}, 201 if added else 200
+
+
+def sentence_id_or_latest(sentence_id):
+    """Return the given sentence ID or, if missing, the most recent one.
+
+    Falling back to the latest sentence keeps older runners working, but
+    is racy when several runs store results at the same time."""
+    if sentence_id is None:
+        return DatabaseService.get_current_run_id()
+    return int(sentence_id)
 
 
 @app.route("/store/test_query", methods=['POST'])
 def store_test_query():
-    """Store a mutated question and the resulting LLM response."""
+    """Store a mutated question and the resulting LLM response.
+
+    The optional `sentence_id` property selects the tested sentence.
+    Further optional properties are the timing and token counts reported
+    by the executor (`wall_time`, `eval_count`, `prompt_eval_count`,
+    `total_duration`, `cache_hit`) and the `trace_id` of the query, which
+    may also be sent as `X-Trace-Id` header."""
     request_data = request.json
     DatabaseService.save_test_query(
-        TestQuery(DatabaseService.get_current_run_id(),
-                           request_data["modified_question"],
-                           request_data["new_response"])
+        TestQuery(sentence_id_or_latest(request_data.get("sentence_id")),
+                  request_data["modified_question"],
+                  request_data["new_response"],
+                  *(request_data.get(key) for key in QUERY_TIMING),
+                  request_data.get("trace_id") or request.headers.get("X-Trace-Id"))
     )
     return "Success"
 
 
 @app.route("/store/model_parameters", methods=['POST'])
 def store_model_parameters():
-    """Store model parameters as key-value pairs."""
+    """Store model parameters as key-value pairs.
+
+    The request body is either a list of [parameter, value] pairs or an
+    object with `sentence_id` and `parameters` (such a list) properties."""
     request_data = request.json
-    run_id = DatabaseService.get_current_run_id()
-    for parameter, value in request_data:
-        DatabaseService.save_model_parameters(
-            ModelParameter(run_id, parameter, value)
-        )
+    sentence_id = None
+    if isinstance(request_data, dict):
+        sentence_id = request_data.get("sentence_id")
+        request_data = request_data["parameters"]
+    run_id = sentence_id_or_latest(sentence_id)
+    DatabaseService.save_model_parameter_list([
+        ModelParameter(run_id, parameter, value)
+        for parameter, value in request_data
+    ])
     return "Success"
 
 
@@ -100,10 +208,195 @@ def load_model_parameters():
     else:
         return model_parameters.to_html()
 
-def start_server():
-    """Run Flask app on the port given by the SERVICE_PORT env variable."""
-    global port
-    app.run(host="0.0.0.0", port=SERVICE_PORT)
 
-# Start the server in a thread
-threading.Thread(target=start_server).start()
+
+@app.route("/load/metrics", methods=['GET'])
+def load_metrics():
+    """Compute confusion matrix, precision, recall, F1 score and consistency.
+
+    GET parameters are `oracle_id` (1 by default), `group_by`, a comma-
+    separated list of `note`, `model_name` and `sentence_id`, and `live`;
+    if set to `true`, the metrics are computed from all verdicts instead
+    of the per-sentence aggregates."""
+    group_by = request.args.get("group_by")
+    live = request.args.get("live", "").lower() == "true"
+    try:
+        metrics = DatabaseService.get_metrics(
+            request.args.get("oracle_id", 1, type=int),
+            group_by.split(",") if group_by else [], not live)
+    except ValueError as e:
+        return Response(str(e), status=400, mimetype='text/plain')
+    return_type = request.args.get("return_type", "html")
+    if return_type == "json":
+        return Response(metrics.to_json(orient="records"), mimetype='application/json')
+    else:
+        return metrics.to_html()
+
+
+@app.route("/load/sentence_metrics", methods=['GET'])
+def load_sentence_metrics():
+    """Retrieve the per-sentence verdict aggregates of the `oracle_id` oracle."""
+    sentence_metrics = DatabaseService.get_sentence_metrics(
+        request.args.get("oracle_id", 1, type=int))
+    return_type = request.args.get("return_type", "html")
+    if return_type == "json":
+        return Response(sentence_metrics.to_json(orient="records"), mimetype='application/json')
+    else:
+        return sentence_metrics.to_html()
+
+
+@app.route("/compare/runs", methods=['GET'])
+def compare_runs():
+    """Compare the verdicts of two test runs over the same questions.
+
+    Runs are selected by the `a_note`/`a_model_name` and
+    `b_note`/`b_model_name` GET parameters; further parameters are
+    `oracle_id` (1 by default) and `top`, the number of diverging
+    prompts (20 by default). Returns the summary, per-sentence
+    comparison and top diverging prompts, see DBConnection.compare_runs()."""
+    runs = [{column: request.args.get(f"{name}_{column}")
+             for column in ("note", "model_name")} for name in ("a", "b")]
+    try:
+        comparison = DatabaseService.compare_runs(
+            *runs, request.args.get("oracle_id", 1, type=int),
+            request.args.get("top", 20, type=int))
+    except ValueError as e:
+        return Response(str(e), status=400, mimetype='text/plain')
+    return_type = request.args.get("return_type", "html")
+    if return_type == "json":
+        return {name: json.loads(df.to_json(orient="records"))
+                for name, df in comparison.items()}
+    else:
+        return "".join(f"<h2>{name}</h2>{df.to_html()}"
+                       for name, df in comparison.items())
+
+
+@app.route("/load/fault_localization", methods=['GET'])
+def load_fault_localization():
+    """Rank the synonym combinations most associated with deviating verdicts.
+
+    GET parameters are `sentence_id`, a comma-separated list of sentence
+    IDs, `oracle_id` (1 by default), `strength` (the strength of each
+    sentence's CA by default), `min_queries` and `top`, the number of
+    combinations per sentence. Sentences that cannot be ranked, e.g.
+    because some of their queries failed, are skipped; their IDs are
+    listed in the X-Skipped-Sentences header."""
+    sentence_ids = request.args.get("sentence_id")
+    if not sentence_ids:
+        return Response("sentence_id is required", status=400, mimetype='text/plain')
+    try:
+        sentence_ids = [int(s) for s in sentence_ids.split(",")]
+        oracle_id = request.args.get("oracle_id", 1, type=int)
+        ranking, skipped = FaultLocalization.localize_sentence_faults(
+            DatabaseService.get_sentence_cas(sentence_ids),
+            DatabaseService.get_sentence_verdicts(sentence_ids, oracle_id),
+            request.args.get("strength", None, type=int),
+            request.args.get("min_queries", 1, type=int),
+            request.args.get("top", None, type=int))
+    except ValueError as e:
+        return Response(str(e), status=400, mimetype='text/plain')
+    for sentence_id, reason in skipped.items():
+        logging.warning("Fault localization skipped sentence %s: %s",
+                        sentence_id, reason)
+    headers = {"X-Skipped-Sentences": ",".join(map(str, skipped))}
+    return_type = request.args.get("return_type", "html")
+    if return_type == "json":
+        return Response(ranking.to_json(orient="records"), mimetype='application/json',
+                        headers=headers)
+    else:
+        return Response(ranking.to_html(), mimetype='text/html', headers=headers)
+
+
+@app.route("/oracle/evaluate", methods=['POST'])
+def evaluate_new_queries():
+    """Apply the `oracle_id` oracle to all queries it has not judged yet.
+
+    The optional `workers` and `chunk_size` GET parameters control the
+    parallel evaluation, see OracleRegistry.run_oracle()."""
+    try:
+        evaluated = OracleRegistry.evaluate_new_queries(
+            request.args.get("oracle_id", 1, type=int),
+            request.args.get("workers", ORACLE_WORKERS, type=int),
+            request.args.get("chunk_size", ORACLE_CHUNK_SIZE, type=int))
+    except ValueError as e:
+        return Response(str(e), status=400, mimetype='text/plain')
+    return {"verdicts": evaluated}
+
+def ndjson_chunks(columns, chunks):
+    """Serialize chunks of rows as newline-delimited JSON objects."""
+    for rows in chunks:
+        yield "".join(json.dumps(dict(zip(columns, row)), default=str) + "\n"
+                      for row in rows)
+
+
+def csv_chunks(columns, chunks):
+    """Serialize chunks of rows as CSV, starting with a header line."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+@app.route("/stream/<table>", methods=['GET'])
+def stream_table(table):
+    """Stream the rows of a table in ID order, chunk by chunk.
+
+    GET parameters are `format` (`ndjson` or `csv`), `columns` (comma-
+    separated, all by default), `since_id` (only return rows with a higher
+    ID) and `limit` (maximum number of rows). The `id` column is always
+    included; pass the last received ID as `since_id` to get the next page."""
+    try:
+        available = DatabaseService.get_table_columns(table)
+    except ValueError as e:
+        return Response(str(e), status=404, mimetype='text/plain')
+    columns = request.args.get("columns")
+    columns = columns.split(",") if columns else available
+    unknown = set(columns) - set(available)
+    if unknown:
+        return Response(f"Unknown columns: {', '.join(sorted(unknown))}",
+                        status=400, mimetype='text/plain')
+    if "id" not in columns:
+        columns = ["id"] + columns
+    since_id = request.args.get("since_id", 0, type=int)
+    limit = request.args.get("limit", None, type=int)
+    chunks = DatabaseService.stream_table(table, columns, since_id, limit)
+    return_format = request.args.get("format", "ndjson")
+    if return_format == "csv":
+        return Response(csv_chunks(columns, chunks), mimetype='text/csv')
+    elif return_format == "ndjson":
+        return Response(ndjson_chunks(columns, chunks),
+                        mimetype='application/x-ndjson')
+    return Response("Format must be ndjson or csv.", status=400,
+                    mimetype='text/plain')
+
+
+@app.route("/export/test_data", methods=['GET'])
+def export_test_data():
+    """Export the joined sentences/queries/verdicts as Arrow or Parquet.
+
+    GET parameters are `format` (`arrow` for an Arrow IPC stream or
+    `parquet`), `columns` (comma-separated), `note` and `model_name`
+    (may be repeated to select several test runs) and `oracle_id`, which
+    restricts the export to queries with a verdict by this oracle and
+    adds its `oracle_id` and `result` columns."""
+    return_format = request.args.get("format", "arrow")
+    columns = request.args.get("columns")
+    export_file = tempfile.TemporaryFile()
+    try:
+        DatabaseService.export_test_data(
+            export_file, return_format,
+            columns.split(",") if columns else None,
+            request.args.getlist("note"), request.args.getlist("model_name"),
+            request.args.get("oracle_id", None, type=int))
+    except ValueError as e:
+        export_file.close()
+        return Response(str(e), status=400, mimetype='text/plain')
+    export_file.seek(0)
+    return send_file(export_file, mimetype=FORMATS[return_format],
+                     as_attachment=True,
+                     download_name=f"test_data.{return_format}")
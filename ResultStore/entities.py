@@ -24,6 +24,7 @@ class OracleResult:
     oracle_id: int = -1           # Oracle ID
     query_id: int = -1            # Query ID
     result: str | None = None     # Oracle verdict
+    verdict: str | None = None    # Normalized response the verdict is based on
 
     def __str__(self) -> str:
         return f'QID: {self.query_id} Result: {self.result}'
@@ -31,9 +32,15 @@ class OracleResult:
 @dataclass
 class TestQuery:
     """A question/answer pair based on a mutated test sentence."""
-    sentence_id: int = -1          # ID of the original sentence
-    modified_question: str = ""    # Mutated question including prompt prefix/suffix
-    new_response: str = ""         # Returned response
+    sentence_id: int = -1                 # ID of the original sentence
+    modified_question: str = ""           # Mutated question including prompt prefix/suffix
+    new_response: str = ""                # Returned response
+    wall_time: float | None = None        # Executor's time for the query (s)
+    eval_count: int | None = None         # Generated tokens
+    prompt_eval_count: int | None = None  # Prompt tokens
+    total_duration: int | None = None     # LLM's processing time (ns)
+    cache_hit: bool | None = None         # Response came from the executor's cache
+    trace_id: str | None = None           # Correlates runner/executor/store logs
 
 
 @dataclass
@@ -50,3 +57,5 @@ class TestSentence:
     ipm_description_file: str = ""   # Description of input parameter model variant
     strength: int = 2                # Tested combinatorial strength
     note: str = ""                   # Additional note for this test run
+    ca_hash: str | None = None       # Blob hash of the CA (replaces ca_file)
+    ipm_hash: str | None = None      # Blob hash of the IPM (replaces ipm_file)
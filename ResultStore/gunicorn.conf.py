@@ -0,0 +1,40 @@
+"""Gunicorn configuration for the storage API (see wsgi.py)."""
+import os
+import shutil
+import tempfile
+from services.ConfigParser import SERVICE_PORT, STORE_THREADS, STORE_WORKERS
+
+# Workers share their metrics through files, see services/Instrumentation.py;
+# this must be set before prometheus_client is imported
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR",
+                      os.path.join(tempfile.gettempdir(), "store_metrics"))
+
+bind = f"0.0.0.0:{SERVICE_PORT}"
+workers = STORE_WORKERS
+worker_class = "gthread"
+threads = STORE_THREADS
+# Long exports must not be mistaken for hung workers
+timeout = 300
+# Do not load the app in the master so no connection is shared across forks
+preload_app = False
+accesslog = "-"
+# The default format plus the trace ID of the runner's query, if any
+access_log_format = ('%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s"'
+                     ' trace=%({x-trace-id}i)s')
+
+
+def on_starting(server):
+    """Upgrade the database schema once, before any worker is forked.
+
+    Also removes the metric files of a previous server."""
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+    from persistence.Migrations import upgrade_database
+    server.log.info("Applied schema migrations: %s", upgrade_database() or "none")
+
+
+def child_exit(server, worker):
+    """Drop the live gauges (e.g. requests in flight) of a dead worker."""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
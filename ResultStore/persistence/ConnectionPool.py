@@ -0,0 +1,31 @@
+"""Thread-safe pool of database connections."""
+import threading
+from psycopg2.pool import ThreadedConnectionPool
+
+
+class BlockingConnectionPool(ThreadedConnectionPool):
+    """A ThreadedConnectionPool that waits for a free connection.
+
+    psycopg2's own pool raises a PoolError as soon as all connections are
+    checked out; this variant blocks the calling thread until another
+    thread returns its connection instead."""
+
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        self.__slots = threading.BoundedSemaphore(maxconn)
+        super().__init__(minconn, maxconn, *args, **kwargs)
+
+    def getconn(self, key=None):
+        """Check out a connection, waiting until one is available."""
+        self.__slots.acquire()
+        try:
+            return super().getconn(key)
+        except Exception:
+            self.__slots.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        """Return a connection to the pool and wake up a waiting thread."""
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self.__slots.release()
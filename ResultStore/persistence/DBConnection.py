@@ -1,17 +1,99 @@
+from contextlib import contextmanager
+import io
 import numpy
 import pandas.io.sql as sqlio
 import psycopg2
 import psycopg2.extras
+from psycopg2 import sql
 from psycopg2.extensions import register_adapter, AsIs
 from entities import TestSentence, TestQuery, ModelParameter, OracleResult, OracleDescription
+from persistence.ConnectionPool import BlockingConnectionPool
+from persistence.StorageBackend import *
 from services.ConfigParser import *
+from services.Profiling import profiled
 from tenacity import retry, stop_after_attempt, wait_exponential
 
-class DBConnection:
-    """Persistence layer, can store/retrieve objects to/from a Postgres DB."""
+# Recomputes the sentence_metrics rows of all (sentence, oracle) pairs
+# selected by the {scope} condition, see refresh_sentence_metrics()
+SENTENCE_METRICS_REFRESH = """
+INSERT INTO sentence_metrics (sentence_id, oracle_id, tp, fp, tn, fn,
+    undefined, queries, baseline_query_id, baseline_verdict, agreement)
+SELECT sentence_id, oracle_id,
+       count(*) FILTER (WHERE label = 'true' AND verdict = 'true'),
+       count(*) FILTER (WHERE label = 'false' AND verdict = 'true'),
+       count(*) FILTER (WHERE label = 'false' AND verdict = 'false'),
+       count(*) FILTER (WHERE label = 'true' AND verdict = 'false'),
+       count(*) FILTER (WHERE verdict NOT IN ('true', 'false')),
+       count(*),
+       baseline_query_id, baseline_verdict,
+       count(*) FILTER (WHERE verdict = baseline_verdict)
+FROM (
+    SELECT tq.sentence_id, ores.oracle_id, ts.correct_answer_label AS label,
+           ores.verdict,
+           first_value(tq.id) OVER w AS baseline_query_id,
+           first_value(ores.verdict) OVER w AS baseline_verdict
+    FROM test_sentence ts JOIN test_query tq ON ts.id = tq.sentence_id
+    JOIN oracle_result ores ON tq.id = ores.query_id
+    WHERE ores.verdict IS NOT NULL AND {scope}
+    WINDOW w AS (PARTITION BY tq.sentence_id, ores.oracle_id ORDER BY tq.id)
+) verdicts
+GROUP BY sentence_id, oracle_id, baseline_query_id, baseline_verdict
+ON CONFLICT (sentence_id, oracle_id) DO UPDATE SET
+    tp = excluded.tp, fp = excluded.fp, tn = excluded.tn, fn = excluded.fn,
+    undefined = excluded.undefined, queries = excluded.queries,
+    baseline_query_id = excluded.baseline_query_id,
+    baseline_verdict = excluded.baseline_verdict,
+    agreement = excluded.agreement
+"""
+
+# Matches the verdicts of two runs (selected by the {run_a} and {run_b}
+# conditions) by sentence text and prompt; each prompt's first query counts
+RUN_COMPARISON = """
+WITH a AS (
+    SELECT DISTINCT ON (ts.sentence, tq.modified_question)
+           ts.id AS sentence_id, ts.sentence, ts.correct_answer_label AS label,
+           tq.id AS query_id, tq.modified_question, ores.verdict
+    FROM test_sentence ts JOIN test_query tq ON ts.id = tq.sentence_id
+    JOIN oracle_result ores ON tq.id = ores.query_id
+    WHERE ores.oracle_id = %(oracle_id)s AND ores.verdict IS NOT NULL AND {run_a}
+    ORDER BY ts.sentence, tq.modified_question, tq.id
+), b AS (
+    SELECT DISTINCT ON (ts.sentence, tq.modified_question)
+           ts.id AS sentence_id, ts.sentence, tq.id AS query_id,
+           tq.modified_question, ores.verdict
+    FROM test_sentence ts JOIN test_query tq ON ts.id = tq.sentence_id
+    JOIN oracle_result ores ON tq.id = ores.query_id
+    WHERE ores.oracle_id = %(oracle_id)s AND ores.verdict IS NOT NULL AND {run_b}
+    ORDER BY ts.sentence, tq.modified_question, tq.id
+), pairs AS (
+    SELECT a.sentence, a.modified_question, a.label,
+           a.sentence_id AS a_sentence_id, b.sentence_id AS b_sentence_id,
+           a.query_id AS a_query_id, b.query_id AS b_query_id,
+           a.verdict AS a_verdict, b.verdict AS b_verdict,
+           a.verdict <> b.verdict AS flipped
+    FROM a JOIN b USING (sentence, modified_question)
+), sentences AS (
+    SELECT p.*, sa.agreement::float / sa.queries AS a_consistency,
+           sb.agreement::float / sb.queries AS b_consistency
+    FROM (SELECT sentence, a_sentence_id, b_sentence_id, count(*) AS queries,
+                 count(*) FILTER (WHERE flipped) AS flips,
+                 avg((NOT flipped)::int)::float AS agreement
+          FROM pairs GROUP BY sentence, a_sentence_id, b_sentence_id) p
+    LEFT JOIN sentence_metrics sa
+        ON sa.sentence_id = p.a_sentence_id AND sa.oracle_id = %(oracle_id)s
+    LEFT JOIN sentence_metrics sb
+        ON sb.sentence_id = p.b_sentence_id AND sb.oracle_id = %(oracle_id)s
+)
+"""
+
+class DBConnection(StorageBackend):
+    """Persistence layer, can store/retrieve objects to/from a Postgres DB.
+
+    Connections are taken from a thread-safe pool for each operation, so
+    concurrent callers never share a cursor or a transaction."""
 
     def __init__(self):
-        """Connect to database and execute DB setup script."""
+        """Create the connection pool."""
         register_adapter(numpy.float64, AsIs)
         register_adapter(numpy.int64, AsIs)
         self.connect()
@@ -19,198 +101,553 @@ class DBConnection:
     @retry(reraise=True, stop=stop_after_attempt(4),
            wait=wait_exponential(multiplier=1, min=2, max=16))
     def connect(self):
-        """Establish database connection."""
-        self.__connection = psycopg2.connect(dbname=DB_NAME, user=DB_USER,
+        """Establish the database connection pool."""
+        self.__pool = BlockingConnectionPool(DB_POOL_MIN, DB_POOL_MAX,
+                                             dbname=DB_NAME, user=DB_USER,
                                              host=DB_HOST, port=DB_PORT,
                                              password=DB_PW)
 
-    def add_test_sentence(self, test_sentence: TestSentence):
+    def close(self):
+        """Close all pooled connections."""
+        self.__pool.closeall()
+
+    def ping(self) -> bool:
+        """Check whether the database answers a trivial query."""
+        try:
+            with self.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                return cursor.fetchone()[0] == 1
+        except psycopg2.Error:
+            return False
+
+    @contextmanager
+    def connection(self):
+        """Borrow a pooled connection for the duration of a `with` block.
+
+        The transaction is committed if the block completes and rolled
+        back otherwise; the connection is returned to the pool in both
+        cases (and discarded if it was closed in the meantime)."""
+        conn = self.__pool.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self.__pool.putconn(conn, close=bool(conn.closed))
+
+    @contextmanager
+    def cursor(self):
+        """Open a cursor on a pooled connection, see connection()."""
+        with self.connection() as conn:
+            with conn.cursor() as cursor:
+                yield cursor
+
+    @profiled("read_sql")
+    def read_sql(self, query, params=None):
+        """Run a query on a pooled connection and return a dataframe."""
+        with self.connection() as conn:
+            if isinstance(query, sql.Composable):
+                query = query.as_string(conn)
+            return sqlio.read_sql_query(query, conn, params=params)
+
+    def get_table_columns(self, table) -> list[str]:
+        """Return the column names of a streamable table, in order."""
+        if table not in STREAMABLE_TABLES:
+            raise ValueError(f"Table {table} cannot be streamed")
+        with self.cursor() as cursor:
+            cursor.execute("SELECT column_name FROM information_schema.columns "
+                           "WHERE table_schema = current_schema() AND "
+                           "table_name = %s ORDER BY ordinal_position",
+                           (table,))
+            return [row[0] for row in cursor.fetchall()]
+
+    def stream_table(self, table, columns, since_id=0, limit=None,
+                     chunk_size=STREAM_CHUNK_SIZE):
+        """Yield lists of rows with an ID above since_id, in ID order.
+
+        Rows are read in keyset pages of at most chunk_size rows, each on
+        a connection that is returned to the pool before the page is
+        yielded (see keyset_pages()). Callers must validate columns via
+        get_table_columns(); the ID of the last row is the since_id of the
+        next page."""
+        query = sql.SQL("SELECT id, {} FROM {} WHERE id > %s ORDER BY id LIMIT %s"
+                        ).format(sql.SQL(", ").join(map(sql.Identifier, columns)),
+                                 sql.Identifier(table))
+
+        def fetch_page(after_id, size):
+            with self.cursor() as cursor:
+                cursor.execute(query, (after_id, size))
+                return cursor.fetchall()
+        return keyset_pages(fetch_page, since_id, limit, chunk_size)
+
+    def copy_test_data(self, out_file, columns, notes=None, model_names=None,
+                       oracle_id=None):
+        """Write the joined sentences/queries as CSV (with header) to out_file.
+
+        columns is a list of TEST_DATA_COLUMNS keys. notes and model_names
+        optionally restrict the exported test runs. If oracle_id is given,
+        only queries with a verdict by this oracle are exported and the
+        oracle_id/result/verdict columns become available. The data is produced
+        by COPY, i.e. without converting individual rows in Python."""
+        check_test_data_columns(columns, oracle_id)
+        query = sql.SQL("SELECT {} FROM test_sentence ts JOIN test_query tq "
+                        "ON ts.id = tq.sentence_id").format(
+            sql.SQL(", ").join(
+                sql.SQL("{} AS {}").format(sql.SQL(TEST_DATA_COLUMNS[c]),
+                                           sql.Identifier(c))
+                for c in columns))
+        conditions = []
+        if oracle_id is not None:
+            query += sql.SQL(" JOIN oracle_result ores ON tq.id = ores.query_id")
+            conditions.append(sql.SQL("ores.oracle_id = {}").format(
+                sql.Literal(int(oracle_id))))
+        if notes:
+            conditions.append(sql.SQL("ts.note = ANY({})").format(
+                sql.Literal(list(notes))))
+        if model_names:
+            conditions.append(sql.SQL("ts.model_name = ANY({})").format(
+                sql.Literal(list(model_names))))
+        if conditions:
+            query += sql.SQL(" WHERE ") + sql.SQL(" AND ").join(conditions)
+        query += sql.SQL(" ORDER BY tq.id")
+        with self.cursor() as cursor:
+            cursor.copy_expert(
+                sql.SQL("COPY ({}) TO STDOUT WITH (FORMAT csv, HEADER)").format(query),
+                out_file)
+
+    def get_metrics(self, oracle_id, group_by=(), materialized=True):
+        """Compute verdict metrics of an oracle in a single SQL query.
+
+        Returns the confusion matrix (tp/fp/tn/fn), the number of undefined
+        verdicts and of queries, precision, recall, F1 score and the mean
+        consistency per sentence, optionally grouped by any of
+        METRICS_GROUP_COLUMNS. The consistency of a sentence is the ratio of
+        verdicts identical to the verdict for its first query. Only
+        verdicts stored with their normalized response are considered.
+
+        By default, the metrics are aggregated from the sentence_metrics
+        table; set materialized to False to compute them from the verdicts."""
+        check_metrics_groups(group_by)
+        groups = sql.SQL(", ").join(map(sql.Identifier, group_by))
+        query = sql.SQL(
+            "WITH sentences AS ("
+            " SELECT sm.sentence_id, ts.note, ts.model_name, tp, fp, tn, fn,"
+            " undefined, queries, agreement::float / queries AS consistency"
+            " FROM sentence_metrics sm JOIN test_sentence ts"
+            " ON ts.id = sm.sentence_id WHERE sm.oracle_id = %(oracle_id)s"
+        ) if materialized else sql.SQL(
+            "WITH verdicts AS ("
+            " SELECT ts.id AS sentence_id, ts.note, ts.model_name,"
+            " ts.correct_answer_label AS label, ores.verdict,"
+            " first_value(ores.verdict) OVER"
+            " (PARTITION BY ts.id ORDER BY tq.id) AS baseline"
+            " FROM test_sentence ts JOIN test_query tq ON ts.id = tq.sentence_id"
+            " JOIN oracle_result ores ON tq.id = ores.query_id"
+            " WHERE ores.oracle_id = %(oracle_id)s AND ores.verdict IS NOT NULL"
+            "), sentences AS ("
+            " SELECT sentence_id, note, model_name,"
+            " count(*) FILTER (WHERE label = 'true' AND verdict = 'true') AS tp,"
+            " count(*) FILTER (WHERE label = 'false' AND verdict = 'true') AS fp,"
+            " count(*) FILTER (WHERE label = 'false' AND verdict = 'false') AS tn,"
+            " count(*) FILTER (WHERE label = 'true' AND verdict = 'false') AS fn,"
+            " count(*) FILTER (WHERE verdict NOT IN ('true', 'false')) AS undefined,"
+            " count(*) AS queries,"
+            " avg((verdict = baseline)::int) AS consistency"
+            " FROM verdicts GROUP BY sentence_id, note, model_name"
+        )
+        query += sql.SQL(
+            "), totals AS ("
+            " SELECT {select_groups} sum(tp)::int AS tp, sum(fp)::int AS fp,"
+            " sum(tn)::int AS tn, sum(fn)::int AS fn,"
+            " sum(undefined)::int AS undefined, sum(queries)::int AS queries,"
+            " avg(consistency)::float AS consistency"
+            " FROM sentences {group_clause}"
+            "), rates AS ("
+            " SELECT *, coalesce(tp::float / nullif(tp + fp, 0), 0) AS precision,"
+            " coalesce(tp::float / nullif(tp + fn, 0), 0) AS recall"
+            " FROM totals"
+            ") SELECT *, coalesce(2 * precision * recall"
+            " / nullif(precision + recall, 0), 0) AS f1 FROM rates {order_clause}"
+        ).format(
+            select_groups=groups + sql.SQL(",") if group_by else sql.SQL(""),
+            group_clause=sql.SQL("GROUP BY ") + groups if group_by else sql.SQL(""),
+            order_clause=sql.SQL("ORDER BY ") + groups if group_by else sql.SQL(""))
+        return self.read_sql(query, {"oracle_id": oracle_id})
+
+    def compare_runs(self, run_a: dict, run_b: dict, oracle_id, top=20) -> dict:
+        """Compare the verdicts of two test runs inside the database.
+
+        Each run is selected by a dict with values for any of RUN_COLUMNS,
+        e.g. {"note": "llama3.1"}. Queries of both runs are matched by
+        sentence text and prompt (modified_question). Returns a dict of
+        dataframes:
+
+        * `summary`: number of matched sentences and queries, verdict flips
+          (in total, true to false, false to true and from/to other
+          verdicts), regressions (correct in run a only) and fixes (correct
+          in run b only), and the mean consistency of both runs' matched
+          sentences with its delta.
+        * `sentences`: the same per sentence, most flips first.
+        * `diverging_prompts`: the top flipped prompts, regressions first,
+          then by the number of flips of their sentence."""
+        conditions = {}
+        params = {"oracle_id": oracle_id, "top": top}
+        for name, run in (("a", run_a), ("b", run_b)):
+            check_run(name, run)
+            conditions[f"run_{name}"] = sql.SQL(" AND ").join(
+                sql.SQL("ts.{} = {}").format(sql.Identifier(column),
+                                             sql.Placeholder(f"{name}_{column}"))
+                for column, value in run.items() if value)
+            params |= {f"{name}_{column}": value for column, value in run.items()}
+        comparison = sql.SQL(RUN_COMPARISON).format(**conditions)
+        summary = comparison + sql.SQL(
+            ", totals AS ("
+            " SELECT count(*) AS queries,"
+            " count(*) FILTER (WHERE flipped) AS flips,"
+            " count(*) FILTER (WHERE a_verdict = 'true' AND b_verdict = 'false')"
+            " AS true_to_false,"
+            " count(*) FILTER (WHERE a_verdict = 'false' AND b_verdict = 'true')"
+            " AS false_to_true,"
+            " count(*) FILTER (WHERE flipped AND (a_verdict NOT IN ('true', 'false')"
+            " OR b_verdict NOT IN ('true', 'false'))) AS other_flips,"
+            " count(*) FILTER (WHERE a_verdict = label AND b_verdict <> label)"
+            " AS regressions,"
+            " count(*) FILTER (WHERE a_verdict <> label AND b_verdict = label)"
+            " AS fixes"
+            " FROM pairs"
+            ") SELECT s.sentences, t.*, s.a_consistency, s.b_consistency,"
+            " s.b_consistency - s.a_consistency AS consistency_delta"
+            " FROM totals t, (SELECT count(*) AS sentences,"
+            " avg(a_consistency) AS a_consistency,"
+            " avg(b_consistency) AS b_consistency FROM sentences) s")
+        sentences = comparison + sql.SQL(
+            " SELECT *, b_consistency - a_consistency AS consistency_delta"
+            " FROM sentences ORDER BY flips DESC, a_sentence_id")
+        diverging_prompts = comparison + sql.SQL(
+            " SELECT p.a_sentence_id, p.b_sentence_id, p.sentence,"
+            " p.modified_question, p.label, p.a_query_id, p.b_query_id,"
+            " p.a_verdict, p.b_verdict, s.flips AS sentence_flips"
+            " FROM pairs p JOIN sentences s USING (sentence, a_sentence_id,"
+            " b_sentence_id) WHERE p.flipped"
+            " ORDER BY (p.a_verdict = p.label) DESC, s.flips DESC, p.a_query_id"
+            " LIMIT %(top)s")
+        return {"summary": self.read_sql(summary, params),
+                "sentences": self.read_sql(sentences, params),
+                "diverging_prompts": self.read_sql(diverging_prompts, params)}
+
+    def add_test_sentence(self, test_sentence: TestSentence) -> int:
         """Add a TestSentence to the DB and return its ID."""
-        cursor = self.__connection.cursor()
-        cursor.execute("INSERT INTO test_sentence (id, sentence, "
-                       "correct_answer_label, ipm_vector_notation, "
-                       "source_data_name, model_name, ca_file, ipm_file, "
-                       "ipm_description_file, strength, note)"
-                       " VALUES (DEFAULT, %s, %s, %s, %s, %s, %s, %s, %s, %s, "
-                       "%s) RETURNING id", (test_sentence.sentence,
-                                            test_sentence.correct_answer_label,
-                                            test_sentence.ipm_vector_notation,
-                                            test_sentence.source_data_name,
-                                            test_sentence.model_name,
-                                            test_sentence.ca_file,
-                                            test_sentence.ipm_file,
-                                            test_sentence.ipm_description_file,
-                                            test_sentence.strength,
-                                            test_sentence.note))
-        self.__connection.commit()
-        self.__currentRunId = cursor.fetchone()[0]
-        cursor.close()
+        with self.cursor() as cursor:
+            cursor.execute("INSERT INTO test_sentence (id, sentence, "
+                           "correct_answer_label, ipm_vector_notation, "
+                           "source_data_name, model_name, ca_file, ipm_file, "
+                           "ipm_description_file, strength, note, ca_hash, "
+                           "ipm_hash) VALUES (DEFAULT, %s, %s, %s, %s, %s, %s,"
+                           " %s, %s, %s, %s, %s, %s) RETURNING id",
+                           (test_sentence.sentence,
+                            test_sentence.correct_answer_label,
+                            test_sentence.ipm_vector_notation,
+                            test_sentence.source_data_name,
+                            test_sentence.model_name,
+                            test_sentence.ca_file,
+                            test_sentence.ipm_file,
+                            test_sentence.ipm_description_file,
+                            test_sentence.strength,
+                            test_sentence.note,
+                            test_sentence.ca_hash,
+                            test_sentence.ipm_hash))
+            return cursor.fetchone()[0]
+
+    def add_blob(self, blob_hash, compression, size, data) -> bool:
+        """Store a blob unless it exists; return True if it was added."""
+        with self.cursor() as cursor:
+            cursor.execute("INSERT INTO blob (hash, compression, size, data) "
+                           "VALUES (%s, %s, %s, %s) ON CONFLICT (hash) DO NOTHING",
+                           (blob_hash, compression, size, psycopg2.Binary(data)))
+            return cursor.rowcount == 1
+
+    def has_blob(self, blob_hash) -> bool:
+        """Return True if a blob with the given hash is stored."""
+        with self.cursor() as cursor:
+            cursor.execute("SELECT EXISTS(SELECT 1 FROM blob WHERE hash = %s)",
+                           (blob_hash,))
+            return cursor.fetchone()[0]
+
+    def get_blob(self, blob_hash):
+        """Return the compression and (compressed) data of a blob or None."""
+        with self.cursor() as cursor:
+            cursor.execute("SELECT compression, data FROM blob WHERE hash = %s",
+                           (blob_hash,))
+            row = cursor.fetchone()
+            return (row[0], bytes(row[1])) if row else None
 
     def add_test_query(self, test_query: TestQuery):
         """Store a TestQuery."""
-        cursor = self.__connection.cursor()
-        cursor.execute("INSERT into test_query VALUES (%s, DEFAULT, %s, %s)",
-                       (test_query.sentence_id,
-                        test_query.modified_question,
-                        test_query.new_response))
-        self.__connection.commit()
-        cursor.close()
-
-    def add_model_parameter(self, model_parameter: ModelParameter):
-        """Store a ModelParameter."""
-        cursor = self.__connection.cursor()
-        cursor.execute("INSERT into model_parameter VALUES (DEFAULT, %s, %s, %s)",
-                       (model_parameter.sentence_id,
-                        model_parameter.parameter,
-                        model_parameter.value))
-        self.__connection.commit()
-        cursor.close()
+        with self.cursor() as cursor:
+            cursor.execute("INSERT into test_query (sentence_id, "
+                           "modified_question, new_response, wall_time, "
+                           "eval_count, prompt_eval_count, total_duration, "
+                           "cache_hit, trace_id) VALUES (%s, %s, %s, %s, %s, %s,"
+                           " %s, %s, %s)",
+                           (test_query.sentence_id,
+                            test_query.modified_question,
+                            test_query.new_response,
+                            test_query.wall_time,
+                            test_query.eval_count,
+                            test_query.prompt_eval_count,
+                            test_query.total_duration,
+                            test_query.cache_hit,
+                            test_query.trace_id))
+
+    def add_model_parameters(self, model_parameters: list[ModelParameter]):
+        """Store several ModelParameters in a single transaction."""
+        with self.cursor() as cursor:
+            cursor.executemany(
+                "INSERT into model_parameter VALUES (DEFAULT, %s, %s, %s)",
+                [(p.sentence_id, p.parameter, p.value)
+                 for p in model_parameters])
 
     def add_oracle_result(self, oracle_result: OracleResult):
         """Store an OracleResult."""
-        cursor = self.__connection.cursor()
-        cursor.execute("INSERT into oracle_result VALUES (DEFAULT, %s, %s, %s)"
-                       " ON CONFLICT DO NOTHING",
-                       (oracle_result.query_id,
-                        oracle_result.oracle_id,
-                        oracle_result.result))
-        self.__connection.commit()
-        cursor.close()
+        with self.cursor() as cursor:
+            cursor.execute("INSERT into oracle_result (query_id, oracle_id, "
+                           "result, verdict) VALUES (%s, %s, %s, %s)"
+                           " ON CONFLICT DO NOTHING",
+                           (oracle_result.query_id,
+                            oracle_result.oracle_id,
+                            oracle_result.result,
+                            oracle_result.verdict))
+
+    def add_oracle_results(self, oracle_results, chunk_size=COPY_CHUNK_SIZE) -> int:
+        """Store a dataframe of oracle verdicts and return the number added.
+
+        The `query_id`, `oracle_id`, `result` and `verdict` columns are
+        streamed into a temporary staging table using COPY, chunk by chunk,
+        and merged into oracle_result by a single INSERT with the same
+        ON CONFLICT semantics as add_oracle_result()."""
+        columns = oracle_results[["query_id", "oracle_id", "result", "verdict"]]
+        with self.cursor() as cursor:
+            cursor.execute("CREATE TEMP TABLE oracle_result_staging "
+                           "(query_id int, oracle_id int, result text, "
+                           "verdict text) ON COMMIT DROP")
+            for start in range(0, len(columns), chunk_size):
+                buffer = io.StringIO()
+                columns.iloc[start:start + chunk_size].to_csv(
+                    buffer, index=False, header=False)
+                buffer.seek(0)
+                cursor.copy_expert("COPY oracle_result_staging FROM STDIN "
+                                   "WITH (FORMAT csv)", buffer)
+            cursor.execute("INSERT into oracle_result (query_id, oracle_id, "
+                           "result, verdict) SELECT query_id, oracle_id, "
+                           "result, verdict FROM oracle_result_staging "
+                           "ON CONFLICT DO NOTHING")
+            added = cursor.rowcount
+            # Update the aggregates of all sentences that got new verdicts
+            cursor.execute(SENTENCE_METRICS_REFRESH.format(scope=
+                "(tq.sentence_id, ores.oracle_id) IN (SELECT DISTINCT "
+                "q.sentence_id, s.oracle_id FROM oracle_result_staging s "
+                "JOIN test_query q ON q.id = s.query_id)"))
+            return added
+
+    def refresh_sentence_metrics(self, oracle_id):
+        """Recompute the sentence_metrics of an oracle from its verdicts.
+
+        This is only required for verdicts that were not stored through
+        add_oracle_results(), which keeps the aggregates up to date."""
+        with self.cursor() as cursor:
+            cursor.execute(SENTENCE_METRICS_REFRESH.format(
+                scope="ores.oracle_id = %(oracle_id)s"), {"oracle_id": oracle_id})
 
     def add_oracle_description(self, oracle_description: OracleDescription):
         """Store an OracleDescription."""
-        cursor = self.__connection.cursor()
-        cursor.execute("INSERT into oracle_description VALUES (DEFAULT, %s, %s)",
-                       (oracle_description.name, oracle_description.description))
-        self.__connection.commit()
-        cursor.close()
+        with self.cursor() as cursor:
+            cursor.execute("INSERT into oracle_description VALUES (DEFAULT, %s, %s)",
+                           (oracle_description.name, oracle_description.description))
+
+    def register_oracle_description(self, oracle_description: OracleDescription):
+        """Store the OracleDescription of a registered oracle under its own ID.
+
+        An existing description with that ID is kept as it is, but must have
+        the same name; otherwise the ID belongs to another oracle and a
+        RuntimeError is raised. The ID sequence is advanced past the ID, so
+        later add_oracle_description() calls do not collide with it."""
+        with self.cursor() as cursor:
+            cursor.execute("INSERT into oracle_description (id, name, description)"
+                           " VALUES (%s, %s, %s) ON CONFLICT (id) DO NOTHING",
+                           (oracle_description.id, oracle_description.name,
+                            oracle_description.description))
+            cursor.execute("SELECT name FROM oracle_description WHERE id = %s",
+                           (oracle_description.id,))
+            check_registered_name(oracle_description, cursor.fetchone()[0])
+            cursor.execute("SELECT setval(pg_get_serial_sequence("
+                           "'oracle_description', 'id'), "
+                           "(SELECT max(id) FROM oracle_description))")
 
     def get_last_run_id(self) -> int:
         """Return the highest test run ID."""
-        cursor = self.__connection.cursor()
-        cursor.execute("Select max(id) from test_sentence")
-        self.__connection.commit()
-        self.__currentRunId = cursor.fetchone()[0]
-        return self.__currentRunId
+        with self.cursor() as cursor:
+            cursor.execute("Select max(id) from test_sentence")
+            return cursor.fetchone()[0]
 
     def get_test_sentences(self):
         """Retrieve all test sentences."""
-        cursor = self.__connection.cursor()
-        cursor.execute("Select * from test_sentence")
-        self.__connection.commit()
-        return cursor.fetchall()
+        with self.cursor() as cursor:
+            cursor.execute("Select * from test_sentence")
+            return cursor.fetchall()
 
     def get_test_sentences_as_df(self):
         """Retrieve all test sentences as a Pandas dataframe."""
-        return sqlio.read_sql_query("Select * from test_sentence", self.__connection)
+        return self.read_sql("Select * from test_sentence")
 
     def get_oracle_results_as_df(self):
         """Retrieve all oracle results as a Pandas dataframe."""
-        return sqlio.read_sql_query("Select * from oracle_result", self.__connection)
+        return self.read_sql("Select * from oracle_result")
 
     def get_test_queries_as_df(self):
         """Retrieve all test queries as a Pandas dataframe."""
-        return sqlio.read_sql_query(
+        return self.read_sql(
             "Select ts.id as sentence_id, sentence, correct_answer_label,"
             "tq.id as query_id, modified_question, new_response "
-            "from test_sentence ts join test_query tq on ts.id = tq.sentence_id",
-            self.__connection)
+            "from test_sentence ts join test_query tq on ts.id = tq.sentence_id")
 
     def get_oracle_descriptions_as_df(self):
         """Retrieve all oracle descriptions as a Pandas dataframe."""
-        return sqlio.read_sql_query("Select * from oracle_description", self.__connection)
+        return self.read_sql("Select * from oracle_description")
 
     def get_test_queries_by_sentence_id_as_df(self, sentence_id):
         """Retrieve test queries for a given sentence ID as dataframe."""
-        return sqlio.read_sql_query(
+        return self.read_sql(
             "Select ts.id as sentence_id, sentence, correct_answer_label,"
             "tq.id as query_id, modified_question, new_response "
             "from test_sentence ts join test_query tq on ts.id = tq.sentence_id"
-            f" where sentence_id = {sentence_id}", self.__connection)
+            " where sentence_id = %(sentence_id)s",
+            {"sentence_id": sentence_id})
 
     def get_unevaluated_test_queries_by_sentence_id(self, sentence_id, oracle_id):
         """Retrieve test queries without an oracle decision."""
-        return sqlio.read_sql_query(
-            f"Select * from test_query tq where sentence_id = {sentence_id} "
-            f"and not EXISTS(select * from oracle_result ores where "
-            f"tq.id = ores.query_id and ores.id = {oracle_id})",
-            self.__connection)
+        return self.read_sql(
+            "Select * from test_query tq where sentence_id = %(sentence_id)s "
+            "and not EXISTS(select * from oracle_result ores where "
+            "tq.id = ores.query_id and ores.oracle_id = %(oracle_id)s)",
+            {"sentence_id": sentence_id, "oracle_id": oracle_id})
+
+    def get_unevaluated_test_queries(self, oracle_id, since_query_id=0,
+                                     limit=None):
+        """Retrieve test queries without a verdict by an oracle, by query ID.
+
+        Only queries with an ID above since_query_id are returned, at most
+        limit of them, with the columns of get_test_queries_as_df()."""
+        return self.read_sql(
+            "Select ts.id as sentence_id, sentence, correct_answer_label, "
+            "tq.id as query_id, modified_question, new_response "
+            "from test_sentence ts join test_query tq on ts.id = tq.sentence_id "
+            "where tq.id > %(since_query_id)s and not EXISTS(select * from "
+            "oracle_result ores where tq.id = ores.query_id and "
+            "ores.oracle_id = %(oracle_id)s) order by tq.id limit %(limit)s",
+            {"oracle_id": oracle_id, "since_query_id": since_query_id,
+             "limit": limit})
+
+    def get_sentence_metrics(self, oracle_id):
+        """Retrieve the per-sentence aggregates of an oracle's verdicts."""
+        return self.read_sql(
+            "Select ts.note, ts.model_name, sm.* from sentence_metrics sm "
+            "join test_sentence ts on ts.id = sm.sentence_id "
+            "where sm.oracle_id = %(oracle_id)s order by sm.sentence_id",
+            {"oracle_id": oracle_id})
+
+    def get_sentence_cas(self, sentence_ids):
+        """Retrieve the (compressed) CA and IPM blobs of the given sentences."""
+        return self.read_sql(
+            "Select ts.id as sentence_id, ts.strength, "
+            "ca.compression as ca_compression, ca.data as ca_data, "
+            "ipm.compression as ipm_compression, ipm.data as ipm_data "
+            "from test_sentence ts left join blob ca on ca.hash = ts.ca_hash "
+            "left join blob ipm on ipm.hash = ts.ipm_hash "
+            "where ts.id = ANY(%(sentence_ids)s) order by ts.id",
+            {"sentence_ids": list(sentence_ids)})
+
+    def get_sentence_verdicts(self, sentence_ids, oracle_id):
+        """Retrieve an oracle's normalized responses for the given sentences."""
+        return self.read_sql(
+            "Select tq.sentence_id, tq.id as query_id, ores.verdict "
+            "from test_query tq join oracle_result ores on tq.id = ores.query_id "
+            "where tq.sentence_id = ANY(%(sentence_ids)s) and "
+            "ores.oracle_id = %(oracle_id)s and ores.verdict is not null "
+            "order by tq.id",
+            {"sentence_ids": list(sentence_ids), "oracle_id": oracle_id})
 
     def get_model_parameters_by_sentence_id_as_df(self, sentence_id):
         """Retrieve model parameters for a given sentence ID as dataframe."""
-        return sqlio.read_sql_query(
-            f"Select * from model_parameter where sentence_id = {sentence_id}",
-            self.__connection)
+        return self.read_sql(
+            "Select * from model_parameter where sentence_id = %(sentence_id)s",
+            {"sentence_id": sentence_id})
 
     def get_query_count_by_sentence_id(self, sentence_id):
         """Fetch the number of test queries for a sentence ID."""
-        cursor = self.__connection.cursor()
-        cursor.execute(
-            "Select count(*) from test_query where sentence_id = %s",
-            (sentence_id,))
-        self.__connection.commit()  # XXX Probably not needed?
-        return cursor.fetchone()[0]
+        with self.cursor() as cursor:
+            cursor.execute(
+                "Select count(*) from test_query where sentence_id = %s",
+                (sentence_id,))
+            return cursor.fetchone()[0]
 
     def get_filtered_sentence_ids(self, filter_args: dict):
         """Get sentence IDs based on model parameters.
 
         If filter_args is not empty, each key is used in a LIKE
         clause as the parameter name and its associated value is
-        used in a LIKE clause selecting the parameter value.
-
-        This method is vulnerable to SQL injections."""
+        used in a LIKE clause selecting the parameter value."""
         query = "select ts.id from test_sentence ts where"
+        params = []
         for k in filter_args:
-            query += f" exists(select * from model_parameter mp where "
-            query += f"mp.sentence_id = ts.id and parameter like '{k}'"
-            query += f" and value like '{filter_args[k]}') and"
+            query += " exists(select * from model_parameter mp where "
+            query += "mp.sentence_id = ts.id and parameter like %s"
+            query += " and value like %s) and"
+            params += [k, filter_args[k]]
         query = query[:-4]
-        return sqlio.read_sql_query(query, self.__connection)
-
-    def get_connection(self):
-        """Get current database connection."""
-        return self.__connection
+        return self.read_sql(query, params)
 
     def get_complete_data_by_oracle_id(self, oracle_id):
         """Retrieve all verdicts by a specific oracle ID."""
-        return sqlio.read_sql_query(
+        return self.read_sql(
             "Select ts.id as sentence_id, sentence, correct_answer_label, "
             "tq.id as query_id, modified_question, new_response, result "
             "from test_sentence ts join test_query tq on ts.id = tq.sentence_id"
             " join oracle_result ores on tq.id = ores.query_id "
-            f"where ores.oracle_id = {oracle_id}", self.__connection)
+            "where ores.oracle_id = %(oracle_id)s", {"oracle_id": oracle_id})
 
     def get_test_data(self):
         """Retrieve the question/response of a test and the correct answer."""
-        return sqlio.read_sql_query(
+        return self.read_sql(
             "Select ts.id as sentence_id, sentence, correct_answer_label, "
-            "tq.id as query_id, modified_question, new_response, ca_file "
-            "from test_sentence ts join test_query tq on ts.id = tq.sentence_id",
-            self.__connection)
+            "tq.id as query_id, modified_question, new_response, ca_hash "
+            "from test_sentence ts join test_query tq on ts.id = tq.sentence_id")
 
     def get_test_data_until_sentence(self, sentence_id):
         """Retrieve question/response and correct answer up to a sentence ID."""
-        return sqlio.read_sql_query(
+        return self.read_sql(
             "Select ts.id as sentence_id, sentence, correct_answer_label, "
-            "tq.id as query_id, modified_question, new_response, ca_file "
+            "tq.id as query_id, modified_question, new_response, ca_hash "
             "from test_sentence ts join test_query tq on ts.id = tq.sentence_id "
-            f"where ts.id <= {sentence_id}", self.__connection)
+            "where ts.id <= %(sentence_id)s", {"sentence_id": sentence_id})
 
     def get_test_data_by_oracle_id(self, oracle_id):
         """Retrieve all question/responses and correct answers for an oracle."""
-        return sqlio.read_sql_query(
+        return self.read_sql(
             "Select ts.id as sentence_id, sentence, correct_answer_label, "
             "tq.id as query_id, modified_question, new_response "
             "from test_sentence ts join test_query tq on "
             "ts.id = tq.sentence_id join oracle_result ores on "
-            f"tq.id = ores.query_id where ores.oracle_id = {oracle_id}",
-            self.__connection)
+            "tq.id = ores.query_id where ores.oracle_id = %(oracle_id)s",
+            {"oracle_id": oracle_id})
 
     def get_test_data_by_sentence_id(self, sentence_id):
         """Retrieve question/response/correct answers based on a sentence."""
-        return sqlio.read_sql_query(
+        return self.read_sql(
             "Select ts.id as sentence_id, sentence, correct_answer_label, tq.id"
             " as query_id, modified_question, new_response from test_sentence "
             "ts join test_query tq on ts.id = tq.sentence_id join "
             "oracle_result ores on tq.id = ores.query_id "
-            f"where ts.id = {sentence_id}", self.__connection)
+            "where ts.id = %(sentence_id)s", {"sentence_id": sentence_id})
@@ -0,0 +1,87 @@
+"""Versioned, in-place upgrades of the database schema.
+
+The baseline schema is db_scripts/create2.sql. Every later change is a
+script in db_scripts/migrations named `<version>_<description>.sql`.
+Scripts are applied in order of their version, each in its own
+transaction, and recorded in the schema_version table, so existing
+deployments are upgraded in place and every script runs exactly once.
+
+The embedded SQLite backend does not use these scripts; its schema is
+created and upgraded when it is opened (see SQLiteConnection).
+
+After upgrading, the descriptions of the registered oracles are stored
+(see OracleRegistry.sync_descriptions()).
+
+Run `python3 -m persistence.Migrations` to upgrade a database manually."""
+import logging
+from pathlib import Path
+import re
+import sys
+from services.ConfigParser import DB_BACKEND
+
+SCRIPT_DIR = Path(__file__).parent / "db_scripts"
+BASELINE = SCRIPT_DIR / "create2.sql"
+MIGRATION_DIR = SCRIPT_DIR / "migrations"
+# Arbitrary key of the advisory lock that serializes concurrent upgrades
+MIGRATION_LOCK = 7_366_275
+
+def available_migrations() -> list[tuple[int, str, Path]]:
+    """Return (version, name, path) of all migration scripts, in order."""
+    migrations = []
+    for path in MIGRATION_DIR.glob("*.sql"):
+        match = re.fullmatch(r"(\d+)_(.+)", path.stem)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), path))
+    return sorted(migrations)
+
+def migrate(db) -> list[int]:
+    """Bring the schema up to date and return the newly applied versions.
+
+    Concurrent callers (e.g. several starting containers) wait for each
+    other through an advisory lock."""
+    applied = []
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK,))
+        try:
+            cursor.execute(BASELINE.read_text(encoding="utf-8"))
+            cursor.execute("CREATE TABLE IF NOT EXISTS schema_version ("
+                           "version int primary key, name text, "
+                           "applied_at timestamp default CURRENT_TIMESTAMP)")
+            conn.commit()
+            cursor.execute("SELECT version FROM schema_version")
+            installed = {row[0] for row in cursor.fetchall()}
+            for version, name, path in available_migrations():
+                if version in installed:
+                    continue
+                logging.info("Applying schema migration %s (%s)", version, name)
+                cursor.execute(path.read_text(encoding="utf-8"))
+                cursor.execute("INSERT INTO schema_version (version, name) "
+                               "VALUES (%s, %s)", (version, name))
+                conn.commit()
+                applied.append(version)
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK,))
+            conn.commit()
+    return applied
+
+def upgrade_database() -> list[int]:
+    """Apply all pending migrations and store the registered oracles.
+
+    Uses a short-lived connection pool. This is meant to run once before
+    worker processes are started, so no connection is inherited by them."""
+    from services.DatabaseService import open_backend
+    from services.OracleRegistry import sync_descriptions
+    db = open_backend()
+    try:
+        applied = migrate(db) if DB_BACKEND == "postgres" else []
+        sync_descriptions(db)
+        return applied
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+    logging.info("Applied migrations: %s", upgrade_database() or "none")
@@ -0,0 +1,639 @@
+"""Embedded storage backend for single-node runs without a database server.
+
+All data is kept in a single SQLite file (SQLITE_PATH) in WAL mode, so
+several threads and the pre-forked API workers can read while one of
+them writes. The schema is db_scripts/sqlite/schema.sql; it is created
+when the backend is opened. Files created by earlier versions are
+upgraded in place with SCHEMA_UPGRADES, tracked by PRAGMA user_version
+(see upgrade_schema()). sentence_metrics
+is a view there, so the per-sentence aggregates never have to be
+refreshed."""
+from contextlib import contextmanager
+from datetime import date
+from pathlib import Path
+import sqlite3
+import threading
+import numpy
+import pandas as pd
+from entities import TestSentence, TestQuery, ModelParameter, OracleResult, OracleDescription
+from persistence.StorageBackend import *
+from services.ConfigParser import *
+from services.Profiling import profiled
+
+SCHEMA = Path(__file__).parent / "db_scripts" / "sqlite" / "schema.sql"
+# Upgrades of files created by earlier versions: the statements that bring
+# a file from version i (PRAGMA user_version) to version i + 1
+SCHEMA_UPGRADES = [
+    # Per-query timing, token counts and trace IDs, like migration 006
+    [f"ALTER TABLE test_query ADD COLUMN {column}"
+     for column in ("wall_time real", "eval_count integer",
+                    "prompt_eval_count integer", "total_duration integer",
+                    "cache_hit boolean", "trace_id text")],
+]
+SCHEMA_VERSION = len(SCHEMA_UPGRADES)
+# Seconds a writer waits for the lock held by another connection
+BUSY_TIMEOUT = 30
+
+# Matches the verdicts of two runs like DBConnection.RUN_COMPARISON, with
+# row_number() in place of DISTINCT ON
+RUN_COMPARISON = """
+WITH a AS (
+    SELECT sentence_id, sentence, label, query_id, modified_question, verdict
+    FROM (SELECT ts.id AS sentence_id, ts.sentence,
+                 ts.correct_answer_label AS label, tq.id AS query_id,
+                 tq.modified_question, ores.verdict,
+                 row_number() OVER (PARTITION BY ts.sentence, tq.modified_question
+                                    ORDER BY tq.id) AS position
+          FROM test_sentence ts JOIN test_query tq ON ts.id = tq.sentence_id
+          JOIN oracle_result ores ON tq.id = ores.query_id
+          WHERE ores.oracle_id = :oracle_id AND ores.verdict IS NOT NULL
+          AND {run_a})
+    WHERE position = 1
+), b AS (
+    SELECT sentence_id, sentence, query_id, modified_question, verdict
+    FROM (SELECT ts.id AS sentence_id, ts.sentence, tq.id AS query_id,
+                 tq.modified_question, ores.verdict,
+                 row_number() OVER (PARTITION BY ts.sentence, tq.modified_question
+                                    ORDER BY tq.id) AS position
+          FROM test_sentence ts JOIN test_query tq ON ts.id = tq.sentence_id
+          JOIN oracle_result ores ON tq.id = ores.query_id
+          WHERE ores.oracle_id = :oracle_id AND ores.verdict IS NOT NULL
+          AND {run_b})
+    WHERE position = 1
+), pairs AS (
+    SELECT a.sentence, a.modified_question, a.label,
+           a.sentence_id AS a_sentence_id, b.sentence_id AS b_sentence_id,
+           a.query_id AS a_query_id, b.query_id AS b_query_id,
+           a.verdict AS a_verdict, b.verdict AS b_verdict,
+           a.verdict <> b.verdict AS flipped
+    FROM a JOIN b USING (sentence, modified_question)
+), sentences AS (
+    SELECT p.*, CAST(sa.agreement AS REAL) / sa.queries AS a_consistency,
+           CAST(sb.agreement AS REAL) / sb.queries AS b_consistency
+    FROM (SELECT sentence, a_sentence_id, b_sentence_id, count(*) AS queries,
+                 count(*) FILTER (WHERE flipped) AS flips,
+                 avg(NOT flipped) AS agreement
+          FROM pairs GROUP BY sentence, a_sentence_id, b_sentence_id) p
+    LEFT JOIN sentence_metrics sa
+        ON sa.sentence_id = p.a_sentence_id AND sa.oracle_id = :oracle_id
+    LEFT JOIN sentence_metrics sb
+        ON sb.sentence_id = p.b_sentence_id AND sb.oracle_id = :oracle_id
+)
+"""
+
+def quote(identifier) -> str:
+    """Quote an SQL identifier."""
+    return '"' + str(identifier).replace('"', '""') + '"'
+
+def csv_field(value) -> str:
+    """Format a value like COPY ... (FORMAT csv) with quoted strings.
+
+    NULLs are left empty and unquoted, so they stay distinguishable from
+    empty strings."""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return '"' + value.replace('"', '""') + '"'
+    return str(value)
+
+def placeholders(values) -> str:
+    """Return the positional placeholders of an IN list."""
+    return ", ".join("?" * len(values))
+
+
+class SQLiteConnection(StorageBackend):
+    """Persistence layer storing everything in an embedded SQLite file.
+
+    Each thread uses its own connection, so concurrent callers never
+    share a cursor or a transaction."""
+
+    def __init__(self, path=SQLITE_PATH):
+        """Open the database file and create missing tables."""
+        sqlite3.register_adapter(numpy.float64, float)
+        sqlite3.register_adapter(numpy.int64, int)
+        # Return `date` columns as dates, like psycopg2
+        sqlite3.register_converter(
+            "date", lambda value: date.fromisoformat(value.decode()))
+        self.path = str(path)
+        self.__local = threading.local()
+        self.__connections = []
+        self.__lock = threading.Lock()
+        with self.connection() as conn:
+            self.upgrade_schema(conn)
+            conn.executescript(SCHEMA.read_text(encoding="utf-8"))
+
+    def upgrade_schema(self, conn: sqlite3.Connection):
+        """Upgrade the tables of a file created by an earlier version.
+
+        New files are marked as up to date; their tables are created from
+        SCHEMA afterwards. Raises a RuntimeError for files of a newer
+        version. Concurrent callers wait for each other's upgrade."""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version > SCHEMA_VERSION:
+                raise RuntimeError(
+                    f"{self.path} has schema version {version}, but this version "
+                    f"of the store only supports up to {SCHEMA_VERSION}")
+            has_tables = conn.execute(
+                "SELECT count(*) FROM sqlite_master WHERE name = 'test_query'"
+            ).fetchone()[0]
+            if has_tables:
+                for statements in SCHEMA_UPGRADES[version:]:
+                    for statement in statements:
+                        conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def __connect(self) -> sqlite3.Connection:
+        """Return the connection of the calling thread, opening it if needed."""
+        conn = getattr(self.__local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT,
+                                   detect_types=sqlite3.PARSE_DECLTYPES,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA foreign_keys = ON")
+            # LIKE is case-sensitive in Postgres, see get_filtered_sentence_ids()
+            conn.execute("PRAGMA case_sensitive_like = ON")
+            self.__local.conn = conn
+            with self.__lock:
+                self.__connections.append(conn)
+        return conn
+
+    def close(self):
+        """Close the connections of all threads."""
+        with self.__lock:
+            for conn in self.__connections:
+                conn.close()
+            self.__connections.clear()
+        self.__local = threading.local()
+
+    def ping(self) -> bool:
+        """Check whether the database answers a trivial query."""
+        try:
+            with self.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                return cursor.fetchone()[0] == 1
+        except sqlite3.Error:
+            return False
+
+    @contextmanager
+    def connection(self):
+        """Use this thread's connection for the duration of a `with` block.
+
+        The transaction is committed if the block completes and rolled
+        back otherwise."""
+        conn = self.__connect()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    @contextmanager
+    def cursor(self):
+        """Open a cursor on this thread's connection, see connection()."""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    @profiled("read_sql")
+    def read_sql(self, query, params=None):
+        """Run a query on this thread's connection and return a dataframe."""
+        with self.connection() as conn:
+            return pd.read_sql_query(query, conn, params=params)
+
+    def get_table_columns(self, table) -> list[str]:
+        """Return the column names of a streamable table, in order."""
+        if table not in STREAMABLE_TABLES:
+            raise ValueError(f"Table {table} cannot be streamed")
+        with self.cursor() as cursor:
+            cursor.execute(f"PRAGMA table_info({quote(table)})")
+            return [row[1] for row in cursor.fetchall()]
+
+    def stream_table(self, table, columns, since_id=0, limit=None,
+                     chunk_size=STREAM_CHUNK_SIZE):
+        """Yield lists of rows with an ID above since_id, in ID order.
+
+        Rows are read in keyset pages of at most chunk_size rows, each in
+        its own read transaction, so a slow client does not block WAL
+        checkpoints (see keyset_pages()). Callers must validate columns
+        via get_table_columns()."""
+        query = (f"SELECT id, {', '.join(map(quote, columns))} FROM {quote(table)}"
+                 " WHERE id > ? ORDER BY id LIMIT ?")
+
+        def fetch_page(after_id, size):
+            with self.cursor() as cursor:
+                cursor.execute(query, (after_id, size))
+                return cursor.fetchall()
+        return keyset_pages(fetch_page, since_id, limit, chunk_size)
+
+    def copy_test_data(self, out_file, columns, notes=None, model_names=None,
+                       oracle_id=None):
+        """Write the joined sentences/queries as CSV (with header) to out_file.
+
+        Takes the same arguments as DBConnection.copy_test_data() and
+        writes the same CSV dialect, COPY_CHUNK_SIZE rows at a time."""
+        check_test_data_columns(columns, oracle_id)
+        query = (f"SELECT {', '.join(TEST_DATA_COLUMNS[c] for c in columns)} "
+                 "FROM test_sentence ts JOIN test_query tq "
+                 "ON ts.id = tq.sentence_id")
+        conditions, params = [], []
+        if oracle_id is not None:
+            query += " JOIN oracle_result ores ON tq.id = ores.query_id"
+            conditions.append("ores.oracle_id = ?")
+            params.append(int(oracle_id))
+        if notes:
+            conditions.append(f"ts.note IN ({placeholders(notes)})")
+            params += notes
+        if model_names:
+            conditions.append(f"ts.model_name IN ({placeholders(model_names)})")
+            params += model_names
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY tq.id"
+        out_file.write((",".join(columns) + "\n").encode("utf-8"))
+        with self.cursor() as cursor:
+            cursor.execute(query, params)
+            while rows := cursor.fetchmany(COPY_CHUNK_SIZE):
+                out_file.write("".join(
+                    ",".join(map(csv_field, row)) + "\n"
+                    for row in rows).encode("utf-8"))
+
+    def get_metrics(self, oracle_id, group_by=(), materialized=True):
+        """Compute verdict metrics of an oracle in a single SQL query.
+
+        Returns the same columns as DBConnection.get_metrics(). The
+        sentence_metrics view is always computed from the verdicts, so
+        materialized makes no difference."""
+        check_metrics_groups(group_by)
+        groups = ", ".join(map(quote, group_by))
+        query = (
+            "WITH sentences AS ("
+            " SELECT sm.sentence_id, ts.note, ts.model_name, tp, fp, tn, fn,"
+            " undefined, queries, CAST(agreement AS REAL) / queries AS consistency"
+            " FROM sentence_metrics sm JOIN test_sentence ts"
+            " ON ts.id = sm.sentence_id WHERE sm.oracle_id = :oracle_id"
+            "), totals AS ("
+            f" SELECT {groups + ',' if group_by else ''}"
+            " sum(tp) AS tp, sum(fp) AS fp, sum(tn) AS tn, sum(fn) AS fn,"
+            " sum(undefined) AS undefined, sum(queries) AS queries,"
+            " avg(consistency) AS consistency"
+            f" FROM sentences {'GROUP BY ' + groups if group_by else ''}"
+            "), rates AS ("
+            " SELECT *, coalesce(CAST(tp AS REAL) / nullif(tp + fp, 0), 0)"
+            " AS precision,"
+            " coalesce(CAST(tp AS REAL) / nullif(tp + fn, 0), 0) AS recall"
+            " FROM totals"
+            ") SELECT *, coalesce(2 * precision * recall"
+            " / nullif(precision + recall, 0), 0) AS f1 FROM rates"
+            f" {'ORDER BY ' + groups if group_by else ''}")
+        return self.read_sql(query, {"oracle_id": oracle_id})
+
+    def compare_runs(self, run_a: dict, run_b: dict, oracle_id, top=20) -> dict:
+        """Compare the verdicts of two test runs inside the database.
+
+        Returns the same dataframes as DBConnection.compare_runs()."""
+        conditions = {}
+        params = {"oracle_id": oracle_id, "top": -1 if top is None else top}
+        for name, run in (("a", run_a), ("b", run_b)):
+            check_run(name, run)
+            conditions[f"run_{name}"] = " AND ".join(
+                f"ts.{quote(column)} = :{name}_{column}"
+                for column, value in run.items() if value)
+            params |= {f"{name}_{column}": value for column, value in run.items()}
+        comparison = RUN_COMPARISON.format(**conditions)
+        summary = comparison + (
+            ", totals AS ("
+            " SELECT count(*) AS queries,"
+            " count(*) FILTER (WHERE flipped) AS flips,"
+            " count(*) FILTER (WHERE a_verdict = 'true' AND b_verdict = 'false')"
+            " AS true_to_false,"
+            " count(*) FILTER (WHERE a_verdict = 'false' AND b_verdict = 'true')"
+            " AS false_to_true,"
+            " count(*) FILTER (WHERE flipped AND (a_verdict NOT IN ('true', 'false')"
+            " OR b_verdict NOT IN ('true', 'false'))) AS other_flips,"
+            " count(*) FILTER (WHERE a_verdict = label AND b_verdict <> label)"
+            " AS regressions,"
+            " count(*) FILTER (WHERE a_verdict <> label AND b_verdict = label)"
+            " AS fixes"
+            " FROM pairs"
+            ") SELECT s.sentences, t.*, s.a_consistency, s.b_consistency,"
+            " s.b_consistency - s.a_consistency AS consistency_delta"
+            " FROM totals t, (SELECT count(*) AS sentences,"
+            " avg(a_consistency) AS a_consistency,"
+            " avg(b_consistency) AS b_consistency FROM sentences) s")
+        sentences = comparison + (
+            " SELECT *, b_consistency - a_consistency AS consistency_delta"
+            " FROM sentences ORDER BY flips DESC, a_sentence_id")
+        diverging_prompts = comparison + (
+            " SELECT p.a_sentence_id, p.b_sentence_id, p.sentence,"
+            " p.modified_question, p.label, p.a_query_id, p.b_query_id,"
+            " p.a_verdict, p.b_verdict, s.flips AS sentence_flips"
+            " FROM pairs p JOIN sentences s USING (sentence, a_sentence_id,"
+            " b_sentence_id) WHERE p.flipped"
+            " ORDER BY (p.a_verdict = p.label) DESC, s.flips DESC, p.a_query_id"
+            " LIMIT :top")
+        return {"summary": self.read_sql(summary, params),
+                "sentences": self.read_sql(sentences, params),
+                "diverging_prompts": self.read_sql(diverging_prompts, params)}
+
+    def add_test_sentence(self, test_sentence: TestSentence) -> int:
+        """Add a TestSentence to the DB and return its ID."""
+        with self.cursor() as cursor:
+            cursor.execute("INSERT INTO test_sentence (sentence, "
+                           "correct_answer_label, ipm_vector_notation, "
+                           "source_data_name, model_name, ca_file, ipm_file, "
+                           "ipm_description_file, strength, note, ca_hash, "
+                           "ipm_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           (test_sentence.sentence,
+                            test_sentence.correct_answer_label,
+                            test_sentence.ipm_vector_notation,
+                            test_sentence.source_data_name,
+                            test_sentence.model_name,
+                            test_sentence.ca_file,
+                            test_sentence.ipm_file,
+                            test_sentence.ipm_description_file,
+                            test_sentence.strength,
+                            test_sentence.note,
+                            test_sentence.ca_hash,
+                            test_sentence.ipm_hash))
+            return cursor.lastrowid
+
+    def add_blob(self, blob_hash, compression, size, data) -> bool:
+        """Store a blob unless it exists; return True if it was added."""
+        with self.cursor() as cursor:
+            cursor.execute("INSERT INTO blob (hash, compression, size, data) "
+                           "VALUES (?, ?, ?, ?) ON CONFLICT (hash) DO NOTHING",
+                           (blob_hash, compression, size, bytes(data)))
+            return cursor.rowcount == 1
+
+    def has_blob(self, blob_hash) -> bool:
+        """Return True if a blob with the given hash is stored."""
+        with self.cursor() as cursor:
+            cursor.execute("SELECT EXISTS(SELECT 1 FROM blob WHERE hash = ?)",
+                           (blob_hash,))
+            return bool(cursor.fetchone()[0])
+
+    def get_blob(self, blob_hash):
+        """Return the compression and (compressed) data of a blob or None."""
+        with self.cursor() as cursor:
+            cursor.execute("SELECT compression, data FROM blob WHERE hash = ?",
+                           (blob_hash,))
+            row = cursor.fetchone()
+            return (row[0], bytes(row[1])) if row else None
+
+    def add_test_query(self, test_query: TestQuery):
+        """Store a TestQuery."""
+        with self.cursor() as cursor:
+            cursor.execute("INSERT INTO test_query (sentence_id, "
+                           "modified_question, new_response, wall_time, "
+                           "eval_count, prompt_eval_count, total_duration, "
+                           "cache_hit, trace_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           (test_query.sentence_id,
+                            test_query.modified_question,
+                            test_query.new_response,
+                            test_query.wall_time,
+                            test_query.eval_count,
+                            test_query.prompt_eval_count,
+                            test_query.total_duration,
+                            test_query.cache_hit,
+                            test_query.trace_id))
+
+    def add_model_parameters(self, model_parameters: list[ModelParameter]):
+        """Store several ModelParameters in a single transaction."""
+        with self.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO model_parameter (sentence_id, parameter, value) "
+                "VALUES (?, ?, ?)",
+                [(p.sentence_id, p.parameter, p.value)
+                 for p in model_parameters])
+
+    def add_oracle_result(self, oracle_result: OracleResult):
+        """Store an OracleResult."""
+        with self.cursor() as cursor:
+            cursor.execute("INSERT INTO oracle_result (query_id, oracle_id, "
+                           "result, verdict) VALUES (?, ?, ?, ?)"
+                           " ON CONFLICT DO NOTHING",
+                           (oracle_result.query_id,
+                            oracle_result.oracle_id,
+                            oracle_result.result,
+                            oracle_result.verdict))
+
+    def add_oracle_results(self, oracle_results) -> int:
+        """Store a dataframe of oracle verdicts and return the number added.
+
+        The `query_id`, `oracle_id`, `result` and `verdict` columns are
+        inserted in a single transaction with the same ON CONFLICT
+        semantics as add_oracle_result()."""
+        columns = oracle_results[["query_id", "oracle_id", "result", "verdict"]]
+        rows = columns.astype(object).where(columns.notna(), None)
+        with self.connection() as conn:
+            changes = conn.total_changes
+            conn.executemany("INSERT INTO oracle_result (query_id, oracle_id, "
+                             "result, verdict) VALUES (?, ?, ?, ?)"
+                             " ON CONFLICT DO NOTHING",
+                             rows.itertuples(index=False, name=None))
+            return conn.total_changes - changes
+
+    def refresh_sentence_metrics(self, oracle_id):
+        """Do nothing; the sentence_metrics view is always up to date."""
+
+    def add_oracle_description(self, oracle_description: OracleDescription):
+        """Store an OracleDescription."""
+        with self.cursor() as cursor:
+            cursor.execute("INSERT INTO oracle_description (name, description) "
+                           "VALUES (?, ?)",
+                           (oracle_description.name, oracle_description.description))
+
+    def register_oracle_description(self, oracle_description: OracleDescription):
+        """Store the OracleDescription of a registered oracle under its own ID.
+
+        An existing description with that ID is kept as it is, but must have
+        the same name; otherwise the ID belongs to another oracle and a
+        RuntimeError is raised. New IDs are always above the highest ID, so
+        later add_oracle_description() calls do not collide with it."""
+        with self.cursor() as cursor:
+            cursor.execute("INSERT INTO oracle_description (id, name, description)"
+                           " VALUES (?, ?, ?) ON CONFLICT (id) DO NOTHING",
+                           (oracle_description.id, oracle_description.name,
+                            oracle_description.description))
+            cursor.execute("SELECT name FROM oracle_description WHERE id = ?",
+                           (oracle_description.id,))
+            check_registered_name(oracle_description, cursor.fetchone()[0])
+
+    def get_last_run_id(self) -> int:
+        """Return the highest test run ID."""
+        with self.cursor() as cursor:
+            cursor.execute("Select max(id) from test_sentence")
+            return cursor.fetchone()[0]
+
+    def get_test_sentences(self):
+        """Retrieve all test sentences."""
+        with self.cursor() as cursor:
+            cursor.execute("Select * from test_sentence")
+            return cursor.fetchall()
+
+    def get_test_sentences_as_df(self):
+        """Retrieve all test sentences as a Pandas dataframe."""
+        return self.read_sql("Select * from test_sentence")
+
+    def get_oracle_results_as_df(self):
+        """Retrieve all oracle results as a Pandas dataframe."""
+        return self.read_sql("Select * from oracle_result")
+
+    def get_test_queries_as_df(self):
+        """Retrieve all test queries as a Pandas dataframe."""
+        return self.read_sql(
+            "Select ts.id as sentence_id, sentence, correct_answer_label,"
+            "tq.id as query_id, modified_question, new_response "
+            "from test_sentence ts join test_query tq on ts.id = tq.sentence_id")
+
+    def get_oracle_descriptions_as_df(self):
+        """Retrieve all oracle descriptions as a Pandas dataframe."""
+        return self.read_sql("Select * from oracle_description")
+
+    def get_test_queries_by_sentence_id_as_df(self, sentence_id):
+        """Retrieve test queries for a given sentence ID as dataframe."""
+        return self.read_sql(
+            "Select ts.id as sentence_id, sentence, correct_answer_label,"
+            "tq.id as query_id, modified_question, new_response "
+            "from test_sentence ts join test_query tq on ts.id = tq.sentence_id"
+            " where sentence_id = :sentence_id",
+            {"sentence_id": sentence_id})
+
+    def get_unevaluated_test_queries_by_sentence_id(self, sentence_id, oracle_id):
+        """Retrieve test queries without an oracle decision."""
+        return self.read_sql(
+            "Select * from test_query tq where sentence_id = :sentence_id "
+            "and not EXISTS(select * from oracle_result ores where "
+            "tq.id = ores.query_id and ores.oracle_id = :oracle_id)",
+            {"sentence_id": sentence_id, "oracle_id": oracle_id})
+
+    def get_unevaluated_test_queries(self, oracle_id, since_query_id=0,
+                                     limit=None):
+        """Retrieve test queries without a verdict by an oracle, by query ID.
+
+        Only queries with an ID above since_query_id are returned, at most
+        limit of them, with the columns of get_test_queries_as_df()."""
+        return self.read_sql(
+            "Select ts.id as sentence_id, sentence, correct_answer_label, "
+            "tq.id as query_id, modified_question, new_response "
+            "from test_sentence ts join test_query tq on ts.id = tq.sentence_id "
+            "where tq.id > :since_query_id and not EXISTS(select * from "
+            "oracle_result ores where tq.id = ores.query_id and "
+            "ores.oracle_id = :oracle_id) order by tq.id limit :limit",
+            {"oracle_id": oracle_id, "since_query_id": since_query_id,
+             "limit": -1 if limit is None else limit})
+
+    def get_sentence_metrics(self, oracle_id):
+        """Retrieve the per-sentence aggregates of an oracle's verdicts."""
+        return self.read_sql(
+            "Select ts.note, ts.model_name, sm.* from sentence_metrics sm "
+            "join test_sentence ts on ts.id = sm.sentence_id "
+            "where sm.oracle_id = :oracle_id order by sm.sentence_id",
+            {"oracle_id": oracle_id})
+
+    def get_sentence_cas(self, sentence_ids):
+        """Retrieve the (compressed) CA and IPM blobs of the given sentences."""
+        sentence_ids = list(sentence_ids)
+        return self.read_sql(
+            "Select ts.id as sentence_id, ts.strength, "
+            "ca.compression as ca_compression, ca.data as ca_data, "
+            "ipm.compression as ipm_compression, ipm.data as ipm_data "
+            "from test_sentence ts left join blob ca on ca.hash = ts.ca_hash "
+            "left join blob ipm on ipm.hash = ts.ipm_hash "
+            f"where ts.id in ({placeholders(sentence_ids)}) order by ts.id",
+            sentence_ids)
+
+    def get_sentence_verdicts(self, sentence_ids, oracle_id):
+        """Retrieve an oracle's normalized responses for the given sentences."""
+        sentence_ids = list(sentence_ids)
+        return self.read_sql(
+            "Select tq.sentence_id, tq.id as query_id, ores.verdict "
+            "from test_query tq join oracle_result ores on tq.id = ores.query_id "
+            f"where tq.sentence_id in ({placeholders(sentence_ids)}) and "
+            "ores.oracle_id = ? and ores.verdict is not null order by tq.id",
+            sentence_ids + [oracle_id])
+
+    def get_model_parameters_by_sentence_id_as_df(self, sentence_id):
+        """Retrieve model parameters for a given sentence ID as dataframe."""
+        return self.read_sql(
+            "Select * from model_parameter where sentence_id = :sentence_id",
+            {"sentence_id": sentence_id})
+
+    def get_query_count_by_sentence_id(self, sentence_id):
+        """Fetch the number of test queries for a sentence ID."""
+        with self.cursor() as cursor:
+            cursor.execute(
+                "Select count(*) from test_query where sentence_id = ?",
+                (sentence_id,))
+            return cursor.fetchone()[0]
+
+    def get_filtered_sentence_ids(self, filter_args: dict):
+        """Get sentence IDs based on model parameters.
+
+        If filter_args is not empty, each key is used in a LIKE
+        clause as the parameter name and its associated value is
+        used in a LIKE clause selecting the parameter value."""
+        query = "select ts.id from test_sentence ts where"
+        params = []
+        for k in filter_args:
+            query += " exists(select * from model_parameter mp where "
+            query += "mp.sentence_id = ts.id and parameter like ?"
+            query += " and value like ?) and"
+            params += [k, filter_args[k]]
+        query = query[:-4]
+        return self.read_sql(query, params)
+
+    def get_complete_data_by_oracle_id(self, oracle_id):
+        """Retrieve all verdicts by a specific oracle ID."""
+        return self.read_sql(
+            "Select ts.id as sentence_id, sentence, correct_answer_label, "
+            "tq.id as query_id, modified_question, new_response, result "
+            "from test_sentence ts join test_query tq on ts.id = tq.sentence_id"
+            " join oracle_result ores on tq.id = ores.query_id "
+            "where ores.oracle_id = :oracle_id", {"oracle_id": oracle_id})
+
+    def get_test_data(self):
+        """Retrieve the question/response of a test and the correct answer."""
+        return self.read_sql(
+            "Select ts.id as sentence_id, sentence, correct_answer_label, "
+            "tq.id as query_id, modified_question, new_response, ca_hash "
+            "from test_sentence ts join test_query tq on ts.id = tq.sentence_id")
+
+    def get_test_data_until_sentence(self, sentence_id):
+        """Retrieve question/response and correct answer up to a sentence ID."""
+        return self.read_sql(
+            "Select ts.id as sentence_id, sentence, correct_answer_label, "
+            "tq.id as query_id, modified_question, new_response, ca_hash "
+            "from test_sentence ts join test_query tq on ts.id = tq.sentence_id "
+            "where ts.id <= :sentence_id", {"sentence_id": sentence_id})
+
+    def get_test_data_by_oracle_id(self, oracle_id):
+        """Retrieve all question/responses and correct answers for an oracle."""
+        return self.read_sql(
+            "Select ts.id as sentence_id, sentence, correct_answer_label, "
+            "tq.id as query_id, modified_question, new_response "
+            "from test_sentence ts join test_query tq on "
+            "ts.id = tq.sentence_id join oracle_result ores on "
+            "tq.id = ores.query_id where ores.oracle_id = :oracle_id",
+            {"oracle_id": oracle_id})
+
+    def get_test_data_by_sentence_id(self, sentence_id):
+        """Retrieve question/response/correct answers based on a sentence."""
+        return self.read_sql(
+            "Select ts.id as sentence_id, sentence, correct_answer_label, tq.id"
+            " as query_id, modified_question, new_response from test_sentence "
+            "ts join test_query tq on ts.id = tq.sentence_id join "
+            "oracle_result ores on tq.id = ores.query_id "
+            "where ts.id = :sentence_id", {"sentence_id": sentence_id})
@@ -0,0 +1,277 @@
+"""Interface of the storage backends behind DatabaseService.
+
+DBConnection stores the results in Postgres, SQLiteConnection in a
+single embedded database file for single-node runs without a database
+server. DatabaseService.get_db() selects one of them by the DB_BACKEND
+setting."""
+from abc import ABC, abstractmethod
+from entities import TestSentence, TestQuery, ModelParameter, OracleResult, OracleDescription
+
+# Tables that can be streamed with stream_table(); all have an `id` column
+STREAMABLE_TABLES = frozenset(["test_sentence", "test_query", "oracle_result",
+                               "oracle_description", "model_parameter"])
+
+# Columns of the sentence/query/verdict join exported by copy_test_data()
+TEST_DATA_COLUMNS = {
+    "sentence_id": "ts.id",
+    "sentence": "ts.sentence",
+    "date": "ts.date",
+    "correct_answer_label": "ts.correct_answer_label",
+    "model_name": "ts.model_name",
+    "note": "ts.note",
+    "strength": "ts.strength",
+    "query_id": "tq.id",
+    "modified_question": "tq.modified_question",
+    "new_response": "tq.new_response",
+    "wall_time": "tq.wall_time",
+    "eval_count": "tq.eval_count",
+    "prompt_eval_count": "tq.prompt_eval_count",
+    "total_duration": "tq.total_duration",
+    "cache_hit": "tq.cache_hit",
+    "trace_id": "tq.trace_id",
+    "oracle_id": "ores.oracle_id",
+    "result": "ores.result",
+    "verdict": "ores.verdict",
+}
+ORACLE_COLUMNS = frozenset(["oracle_id", "result", "verdict"])
+# Columns metrics can be grouped by, see get_metrics()
+METRICS_GROUP_COLUMNS = ("note", "model_name", "sentence_id")
+# Columns a compared run can be selected by, see compare_runs()
+RUN_COLUMNS = ("note", "model_name")
+
+def check_test_data_columns(columns, oracle_id):
+    """Validate the columns requested from copy_test_data()."""
+    unknown = set(columns) - set(TEST_DATA_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(sorted(unknown))}")
+    if oracle_id is None and ORACLE_COLUMNS & set(columns):
+        raise ValueError("Verdict columns require an oracle ID")
+
+def check_metrics_groups(group_by):
+    """Validate the columns get_metrics() groups by."""
+    invalid = set(group_by) - set(METRICS_GROUP_COLUMNS)
+    if invalid:
+        raise ValueError(f"Cannot group by {', '.join(sorted(invalid))}")
+
+def check_run(name, run: dict):
+    """Validate the selection of a run compared by compare_runs()."""
+    invalid = set(run) - set(RUN_COLUMNS)
+    if invalid:
+        raise ValueError(f"Cannot select runs by {', '.join(sorted(invalid))}")
+    if not any(run.values()):
+        raise ValueError(f"Run {name} requires a {' or '.join(RUN_COLUMNS)}")
+
+def keyset_pages(fetch_page, since_id, limit, page_size):
+    """Yield lists of at most page_size rows with an ID above since_id.
+
+    fetch_page(since_id, size) returns the next page of at most size
+    rows, each with its ID prepended, which is removed from the yielded
+    rows. Each page is read in its own short transaction, so no
+    connection or snapshot is held while a slow client consumes a page."""
+    while limit is None or limit > 0:
+        size = page_size if limit is None else min(page_size, limit)
+        rows = fetch_page(since_id, size)
+        if not rows:
+            return
+        since_id = rows[-1][0]
+        if limit is not None:
+            limit -= len(rows)
+        yield [row[1:] for row in rows]
+        if len(rows) < size:
+            return
+
+def check_registered_name(oracle_description: OracleDescription, stored_name):
+    """Check that the stored description of a registered oracle is its own."""
+    if stored_name != oracle_description.name:
+        raise RuntimeError(
+            f"oracle_description {oracle_description.id} is {stored_name!r}, "
+            f"not the registered oracle {oracle_description.name!r}; "
+            "register the oracle under an unused ID")
+
+
+class StorageBackend(ABC):
+    """Stores and retrieves test sentences, queries, verdicts and blobs.
+
+    All methods must be safe to call from several threads at once; a
+    backend that does not implement all abstract methods cannot be
+    instantiated."""
+
+    @abstractmethod
+    def close(self):
+        """Release all connections of the backend."""
+
+    @abstractmethod
+    def ping(self) -> bool:
+        """Check whether the database answers a trivial query."""
+
+    @abstractmethod
+    def connection(self):
+        """Context manager lending a DB-API connection for one transaction."""
+
+    @abstractmethod
+    def cursor(self):
+        """Context manager opening a cursor on a connection()."""
+
+    @abstractmethod
+    def read_sql(self, query, params=None):
+        """Run a query and return a dataframe."""
+
+    @abstractmethod
+    def get_table_columns(self, table) -> list[str]:
+        """Return the column names of a streamable table, in order."""
+
+    @abstractmethod
+    def stream_table(self, table, columns, since_id=0, limit=None):
+        """Yield lists of rows with an ID above since_id, in ID order."""
+
+    @abstractmethod
+    def copy_test_data(self, out_file, columns, notes=None, model_names=None,
+                       oracle_id=None):
+        """Write the joined sentences/queries as CSV (with header) to out_file.
+
+        Unquoted empty fields are NULLs, quoted ones are empty strings
+        (see ArrowConverter.read_csv_batches())."""
+
+    @abstractmethod
+    def get_metrics(self, oracle_id, group_by=(), materialized=True):
+        """Compute the verdict metrics of an oracle, optionally grouped."""
+
+    @abstractmethod
+    def compare_runs(self, run_a: dict, run_b: dict, oracle_id, top=20) -> dict:
+        """Compare the verdicts of two test runs."""
+
+    @abstractmethod
+    def add_test_sentence(self, test_sentence: TestSentence) -> int:
+        """Add a TestSentence and return its ID."""
+
+    @abstractmethod
+    def add_blob(self, blob_hash, compression, size, data) -> bool:
+        """Store a blob unless it exists; return True if it was added."""
+
+    @abstractmethod
+    def has_blob(self, blob_hash) -> bool:
+        """Return True if a blob with the given hash is stored."""
+
+    @abstractmethod
+    def get_blob(self, blob_hash):
+        """Return the compression and (compressed) data of a blob or None."""
+
+    @abstractmethod
+    def add_test_query(self, test_query: TestQuery):
+        """Store a TestQuery."""
+
+    def add_model_parameter(self, model_parameter: ModelParameter):
+        """Store a ModelParameter."""
+        self.add_model_parameters([model_parameter])
+
+    @abstractmethod
+    def add_model_parameters(self, model_parameters: list[ModelParameter]):
+        """Store several ModelParameters in a single transaction."""
+
+    @abstractmethod
+    def add_oracle_result(self, oracle_result: OracleResult):
+        """Store an OracleResult unless the query already has a verdict."""
+
+    @abstractmethod
+    def add_oracle_results(self, oracle_results) -> int:
+        """Store a dataframe of oracle verdicts and return the number added."""
+
+    @abstractmethod
+    def refresh_sentence_metrics(self, oracle_id):
+        """Recompute the sentence_metrics of an oracle from its verdicts."""
+
+    @abstractmethod
+    def add_oracle_description(self, oracle_description: OracleDescription):
+        """Store an OracleDescription."""
+
+    @abstractmethod
+    def register_oracle_description(self, oracle_description: OracleDescription):
+        """Store the OracleDescription of a registered oracle under its own ID.
+
+        Keeps an existing description with that ID if it has the same name,
+        else raises a RuntimeError (see check_registered_name())."""
+
+    @abstractmethod
+    def get_last_run_id(self) -> int:
+        """Return the highest test run ID."""
+
+    @abstractmethod
+    def get_test_sentences(self):
+        """Retrieve all test sentences."""
+
+    @abstractmethod
+    def get_test_sentences_as_df(self):
+        """Retrieve all test sentences as a Pandas dataframe."""
+
+    @abstractmethod
+    def get_oracle_results_as_df(self):
+        """Retrieve all oracle results as a Pandas dataframe."""
+
+    @abstractmethod
+    def get_test_queries_as_df(self):
+        """Retrieve all test queries as a Pandas dataframe."""
+
+    @abstractmethod
+    def get_oracle_descriptions_as_df(self):
+        """Retrieve all oracle descriptions as a Pandas dataframe."""
+
+    @abstractmethod
+    def get_test_queries_by_sentence_id_as_df(self, sentence_id):
+        """Retrieve test queries for a given sentence ID as dataframe."""
+
+    @abstractmethod
+    def get_unevaluated_test_queries_by_sentence_id(self, sentence_id, oracle_id):
+        """Retrieve test queries without an oracle decision."""
+
+    @abstractmethod
+    def get_unevaluated_test_queries(self, oracle_id, since_query_id=0,
+                                     limit=None):
+        """Retrieve test queries without a verdict by an oracle, by query ID."""
+
+    @abstractmethod
+    def get_sentence_metrics(self, oracle_id):
+        """Retrieve the per-sentence aggregates of an oracle's verdicts."""
+
+    @abstractmethod
+    def get_sentence_cas(self, sentence_ids):
+        """Retrieve the (compressed) CA and IPM blobs of the given sentences."""
+
+    @abstractmethod
+    def get_sentence_verdicts(self, sentence_ids, oracle_id):
+        """Retrieve an oracle's normalized responses for the given sentences."""
+
+    @abstractmethod
+    def get_model_parameters_by_sentence_id_as_df(self, sentence_id):
+        """Retrieve model parameters for a given sentence ID as dataframe."""
+
+    @abstractmethod
+    def get_query_count_by_sentence_id(self, sentence_id):
+        """Fetch the number of test queries for a sentence ID."""
+
+    @abstractmethod
+    def get_filtered_sentence_ids(self, filter_args: dict):
+        """Get sentence IDs based on model parameters (LIKE patterns)."""
+
+    def get_connection(self):
+        """Borrow a database connection, see connection()."""
+        return self.connection()
+
+    @abstractmethod
+    def get_complete_data_by_oracle_id(self, oracle_id):
+        """Retrieve all verdicts by a specific oracle ID."""
+
+    @abstractmethod
+    def get_test_data(self):
+        """Retrieve the question/response of a test and the correct answer."""
+
+    @abstractmethod
+    def get_test_data_until_sentence(self, sentence_id):
+        """Retrieve question/response and correct answer up to a sentence ID."""
+
+    @abstractmethod
+    def get_test_data_by_oracle_id(self, oracle_id):
+        """Retrieve all question/responses and correct answers for an oracle."""
+
+    @abstractmethod
+    def get_test_data_by_sentence_id(self, sentence_id):
+        """Retrieve question/response/correct answers based on a sentence."""
@@ -1,3 +1,5 @@
+-- Baseline schema. Later changes are versioned scripts in migrations/,
+-- see persistence/Migrations.py.
 create table if not exists test_sentence
 (
     id                        SERIAL primary key,
@@ -0,0 +1,27 @@
+-- Oracle verdicts were never deduplicated because the serial id is part of
+-- the primary key. Keep the earliest verdict per query and oracle, then
+-- enforce uniqueness so that ON CONFLICT DO NOTHING skips repeated verdicts.
+DELETE FROM oracle_result WHERE id IN (
+    SELECT id FROM (
+        SELECT id, row_number() OVER (PARTITION BY query_id, oracle_id
+                                      ORDER BY id) AS duplicate
+        FROM oracle_result
+    ) ranked WHERE duplicate > 1
+);
+
+ALTER TABLE oracle_result
+    ADD CONSTRAINT oracle_result_query_id_oracle_id_key UNIQUE (query_id, oracle_id);
+
+-- Verdicts by oracle, e.g. get_complete_data_by_oracle_id()
+CREATE INDEX IF NOT EXISTS oracle_result_oracle_id_query_id_idx
+    ON oracle_result (oracle_id, query_id);
+
+-- Filtering test runs by model and note
+CREATE INDEX IF NOT EXISTS test_sentence_model_name_note_idx
+    ON test_sentence (model_name, note);
+
+-- get_filtered_sentence_ids() and lookups of a sentence's parameters
+CREATE INDEX IF NOT EXISTS model_parameter_parameter_value_idx
+    ON model_parameter (parameter, value);
+CREATE INDEX IF NOT EXISTS model_parameter_sentence_id_idx
+    ON model_parameter (sentence_id);
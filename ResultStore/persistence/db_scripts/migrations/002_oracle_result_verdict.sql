@@ -0,0 +1,5 @@
+-- Besides whether a response was correct (result), store the normalized
+-- response the oracle derived from it (verdict, e.g. 'true', 'false' or
+-- 'undefined'), so that confusion matrices and consistency can be computed
+-- inside the database.
+ALTER TABLE oracle_result ADD COLUMN IF NOT EXISTS verdict text;
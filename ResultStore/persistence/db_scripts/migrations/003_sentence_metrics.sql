@@ -0,0 +1,43 @@
+-- Per-sentence, per-oracle aggregates of the verdicts, maintained whenever
+-- verdicts are stored (see DBConnection.add_oracle_results()). The baseline
+-- is the verdict for the first query of a sentence; agreement counts the
+-- verdicts identical to it.
+CREATE TABLE IF NOT EXISTS sentence_metrics
+(
+    sentence_id       int REFERENCES test_sentence (id),
+    oracle_id         int REFERENCES oracle_description (id),
+    tp                int,
+    fp                int,
+    tn                int,
+    fn                int,
+    undefined         int,
+    queries           int,
+    baseline_query_id int,
+    baseline_verdict  text,
+    agreement         int,
+    primary key (sentence_id, oracle_id)
+);
+
+-- Backfill the aggregates of all existing verdicts
+INSERT INTO sentence_metrics
+SELECT sentence_id, oracle_id,
+       count(*) FILTER (WHERE label = 'true' AND verdict = 'true'),
+       count(*) FILTER (WHERE label = 'false' AND verdict = 'true'),
+       count(*) FILTER (WHERE label = 'false' AND verdict = 'false'),
+       count(*) FILTER (WHERE label = 'true' AND verdict = 'false'),
+       count(*) FILTER (WHERE verdict NOT IN ('true', 'false')),
+       count(*),
+       baseline_query_id, baseline_verdict,
+       count(*) FILTER (WHERE verdict = baseline_verdict)
+FROM (
+    SELECT tq.sentence_id, ores.oracle_id, ts.correct_answer_label AS label,
+           ores.verdict,
+           first_value(tq.id) OVER w AS baseline_query_id,
+           first_value(ores.verdict) OVER w AS baseline_verdict
+    FROM test_sentence ts JOIN test_query tq ON ts.id = tq.sentence_id
+    JOIN oracle_result ores ON tq.id = ores.query_id
+    WHERE ores.verdict IS NOT NULL
+    WINDOW w AS (PARTITION BY tq.sentence_id, ores.oracle_id ORDER BY tq.id)
+) verdicts
+GROUP BY sentence_id, oracle_id, baseline_query_id, baseline_verdict
+ON CONFLICT DO NOTHING;
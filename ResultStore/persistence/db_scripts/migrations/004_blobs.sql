@@ -0,0 +1,34 @@
+-- Content-addressed storage for CAs and IPMs. Sentences with the same
+-- cardinalities (or the same sentence tested with several models) share
+-- one blob instead of storing identical copies inline.
+CREATE TABLE IF NOT EXISTS blob
+(
+    hash        text primary key,  -- Hex SHA-256 of the uncompressed content
+    compression text    not null,  -- 'zlib' or 'none'
+    size        integer not null,  -- Uncompressed size in bytes
+    data        bytea   not null
+);
+
+ALTER TABLE test_sentence
+    ADD COLUMN IF NOT EXISTS ca_hash text REFERENCES blob (hash),
+    ADD COLUMN IF NOT EXISTS ipm_hash text REFERENCES blob (hash);
+
+-- Move existing inline contents into (uncompressed) blobs
+INSERT INTO blob (hash, compression, size, data)
+SELECT encode(sha256(content), 'hex'), 'none', length(content), content
+FROM (SELECT convert_to(ca_file, 'UTF8') AS content FROM test_sentence
+      WHERE ca_file <> ''
+      UNION
+      SELECT convert_to(ipm_file, 'UTF8') FROM test_sentence
+      WHERE ipm_file <> '') contents
+ON CONFLICT (hash) DO NOTHING;
+
+UPDATE test_sentence
+SET ca_hash = encode(sha256(convert_to(ca_file, 'UTF8')), 'hex'),
+    ca_file = NULL
+WHERE ca_file <> '';
+
+UPDATE test_sentence
+SET ipm_hash = encode(sha256(convert_to(ipm_file, 'UTF8')), 'hex'),
+    ipm_file = NULL
+WHERE ipm_file <> '';
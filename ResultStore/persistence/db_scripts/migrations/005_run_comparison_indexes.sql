@@ -0,0 +1,9 @@
+-- Comparing two runs (see DBConnection.compare_runs()) selects each run by
+-- note and/or model name and matches queries by sentence text and prompt.
+-- Hash indexes have no size limit for long prompts.
+CREATE INDEX IF NOT EXISTS test_sentence_note_idx
+    ON test_sentence (note);
+CREATE INDEX IF NOT EXISTS test_sentence_sentence_hash_idx
+    ON test_sentence USING hash (sentence);
+CREATE INDEX IF NOT EXISTS test_query_modified_question_hash_idx
+    ON test_query USING hash (modified_question);
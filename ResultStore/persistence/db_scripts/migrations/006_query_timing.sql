@@ -0,0 +1,13 @@
+-- Timing and token accounting of each query as reported by the executor:
+-- wall_time is the executor's time for the query (seconds), eval_count and
+-- prompt_eval_count are the generated and prompt tokens and total_duration
+-- the LLM's own processing time (nanoseconds, as reported by Ollama).
+-- cache_hit marks responses from the executor's response cache; trace_id
+-- correlates the query with the runner, executor and store logs.
+ALTER TABLE test_query
+    ADD COLUMN IF NOT EXISTS wall_time double precision,
+    ADD COLUMN IF NOT EXISTS eval_count integer,
+    ADD COLUMN IF NOT EXISTS prompt_eval_count integer,
+    ADD COLUMN IF NOT EXISTS total_duration bigint,
+    ADD COLUMN IF NOT EXISTS cache_hit boolean,
+    ADD COLUMN IF NOT EXISTS trace_id text;
@@ -0,0 +1,116 @@
+-- Schema of the embedded SQLite backend (see persistence/SQLiteConnection.py).
+-- It mirrors create2.sql with all migrations applied; keep both in sync.
+-- Changes to existing tables also need an entry in SCHEMA_UPGRADES, which
+-- upgrades files created by earlier versions.
+create table if not exists blob
+(
+    hash        text primary key,  -- Hex SHA-256 of the uncompressed content
+    compression text    not null,  -- 'zlib' or 'none'
+    size        integer not null,  -- Uncompressed size in bytes
+    data        blob    not null
+);
+
+create table if not exists test_sentence
+(
+    id                        integer primary key,
+    sentence                  text,
+    date                      date default CURRENT_DATE,
+    correct_answer_label      text,
+    ipm_vector_notation       text,
+    source_data_name          text,
+    model_name                text,
+    ca_file                   text,
+    ipm_file                  text,
+    ipm_description_file      text,
+    strength                  integer,
+    note                      text,
+    ca_hash                   text references blob (hash),
+    ipm_hash                  text references blob (hash)
+);
+
+create table if not exists test_query
+(
+    sentence_id       integer references test_sentence (id),
+    id                integer primary key,
+    modified_question text,
+    new_response      text,
+    wall_time         real,
+    eval_count        integer,
+    prompt_eval_count integer,
+    total_duration    integer,
+    cache_hit         boolean,
+    trace_id          text
+);
+
+create table if not exists oracle_description
+(
+    id          integer primary key,
+    name        text,
+    description text
+);
+
+insert or ignore into oracle_description (id, name, description) values (
+       1,
+       'Default Oracle',
+       'Simple heuristic conversion to boolean'
+);
+
+create table if not exists oracle_result
+(
+    id          integer primary key,
+    query_id    integer references test_query (id),
+    oracle_id   integer references oracle_description (id),
+    result      text,
+    verdict     text,
+    unique (query_id, oracle_id)
+);
+
+create table if not exists model_parameter
+(
+    id          integer primary key,
+    sentence_id integer references test_sentence (id),
+    parameter   text,
+    value       text
+);
+
+create index if not exists test_query_sentence_id_idx
+    on test_query (sentence_id);
+create index if not exists oracle_result_oracle_id_query_id_idx
+    on oracle_result (oracle_id, query_id);
+create index if not exists test_sentence_model_name_note_idx
+    on test_sentence (model_name, note);
+create index if not exists test_sentence_note_idx
+    on test_sentence (note);
+create index if not exists test_sentence_sentence_idx
+    on test_sentence (sentence);
+create index if not exists test_query_modified_question_idx
+    on test_query (modified_question);
+create index if not exists model_parameter_parameter_value_idx
+    on model_parameter (parameter, value);
+create index if not exists model_parameter_sentence_id_idx
+    on model_parameter (sentence_id);
+
+-- Per-sentence, per-oracle aggregates of the verdicts, like the
+-- sentence_metrics table of the Postgres schema. An embedded database is
+-- small enough to compute them on demand instead of maintaining a table.
+create view if not exists sentence_metrics as
+select sentence_id, oracle_id,
+       count(*) filter (where label = 'true' and verdict = 'true') as tp,
+       count(*) filter (where label = 'false' and verdict = 'true') as fp,
+       count(*) filter (where label = 'false' and verdict = 'false') as tn,
+       count(*) filter (where label = 'true' and verdict = 'false') as fn,
+       count(*) filter (where verdict not in ('true', 'false')) as undefined,
+       count(*) as queries,
+       baseline_query_id, baseline_verdict,
+       count(*) filter (where verdict = baseline_verdict) as agreement
+from (
+    select tq.sentence_id, ores.oracle_id, ts.correct_answer_label as label,
+           ores.verdict,
+           first_value(tq.id) over w as baseline_query_id,
+           first_value(ores.verdict) over w as baseline_verdict
+    from test_sentence ts join test_query tq on ts.id = tq.sentence_id
+    join oracle_result ores on tq.id = ores.query_id
+    where ores.verdict is not null
+    window w as (partition by tq.sentence_id, ores.oracle_id order by tq.id)
+) verdicts
+group by sentence_id, oracle_id, baseline_query_id, baseline_verdict;
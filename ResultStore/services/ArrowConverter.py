@@ -0,0 +1,58 @@
+"""Convert CSV exports of the test data to columnar Arrow/Parquet files."""
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+# Arrow types of the exported columns; all others are strings
+COLUMN_TYPES = {
+    "sentence_id": pa.int32(),
+    "query_id": pa.int32(),
+    "oracle_id": pa.int32(),
+    "strength": pa.int32(),
+    "date": pa.date32(),
+    "wall_time": pa.float64(),
+    "eval_count": pa.int32(),
+    "prompt_eval_count": pa.int32(),
+    "total_duration": pa.int64(),
+    "cache_hit": pa.bool_(),
+}
+FORMATS = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+def check_format(return_format):
+    """Raise a ValueError unless return_format is one of FORMATS."""
+    if return_format not in FORMATS:
+        raise ValueError(f"Format must be one of {', '.join(FORMATS)}")
+
+def read_csv_batches(csv_file, columns):
+    """Open a streaming reader over a CSV file as written by COPY.
+
+    Unquoted empty fields are NULLs, quoted ones are empty strings.
+    Booleans may be written as t/f (Postgres) or 1/0 (SQLite)."""
+    return pacsv.open_csv(
+        csv_file,
+        parse_options=pacsv.ParseOptions(newlines_in_values=True),
+        convert_options=pacsv.ConvertOptions(
+            column_types={c: COLUMN_TYPES.get(c, pa.string()) for c in columns},
+            true_values=["t", "true", "1"],
+            false_values=["f", "false", "0"],
+            strings_can_be_null=True,
+            quoted_strings_can_be_null=False))
+
+def convert(csv_file, out_file, columns, return_format="arrow"):
+    """Convert a CSV file to an Arrow IPC stream or a Parquet file.
+
+    The CSV file is processed batch by batch, so only a single record
+    batch is held in memory at a time."""
+    check_format(return_format)
+    reader = read_csv_batches(csv_file, columns)
+    if return_format == "parquet":
+        writer = pq.ParquetWriter(out_file, reader.schema)
+    else:
+        writer = ipc.new_stream(out_file, reader.schema)
+    with writer:
+        for batch in reader:
+            writer.write_batch(batch)
@@ -0,0 +1,25 @@
+"""Hashing and compression of content-addressed blobs (CAs and IPMs).
+
+Blobs are addressed by the hex SHA-256 of their uncompressed content and
+stored zlib-compressed. Clients may upload blobs compressed with zlib
+(HTTP `Content-Encoding: deflate`), which are stored as they are."""
+import hashlib
+import zlib
+
+COMPRESSIONS = ("zlib", "none")
+
+def content_hash(content: bytes) -> str:
+    """Return the address of a blob."""
+    return hashlib.sha256(content).hexdigest()
+
+def compress(content: bytes) -> bytes:
+    """Compress the content of a blob for storage."""
+    return zlib.compress(content)
+
+def decompress(data: bytes, compression: str) -> bytes:
+    """Restore the content of a stored blob."""
+    if compression == "zlib":
+        return zlib.decompress(data)
+    if compression == "none":
+        return bytes(data)
+    raise ValueError(f"Unknown blob compression {compression}")
@@ -1,9 +1,26 @@
 """Load configuration from environment variables."""
-from os import getenv
+from os import cpu_count, getenv
 
+# "postgres" or "sqlite" (embedded single-file database at SQLITE_PATH)
+DB_BACKEND = getenv("DB_BACKEND", "postgres")
+SQLITE_PATH = getenv("SQLITE_PATH", "result_store.sqlite3")
 DB_HOST = getenv("DB_HOST", "localhost")
 DB_NAME = getenv("DB_NAME", "ai_testing")
 DB_USER = getenv("DB_USER", "postgres")
 DB_PW = getenv("DB_PW", "postgres")
 SERVICE_PORT = int(getenv("SERVICE_PORT", "8080"))
 DB_PORT = int(getenv("DB_PORT", "5432"))
+STORE_WORKERS = int(getenv("STORE_WORKERS", str(cpu_count() or 1)))
+STORE_THREADS = int(getenv("STORE_THREADS", "4"))
+DB_POOL_MIN = int(getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(getenv("DB_POOL_MAX", str(STORE_THREADS)))
+COPY_CHUNK_SIZE = int(getenv("COPY_CHUNK_SIZE", "100000"))
+STREAM_CHUNK_SIZE = int(getenv("STREAM_CHUNK_SIZE", "5000"))
+EVALUATION_BATCH_SIZE = int(getenv("EVALUATION_BATCH_SIZE", "100000"))
+ORACLE_WORKERS = int(getenv("ORACLE_WORKERS", str(cpu_count() or 1)))
+ORACLE_CHUNK_SIZE = int(getenv("ORACLE_CHUNK_SIZE", "10000"))
+# Opt-in profiling, see services/Profiling.py
+PROFILE_MODE = getenv("PROFILE_MODE", "").lower()
+PROFILE_DIR = getenv("PROFILE_DIR", "profiles")
+PROFILE_DUMP_INTERVAL = float(getenv("PROFILE_DUMP_INTERVAL", "60"))
+PROFILE_SAMPLE_INTERVAL = float(getenv("PROFILE_SAMPLE_INTERVAL", "0.01"))
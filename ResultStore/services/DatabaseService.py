@@ -1,62 +1,208 @@
 """Simple wrapper around a database connection."""
-import persistence.DBConnection as DBConnection
+import os
+import tempfile
+import threading
+import pyarrow.ipc as ipc
+import persistence.StorageBackend as StorageBackend
 from entities import TestSentence
-
-db = DBConnection.DBConnection()
-
+from services import ArrowConverter, BlobCodec, Instrumentation
+from services.ConfigParser import DB_BACKEND
+
+_db = None
+_db_pid = None
+_db_lock = threading.Lock()
+
+def open_backend(backend=DB_BACKEND) -> StorageBackend.StorageBackend:
+    """Open the storage backend selected by DB_BACKEND."""
+    if backend == "postgres":
+        from persistence.DBConnection import DBConnection
+        return DBConnection()
+    if backend == "sqlite":
+        from persistence.SQLiteConnection import SQLiteConnection
+        return SQLiteConnection()
+    raise ValueError(f"Unknown storage backend {backend}")
+
+def get_db() -> StorageBackend.StorageBackend:
+    """Return this process's storage backend, creating it on first use.
+
+    The backend (e.g. its connection pool) is created lazily, and again
+    after a fork, so that importing this module has no side effects and
+    every worker process of a pre-forking server owns its connections."""
+    global _db, _db_pid
+    with _db_lock:
+        if _db is None or _db_pid != os.getpid():
+            _db = open_backend()
+            _db_pid = os.getpid()
+        return _db
+
+def check_health() -> bool:
+    """Return True if the database is reachable."""
+    return get_db().ping()
+
+@Instrumentation.timed("save_test_query")
 def save_test_query(test_query):
-    db.add_test_query(test_query)
-
-def save_test_sentence(test_sentence: TestSentence):
-    db.add_test_sentence(test_sentence)
-
+    get_db().add_test_query(test_query)
+
+@Instrumentation.timed("save_test_sentence")
+def save_test_sentence(test_sentence: TestSentence) -> int:
+    """Store a test sentence; inline CA/IPM contents are moved to blobs."""
+    if test_sentence.ca_file:
+        test_sentence.ca_hash = save_blob(test_sentence.ca_file.encode("utf-8"))
+    if test_sentence.ipm_file:
+        test_sentence.ipm_hash = save_blob(test_sentence.ipm_file.encode("utf-8"))
+    test_sentence.ca_file = test_sentence.ipm_file = None
+    return get_db().add_test_sentence(test_sentence)
+
+@Instrumentation.timed("save_blob")
+def save_blob(content: bytes) -> str:
+    """Store a blob compressed (unless it exists) and return its hash."""
+    blob_hash = BlobCodec.content_hash(content)
+    found = get_db().has_blob(blob_hash)
+    Instrumentation.count_blob_lookup(found)
+    if not found:
+        get_db().add_blob(blob_hash, "zlib", len(content),
+                          BlobCodec.compress(content))
+    return blob_hash
+
+@Instrumentation.timed("save_compressed_blob")
+def save_compressed_blob(blob_hash, data: bytes, compression="zlib") -> bool:
+    """Store an already compressed blob; return True if it was added.
+
+    Raises a ValueError if the content does not match blob_hash."""
+    content = BlobCodec.decompress(data, compression)
+    if BlobCodec.content_hash(content) != blob_hash:
+        raise ValueError("Blob content does not match its hash")
+    return get_db().add_blob(blob_hash, compression, len(content), data)
+
+def has_blob(blob_hash) -> bool:
+    return get_db().has_blob(blob_hash)
+
+def get_blob(blob_hash):
+    return get_db().get_blob(blob_hash)
+
+@Instrumentation.timed("save_model_parameters")
 def save_model_parameters(model_parameter):
-    db.add_model_parameter(model_parameter)
+    get_db().add_model_parameter(model_parameter)
+
+@Instrumentation.timed("save_model_parameter_list")
+def save_model_parameter_list(model_parameters):
+    get_db().add_model_parameters(model_parameters)
 
+@Instrumentation.timed("save_oracle_result")
 def save_oracle_result(oracle_result):
-    db.add_oracle_result(oracle_result)
+    get_db().add_oracle_result(oracle_result)
+
+@Instrumentation.timed("save_oracle_results")
+def save_oracle_results(oracle_results) -> int:
+    return get_db().add_oracle_results(oracle_results)
 
+@Instrumentation.timed("save_oracle_description")
 def save_oracle_description(oracle_description):
-    db.add_oracle_description(oracle_description)
+    get_db().add_oracle_description(oracle_description)
 
 def get_current_run_id():
-    return db.get_last_run_id()
+    return get_db().get_last_run_id()
 
 def get_test_sentences():
-    return db.get_test_sentences_as_df()
+    return get_db().get_test_sentences_as_df()
 
 def get_oracle_results():
-    return db.get_oracle_results_as_df()
+    return get_db().get_oracle_results_as_df()
 
 def get_oracle_descriptions():
-    return db.get_oracle_descriptions_as_df()
+    return get_db().get_oracle_descriptions_as_df()
 
 def get_test_queries_by_sentence_id(sentence_id):
-    return db.get_test_queries_by_sentence_id_as_df(sentence_id)
+    return get_db().get_test_queries_by_sentence_id_as_df(sentence_id)
 
 def get_test_queries():
-    return db.get_test_queries_as_df()
+    return get_db().get_test_queries_as_df()
 
 def get_unevaluated_test_queries_by_sentence_id(sentence_id, oracle_id):
-    return db.get_unevaluated_test_queries_by_sentence_id(sentence_id, oracle_id)
+    return get_db().get_unevaluated_test_queries_by_sentence_id(sentence_id, oracle_id)
 
 def get_model_parameters(sentence_id):
-    return db.get_model_parameters_by_sentence_id_as_df(sentence_id)
+    return get_db().get_model_parameters_by_sentence_id_as_df(sentence_id)
 
 def get_filtered_sentence_ids(filter_args):
     if filter_args:
-        return db.get_filtered_sentence_ids(filter_args)
+        return get_db().get_filtered_sentence_ids(filter_args)
     else:
-        return db.get_test_sentences_as_df()
+        return get_db().get_test_sentences_as_df()
 
 def get_complete_data_by_oracle_id(oracle_id):
-    return db.get_complete_data_by_oracle_id(oracle_id)
+    return get_db().get_complete_data_by_oracle_id(oracle_id)
 
 def get_test_data():
-    return db.get_test_data()
+    return get_db().get_test_data()
 
 def get_test_data_by_oracle_id(oracle_id):
-    return db.get_test_data_by_oracle_id(oracle_id)
+    return get_db().get_test_data_by_oracle_id(oracle_id)
 
 def get_test_data_by_sentence_id(sentence_id):
-    return db.get_test_data_by_sentence_id(sentence_id)
+    return get_db().get_test_data_by_sentence_id(sentence_id)
+
+@Instrumentation.timed("get_metrics")
+def get_metrics(oracle_id=1, group_by=(), materialized=True):
+    return get_db().get_metrics(oracle_id, list(group_by), materialized)
+
+@Instrumentation.timed("compare_runs")
+def compare_runs(run_a, run_b, oracle_id=1, top=20):
+    return get_db().compare_runs(run_a, run_b, oracle_id, top)
+
+def get_sentence_metrics(oracle_id=1):
+    return get_db().get_sentence_metrics(oracle_id)
+
+def get_sentence_cas(sentence_ids):
+    """Retrieve the decompressed CA and IPM (ca_file, ipm_file) of sentences."""
+    blobs = get_db().get_sentence_cas(sentence_ids)
+    for name in ("ca", "ipm"):
+        blobs[f"{name}_file"] = [
+            BlobCodec.decompress(data, compression).decode("utf-8")
+            if compression else ""
+            for compression, data in zip(blobs.pop(f"{name}_compression"),
+                                         blobs.pop(f"{name}_data"))]
+    return blobs
+
+def get_sentence_verdicts(sentence_ids, oracle_id=1):
+    return get_db().get_sentence_verdicts(sentence_ids, oracle_id)
+
+def refresh_sentence_metrics(oracle_id=1):
+    get_db().refresh_sentence_metrics(oracle_id)
+
+def get_unevaluated_test_queries(oracle_id, since_query_id=0, limit=None):
+    return get_db().get_unevaluated_test_queries(oracle_id, since_query_id, limit)
+
+def get_table_columns(table):
+    return get_db().get_table_columns(table)
+
+def stream_table(table, columns, since_id=0, limit=None):
+    return get_db().stream_table(table, columns, since_id, limit)
+
+@Instrumentation.timed("export_test_data")
+def export_test_data(out_file, return_format="arrow", columns=None, notes=None,
+                     model_names=None, oracle_id=None):
+    """Write the joined sentences/queries/verdicts to a binary file object.
+
+    The data is written as Arrow IPC stream or Parquet file (see
+    ArrowConverter.FORMATS). Columns default to all columns (of the
+    verdict table only if oracle_id is given); notes and model_names
+    are optional lists of test runs to include. An unknown return_format
+    raises a ValueError before any data is read."""
+    ArrowConverter.check_format(return_format)
+    if not columns:
+        columns = [c for c in StorageBackend.TEST_DATA_COLUMNS
+                   if oracle_id is not None or c not in StorageBackend.ORACLE_COLUMNS]
+    with tempfile.TemporaryFile() as csv_file:
+        get_db().copy_test_data(csv_file, columns, notes, model_names, oracle_id)
+        csv_file.seek(0)
+        ArrowConverter.convert(csv_file, out_file, columns, return_format)
+
+def get_test_data_columnar(columns=None, notes=None, model_names=None,
+                           oracle_id=None):
+    """Load the joined test data via the Arrow export as a dataframe."""
+    with tempfile.TemporaryFile() as arrow_file:
+        export_test_data(arrow_file, "arrow", columns, notes, model_names,
+                         oracle_id)
+        arrow_file.seek(0)
+        return ipc.open_stream(arrow_file).read_pandas()
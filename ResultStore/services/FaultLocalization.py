@@ -0,0 +1,159 @@
+"""Localize the synonym substitutions that change a LLM's response.
+
+The consistency of a sentence only tells how often its mutated queries
+received a different verdict than the unmodified one. The CA of the
+sentence additionally tells which synonyms each query used: the n-th
+column of the CA selects a synonym for the n-th token of the IPM, and
+each CA row (except for all-zero rows) is one query, following the
+unmodified baseline query (see consume_payload_from_ca() in the meta
+runner).
+
+localize_faults() joins the CA with the verdicts of a sentence and
+scores every t-way combination of synonyms by the ratio of queries
+containing it whose verdict deviates from the baseline verdict. The
+combinations are counted with np.bincount() over mixed-radix codes
+instead of per-combination Python loops, so t=3 CAs with thousands of
+rows stay cheap."""
+from itertools import combinations
+import json
+import numpy as np
+import pandas as pd
+
+# Upper bound for the number of codes computed in one counting pass
+CODES_PER_PASS = 1 << 20
+
+def parse_ca(ca_file: str) -> np.ndarray:
+    """Parse a headerless CSV CA into an integer matrix (one row per test).
+
+    Lines without a comma are ignored, like CaGenerator.read() does."""
+    rows = [line.strip().split(",") for line in ca_file.splitlines()
+            if "," in line]
+    return np.array(rows, dtype=np.int64).reshape(len(rows), -1)
+
+def query_matrix(ca: np.ndarray) -> np.ndarray:
+    """Return the synonym choices of a sentence's queries, in query order.
+
+    The first query is the unmodified sentence (all zeros), followed by
+    all rows of the CA that are not all-zero."""
+    baseline = np.zeros((1, ca.shape[1]), dtype=ca.dtype)
+    return np.vstack([baseline, ca[ca.any(axis=1)]])
+
+def count_interactions(matrix: np.ndarray, deviations: np.ndarray,
+                       strength: int = 2):
+    """Count queries and deviations per t-way combination of CA values.
+
+    Only columns with more than one value are combined. Within each
+    combination of columns, the values are encoded as a mixed-radix
+    number, and each combination gets its own block of codes, so one
+    bincount per pass counts many combinations at once.
+
+    Returns the combinations of columns (one row each) and two arrays
+    with the number of queries and deviations per combination (rows)
+    and value code (columns)."""
+    varying = np.flatnonzero(matrix.max(axis=0) > matrix.min(axis=0))
+    strength = min(strength, len(varying))
+    column_sets = np.array(list(combinations(varying, strength)),
+                           dtype=np.int64).reshape(-1, strength)
+    radix = int(matrix.max()) + 1
+    block = radix ** strength
+    weights = radix ** np.arange(strength - 1, -1, -1)
+    queries = np.zeros((len(column_sets), block), dtype=np.int64)
+    deviating = np.zeros((len(column_sets), block), dtype=np.int64)
+    tokens = np.ascontiguousarray(matrix.T, dtype=np.int32)
+    step = max(1, CODES_PER_PASS // max(1, len(matrix)))
+    for start in range(0, len(column_sets), step):
+        chunk = column_sets[start:start + step]
+        codes = np.zeros((len(chunk), len(matrix)), dtype=np.int32)
+        for position, weight in enumerate(weights):
+            codes += tokens[chunk[:, position]] * weight
+        codes += (np.arange(len(chunk), dtype=np.int32) * block)[:, None]
+        queries[start:start + len(chunk)] = np.bincount(
+            codes.ravel(), minlength=len(chunk) * block).reshape(-1, block)
+        deviating[start:start + len(chunk)] = np.bincount(
+            codes[:, deviations].ravel(),
+            minlength=len(chunk) * block).reshape(-1, block)
+    return column_sets, queries, deviating
+
+def localize_faults(ca_file: str, ipm_file: str, verdicts,
+                    strength: int = 2, min_queries: int = 1,
+                    top: int = None) -> pd.DataFrame:
+    """Rank the synonym combinations of a sentence by deviating verdicts.
+
+    verdicts are the normalized responses (see
+    OracleService.apply_oracle()) of the sentence's queries in the order
+    of their IDs; the first one is the baseline. ipm_file is the JSON
+    list of synonyms per token stored with the sentence.
+
+    Returns the combinations that substitute at least one token and are
+    used by at least min_queries queries, with their `tokens` (original
+    words), `synonyms`, CA `columns` and `values`, number of `queries`
+    and `deviations` and the `deviation_rate`, highest rate first."""
+    verdicts = np.asarray(verdicts)
+    matrix = query_matrix(parse_ca(ca_file))
+    if len(matrix) != len(verdicts):
+        raise ValueError(f"CA describes {len(matrix)} queries, but "
+                         f"{len(verdicts)} verdicts were given")
+    synonyms = json.loads(ipm_file)
+    if len(synonyms) != matrix.shape[1]:
+        raise ValueError(f"CA has {matrix.shape[1]} columns, but the IPM "
+                         f"has {len(synonyms)} tokens")
+    column_sets, queries, deviating = count_interactions(
+        matrix, verdicts != verdicts[0], strength)
+    queries[:, 0] = 0  # Value code 0 keeps all tokens of a combination
+    set_index, value_code = np.nonzero(queries >= max(1, min_queries))
+    query_counts = queries[set_index, value_code]
+    deviation_counts = deviating[set_index, value_code]
+    rates = deviation_counts / query_counts
+    order = np.lexsort((-deviation_counts, -rates))[:top]
+    columns = column_sets[set_index[order]]
+    radix = int(matrix.max()) + 1
+    values = value_code[order, None] // radix ** np.arange(
+        columns.shape[1] - 1, -1, -1) % radix
+    return pd.DataFrame({
+        "tokens": [tuple(synonyms[c][0] for c in row) for row in columns.tolist()],
+        "synonyms": [tuple(synonyms[c][v].replace("_", " ")
+                           for c, v in zip(row, value_row))
+                     for row, value_row in zip(columns.tolist(), values.tolist())],
+        "columns": list(map(tuple, columns.tolist())),
+        "values": list(map(tuple, values.tolist())),
+        "queries": query_counts[order],
+        "deviations": deviation_counts[order],
+        "deviation_rate": rates[order],
+    })
+
+def localize_sentence_faults(sentences, verdicts, strength: int = None,
+                             min_queries: int = 1,
+                             top: int = None) -> tuple[pd.DataFrame, dict]:
+    """Apply localize_faults() to many sentences.
+
+    sentences requires the `sentence_id`, `strength`, `ca_file` and
+    `ipm_file` columns, verdicts the `sentence_id`, `query_id` and
+    `verdict` columns. Combinations have the strength of each sentence's
+    CA unless strength is given. Returns the concatenated rankings with
+    an additional `sentence_id` column, and the reasons for skipping
+    sentences by their IDs: sentences without a CA, IPM or verdicts, and
+    sentences whose verdicts do not match their CA, e.g. because queries
+    failed or the sentence is still being tested."""
+    verdicts = verdicts.sort_values("query_id")
+    by_sentence = dict(tuple(verdicts.groupby("sentence_id")["verdict"]))
+    rankings = []
+    skipped = {}
+    for sentence in sentences.itertuples():
+        if not (sentence.ca_file and sentence.ipm_file):
+            skipped[sentence.sentence_id] = "no CA or IPM stored"
+            continue
+        if sentence.sentence_id not in by_sentence:
+            skipped[sentence.sentence_id] = "no verdicts"
+            continue
+        try:
+            ranking = localize_faults(sentence.ca_file, sentence.ipm_file,
+                                      by_sentence[sentence.sentence_id],
+                                      strength or sentence.strength,
+                                      min_queries, top)
+        except ValueError as e:
+            skipped[sentence.sentence_id] = str(e)
+            continue
+        rankings.append(ranking.assign(sentence_id=sentence.sentence_id))
+    if not rankings:
+        return pd.DataFrame(), skipped
+    return pd.concat(rankings, ignore_index=True), skipped
@@ -0,0 +1,76 @@
+"""Prometheus metrics of the storage API, served at /metrics.
+
+instrument() counts and times every HTTP request per endpoint, timed()
+measures the latency of database operations in DatabaseService.
+
+Gunicorn serves the API from several worker processes. If the
+PROMETHEUS_MULTIPROC_DIR environment variable is set (gunicorn.conf.py
+sets it), each worker writes its metrics to files in this folder and
+/metrics aggregates the files of all workers."""
+from functools import wraps
+import os
+import time
+from flask import Flask, request
+from kommkonllm_common import flask_metrics
+from prometheus_client import (REGISTRY, CollectorRegistry, Counter, Gauge,
+                               Histogram, generate_latest)
+from prometheus_client import multiprocess
+
+REQUESTS = Counter("store_requests_total",
+                   "HTTP requests by endpoint, method and status",
+                   ["endpoint", "method", "status"])
+REQUEST_LATENCY = Histogram("store_request_duration_seconds",
+                            "HTTP request latency by endpoint and method",
+                            ["endpoint", "method"])
+IN_FLIGHT = Gauge("store_requests_in_flight", "HTTP requests being processed",
+                  ["endpoint"], multiprocess_mode="livesum")
+DB_LATENCY = Histogram("store_db_operation_duration_seconds",
+                       "Latency of database operations by operation",
+                       ["operation"],
+                       buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                                0.25, 0.5, 1, 2.5, 5, 10, 30, float("inf")))
+DB_ERRORS = Counter("store_db_operation_errors_total",
+                    "Failed database operations by operation", ["operation"])
+BLOB_LOOKUPS = Counter("store_blob_lookups_total",
+                       "Blob lookups before uploads by result (hit: already stored)",
+                       ["result"])
+
+def timed(operation: str):
+    """Decorate a database operation to record its latency and errors."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            except Exception:
+                DB_ERRORS.labels(operation).inc()
+                raise
+            finally:
+                DB_LATENCY.labels(operation).observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def count_blob_lookup(found: bool):
+    """Count a check whether a blob is stored already."""
+    BLOB_LOOKUPS.labels("hit" if found else "miss").inc()
+
+def endpoint_label() -> str:
+    """Return the URL rule of the current request, e.g. `/blob/<blob_hash>`."""
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+def collect() -> bytes:
+    """Return the metrics of all worker processes in the text format."""
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+def instrument(app: Flask):
+    """Record metrics of all requests to app and add the /metrics endpoint."""
+    flask_metrics.instrument_requests(
+        app, REQUESTS, REQUEST_LATENCY, IN_FLIGHT,
+        labels=lambda: (endpoint_label(), request.method),
+        in_flight_labels=lambda: (endpoint_label(),))
+    flask_metrics.add_metrics_endpoint(app, collect)
@@ -0,0 +1,65 @@
+"""Confusion-matrix based metrics of oracle verdicts.
+
+compute_metrics() calculates the confusion matrix, precision, recall,
+F1 score and consistency of a dataframe with verdicts in one vectorized
+pass, optionally per group. DatabaseService.get_metrics() runs the same
+aggregation as a single SQL query inside the database."""
+import pandas as pd
+
+GROUP_COLUMNS = ("note", "model_name", "sentence_id")
+COUNT_COLUMNS = ["tp", "fp", "tn", "fn", "undefined", "queries"]
+
+def add_rates(metrics):
+    """Add precision, recall and F1 score columns based on the counts.
+
+    Rates whose denominator is zero are 0, like get_precision() and
+    friends in OracleService."""
+    tp = metrics["tp"]
+    metrics["precision"] = (tp / (tp + metrics["fp"])).fillna(0.0)
+    metrics["recall"] = (tp / (tp + metrics["fn"])).fillna(0.0)
+    precision_recall = metrics["precision"] + metrics["recall"]
+    metrics["f1"] = (2 * metrics["precision"] * metrics["recall"]
+                     / precision_recall).fillna(0.0)
+    return metrics
+
+def compute_metrics(test_data, group_by=None):
+    """Compute verdict metrics of a dataframe, optionally per group.
+
+    test_data requires the `sentence_id`, `query_id`,
+    `correct_answer_label` and `result` (normalized LLM response, see
+    OracleService.apply_oracle()) columns as well as the columns in
+    group_by, a list of GROUP_COLUMNS.
+
+    Returns one row per group with the confusion matrix (tp/fp/tn/fn),
+    the number of undefined responses and of queries, precision, recall,
+    F1 score and consistency. Like OracleService.get_consistency(), the
+    consistency of a group is the mean of its sentences' consistencies,
+    i.e. of the ratios of responses identical to a sentence's first one."""
+    group_by = list(group_by or [])
+    invalid = set(group_by) - set(GROUP_COLUMNS)
+    if invalid:
+        raise ValueError(f"Cannot group by {', '.join(sorted(invalid))}")
+    label = test_data["correct_answer_label"]
+    result = test_data["result"]
+    positive, negative = result == "true", result == "false"
+    baseline = (test_data.sort_values("query_id")
+                .groupby("sentence_id")["result"].transform("first"))
+    counts = pd.DataFrame({
+        "tp": (label == "true") & positive,
+        "fp": (label == "false") & positive,
+        "tn": (label == "false") & negative,
+        "fn": (label == "true") & negative,
+        "undefined": ~(positive | negative),
+        "queries": True,
+        "agreement": result == baseline.reindex(test_data.index),
+    }).astype(int)
+    keys = [c for c in group_by if c != "sentence_id"] + ["sentence_id"]
+    sentences = counts.groupby([test_data[c] for c in keys]).sum()
+    sentences["consistency"] = sentences.pop("agreement") / sentences["queries"]
+    aggregations = dict.fromkeys(COUNT_COLUMNS, "sum") | {"consistency": "mean"}
+    if group_by:
+        metrics = sentences.groupby(level=group_by).agg(aggregations)
+    else:
+        metrics = sentences.agg(aggregations).to_frame().T
+        metrics[COUNT_COLUMNS] = metrics[COUNT_COLUMNS].astype(int)
+    return add_rates(metrics)
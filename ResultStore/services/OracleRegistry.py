@@ -0,0 +1,132 @@
+"""Registry of oracles, keyed by their ID in the oracle_description table.
+
+An oracle is a function that takes a dataframe of test queries (with the
+columns of DatabaseService.get_test_queries()) and returns a Series of
+normalized responses ("true", "false" or "undefined") with the same
+index. Oracles must be defined at module level, so that they can be
+executed in worker processes. To add an oracle, register it:
+
+    @register_oracle(3, "My Oracle", "What my oracle does")
+    def my_oracle_function(test_data):
+        ...
+
+run_oracle() evaluates queries in chunks in a process pool and streams
+the verdicts into the bulk verdict writer as chunks complete. The
+descriptions of registered oracles are stored when the store starts."""
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import multiprocessing
+from dataclasses import dataclass
+from typing import Callable
+from entities import OracleDescription
+from services import DatabaseService, OracleService
+from services.ConfigParser import (EVALUATION_BATCH_SIZE, ORACLE_CHUNK_SIZE,
+                                   ORACLE_WORKERS)
+from services.Profiling import profiled
+
+# Pool workers are forked from a server process that has imported this
+# module, not from the multi-threaded gunicorn worker, whose locks (e.g.
+# of logging), database connections and metric files they would inherit
+POOL_CONTEXT = multiprocessing.get_context("forkserver")
+POOL_CONTEXT.set_forkserver_preload([__name__])
+
+@dataclass
+class RegisteredOracle:
+    """An oracle function and its description."""
+    id: int                     # ID in the oracle_description table
+    name: str                   # Oracle name
+    description: str            # Oracle description
+    function: Callable = None   # Maps a dataframe of queries to verdicts
+
+ORACLES: dict[int, RegisteredOracle] = {}
+
+def register_oracle(oracle_id: int, name: str, description: str):
+    """Decorator registering an oracle function under the given ID."""
+    def decorator(function):
+        ORACLES[oracle_id] = RegisteredOracle(oracle_id, name, description,
+                                              function)
+        return function
+    return decorator
+
+def get_oracle(oracle_id: int) -> RegisteredOracle:
+    """Return a registered oracle or raise a ValueError."""
+    if oracle_id not in ORACLES:
+        raise ValueError(f"No oracle registered with ID {oracle_id}")
+    return ORACLES[oracle_id]
+
+def sync_descriptions(db):
+    """Store the descriptions of all registered oracles in a backend.
+
+    Runs once when the store starts (see Migrations.upgrade_database()).
+    Existing descriptions are kept; a RuntimeError is raised if one of
+    them belongs to another oracle than the one registered under its ID."""
+    for oracle in ORACLES.values():
+        db.register_oracle_description(
+            OracleDescription(oracle.id, oracle.name, oracle.description))
+
+@profiled("oracle.evaluate")
+def evaluate_chunk(function, chunk):
+    """Apply an oracle function to a chunk (executed in worker processes)."""
+    return function(chunk)
+
+def run_oracle(oracle_id, test_data, workers=ORACLE_WORKERS,
+               chunk_size=ORACLE_CHUNK_SIZE) -> int:
+    """Evaluate test queries with a registered oracle and save the verdicts.
+
+    The queries are split into chunks of chunk_size rows, which are
+    evaluated by a pool of worker processes (or in this process if
+    workers is 1). Verdicts are saved in bulk as soon as a chunk
+    completes, with at most two chunks per worker in flight. Returns
+    the number of new verdicts."""
+    oracle = get_oracle(oracle_id)
+    chunks = (test_data.iloc[start:start + chunk_size]
+              for start in range(0, len(test_data), chunk_size))
+    saved = 0
+    if workers <= 1:
+        for chunk in chunks:
+            chunk = chunk.assign(result=evaluate_chunk(oracle.function, chunk))
+            saved += OracleService.save_oracle_results(chunk, oracle_id)
+        return saved
+    with ProcessPoolExecutor(max_workers=workers, mp_context=POOL_CONTEXT) as pool:
+        pending = {}
+        for chunk in chunks:
+            pending[pool.submit(evaluate_chunk, oracle.function, chunk)] = chunk
+            if len(pending) >= 2 * workers:
+                saved += save_completed(pending, oracle_id)
+        while pending:
+            saved += save_completed(pending, oracle_id)
+    return saved
+
+def save_completed(pending, oracle_id) -> int:
+    """Wait for evaluated chunks, save their verdicts and forget them."""
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    saved = 0
+    for future in done:
+        chunk = pending.pop(future).assign(result=future.result())
+        saved += OracleService.save_oracle_results(chunk, oracle_id)
+    return saved
+
+def evaluate_new_queries(oracle_id=1, workers=ORACLE_WORKERS,
+                         chunk_size=ORACLE_CHUNK_SIZE,
+                         batch_size=EVALUATION_BATCH_SIZE) -> int:
+    """Apply a registered oracle to all queries it has not judged yet.
+
+    Queries are loaded in batches of batch_size in the order of their
+    IDs and evaluated with run_oracle(). Returns the number of new
+    verdicts."""
+    get_oracle(oracle_id)
+    evaluated = 0
+    last_query_id = 0
+    while True:
+        test_data = DatabaseService.get_unevaluated_test_queries(
+            oracle_id, last_query_id, batch_size)
+        if test_data.empty:
+            return evaluated
+        evaluated += run_oracle(oracle_id, test_data, workers, chunk_size)
+        last_query_id = test_data["query_id"].max()
+
+register_oracle(1, "Default Oracle", "Simple heuristic conversion to boolean")(
+    OracleService.vectorized_oracle_function)
+register_oracle(2, "JSON Oracle",
+                "First boolean (or yes/no string) in a JSON response, "
+                "else the first word of the response")(
+    OracleService.json_oracle_function)
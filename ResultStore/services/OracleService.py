@@ -1,22 +1,35 @@
+import json
 import re
+import numpy as np
+import pandas as pd
 from services import DatabaseService
-from entities import OracleResult
+from services.Profiling import profiled
 
+@profiled("oracle.save")
 def save_oracle_results(test_data, oracle_id=1):
-    """Save the result of comparing a LLM response with the correct answer."""
+    """Save the result of comparing a LLM response with the correct answer.
+
+    All verdicts are written in one bulk operation; returns the number of
+    verdicts that were actually stored."""
     assert "result" in test_data, "Oracle was not applied before saving!"
-    for res in [OracleResult(-1, oracle_id, qid, label == predict)
-              for qid, label, predict
-              in zip(test_data["query_id"],
-                     test_data["correct_answer_label"],
-                     test_data["result"])]:
-        DatabaseService.save_oracle_result(res)
+    correct = test_data["correct_answer_label"] == test_data["result"]
+    verdicts = pd.DataFrame({
+        "query_id": test_data["query_id"],
+        "oracle_id": oracle_id,
+        "result": correct.map({True: "true", False: "false"}),
+        "verdict": test_data["result"],
+    })
+    return DatabaseService.save_oracle_results(verdicts)
 
 def apply_oracle(test_data, oracle_function):
     """Attach oracle verdicts to a dataframe."""
     test_data["result"] = test_data.apply(oracle_function, axis=1)
     return test_data
 
+# First words of a response that initial_oracle_function() maps to a label
+ORACLE_LABELS = {"no": "false", "false": "false", "0": "false",
+                 "yes": "true", "true": "true", "1": "true"}
+
 def encode_for_classification(query: str) -> list[str]:
     """Normalize string to produce an oracle verdict.
 
@@ -48,14 +61,86 @@ def initial_oracle_function(response):
         oracle_result = "undefined"
     return oracle_result
 
+def strip_question(response, question):
+    """Remove the prefix and the question from a response like reduce_response()."""
+    if not isinstance(response, str):
+        return None  # Missing responses are undefined
+    response = response.replace("Result is: ", "")
+    if isinstance(question, str) and len(response) >= len(question):
+        response = response.replace(question, "")
+    return response
+
+def vectorized_oracle_function(test_data):
+    """Vectorized equivalent of initial_oracle_function() for a dataframe.
+
+    Verdicts are computed once per unique (response, question) pair and
+    broadcast back to all rows: only the unique pairs have the question
+    removed from the response, and the remaining steps are vectorized
+    string operations on the results."""
+    if test_data.empty:
+        return pd.Series(index=test_data.index, dtype=object)
+    pairs = pd.MultiIndex.from_arrays([test_data["new_response"],
+                                       test_data["modified_question"]])
+    codes, uniques = pairs.factorize()
+    responses = pd.Series([strip_question(response, question)
+                           for response, question in uniques], dtype=object)
+    first_words = (responses
+                   .str.replace("<pad>", "", regex=False)
+                   .str.replace(r"[^a-zA-Z0-9 ]", "", regex=True)
+                   .str.lower()
+                   .str.split(n=1).str[0])
+    verdicts = first_words.map(ORACLE_LABELS).fillna("undefined").to_numpy()
+    return pd.Series(verdicts[codes], index=test_data.index)
+
+def json_label(value) -> str:
+    """Map a (decoded) JSON value to a boolean string or "undefined".
+
+    Booleans are used as-is, strings are interpreted like the first word
+    of a response in initial_oracle_function(), and objects and arrays
+    are searched for the first value that can be mapped."""
+    if isinstance(value, bool):
+        return str(value).lower()
+    if isinstance(value, str):
+        return ORACLE_LABELS.get(value.strip().lower(), "undefined")
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, list):
+        for item in value:
+            label = json_label(item)
+            if label != "undefined":
+                return label
+    return "undefined"
+
+def first_word_label(response: str) -> str:
+    """Map the first word of a response to a label like initial_oracle_function()."""
+    words = encode_for_classification(response.replace("Result is: ", ""))
+    return ORACLE_LABELS.get(words[0], "undefined") if words else "undefined"
+
+def json_oracle_function(test_data):
+    """Oracle for responses in JSON format, e.g. `{"answer": true}`.
+
+    Responses are decoded once per unique response. Responses that are
+    not valid JSON, e.g. the `True` or `False` of the executor's Ollama
+    adapter, are labeled by their first word (see ORACLE_LABELS)."""
+    codes, uniques = pd.factorize(test_data["new_response"])
+    verdicts = []
+    for response in uniques:
+        try:
+            verdicts.append(json_label(json.loads(response)))
+        except ValueError:
+            verdicts.append(first_word_label(str(response)))
+    verdicts = np.array(verdicts + ["undefined"], dtype=object)
+    return pd.Series(verdicts[codes], index=test_data.index)
+
+def apply_vectorized_oracle(test_data):
+    """Attach verdicts of vectorized_oracle_function() to a dataframe."""
+    test_data["result"] = vectorized_oracle_function(test_data)
+    return test_data
+
 def preliminary_check():
     """Apply oracle function and return counts per label."""
     test_queries = DatabaseService.get_test_queries()
-    label_stats = {}
-    for _, row in test_queries.iterrows():
-        result_label = initial_oracle_function(row)
-        label_stats[result_label] = label_stats.get(result_label, 0) + 1
-    return label_stats
+    return vectorized_oracle_function(test_queries).value_counts().to_dict()
 
 def get_precision(df):
     """Calculate the precision of LLM responses.
@@ -0,0 +1,13 @@
+"""Opt-in profiling of the storage API's hot paths.
+
+The sections marked with profiled() are the SQL queries including their
+conversion to dataframes (read_sql) and the evaluation and saving of
+oracle verdicts. Each gunicorn worker and oracle worker process writes
+its own profile. PROFILE_MODE and the other settings are read by
+ConfigParser; see kommkonllm_common.profiling for the files written."""
+from kommkonllm_common.profiling import configure, profiled, start
+from services.ConfigParser import (PROFILE_DIR, PROFILE_DUMP_INTERVAL,
+                                   PROFILE_MODE, PROFILE_SAMPLE_INTERVAL)
+
+configure("store", PROFILE_MODE, PROFILE_DIR, PROFILE_DUMP_INTERVAL,
+          PROFILE_SAMPLE_INTERVAL)
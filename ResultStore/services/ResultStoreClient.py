@@ -0,0 +1,102 @@
+"""Incrementally synced local copies of ResultStore tables.
+
+Notebooks usually reload every table from the database on each session.
+ResultStoreClient instead keeps a local Parquet snapshot of each table
+and, on every sync, only fetches the rows with an ID greater than the
+last synced one via the `/stream/<table>` endpoint. A re-sync therefore
+costs time proportional to the number of new rows.
+
+Snapshots are stored as one Parquet file per sync in a folder per table.
+All tables are append-only, so the highest synced ID is a sufficient
+checkpoint; a row committed after a concurrent row with a higher ID was
+already synced is missed, though, so call resync() after runs that were
+still writing during a sync."""
+import json
+from os import getenv
+from pathlib import Path
+import shutil
+import pandas as pd
+import requests
+
+TABLES = ["test_sentence", "test_query", "oracle_result",
+          "oracle_description", "model_parameter"]
+
+class ResultStoreClient:
+    """Local, incrementally synced cache of the ResultStore tables."""
+
+    def __init__(self, base_url: str = None, cache_dir: str = "cache",
+                 rows_per_file: int = 500_000):
+        """Use the store at base_url and keep snapshots in cache_dir.
+
+        base_url defaults to the STORE_URL environment variable or the
+        local storage API."""
+        self.base_url = base_url or getenv(
+            "STORE_URL", f"http://localhost:{getenv('SERVICE_PORT', '8080')}")
+        self.cache_dir = Path(cache_dir)
+        self.rows_per_file = rows_per_file
+
+    def table_dir(self, table: str) -> Path:
+        """Return the snapshot folder of a table."""
+        if table not in TABLES:
+            raise ValueError(f"Unknown table {table}")
+        return self.cache_dir / table
+
+    def snapshot_files(self, table: str) -> list[Path]:
+        """Return the snapshot files of a table, ordered by their IDs."""
+        return sorted(self.table_dir(table).glob("*.parquet"))
+
+    def last_synced_id(self, table: str) -> int:
+        """Return the highest ID stored in the local snapshot (0 if empty).
+
+        Snapshot files are named `<first ID>-<last ID>.parquet`."""
+        files = self.snapshot_files(table)
+        if not files:
+            return 0
+        return int(files[-1].stem.split("-")[1])
+
+    def write_snapshot(self, table: str, records: list[dict]):
+        """Write a list of rows as a new snapshot file."""
+        ids = [record["id"] for record in records]
+        path = self.table_dir(table) / f"{min(ids):012d}-{max(ids):012d}.parquet"
+        temp_path = path.with_suffix(".tmp")
+        pd.DataFrame.from_records(records).to_parquet(temp_path, index=False)
+        temp_path.rename(path)  # Never leave a partial file behind
+
+    def sync(self, table: str) -> int:
+        """Fetch all rows added since the last sync; return their number."""
+        self.table_dir(table).mkdir(parents=True, exist_ok=True)
+        params = {"format": "ndjson", "since_id": self.last_synced_id(table)}
+        fetched = 0
+        records = []
+        with requests.get(f"{self.base_url}/stream/{table}", params=params,
+                          stream=True, timeout=64) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                records.append(json.loads(line))
+                if len(records) >= self.rows_per_file:
+                    self.write_snapshot(table, records)
+                    fetched += len(records)
+                    records = []
+        if records:
+            self.write_snapshot(table, records)
+            fetched += len(records)
+        return fetched
+
+    def sync_all(self) -> dict[str, int]:
+        """Sync all tables and return the number of new rows per table."""
+        return {table: self.sync(table) for table in TABLES}
+
+    def resync(self, table: str) -> int:
+        """Drop the local snapshot of a table and fetch it from scratch."""
+        shutil.rmtree(self.table_dir(table), ignore_errors=True)
+        return self.sync(table)
+
+    def load(self, table: str, columns: list[str] = None) -> pd.DataFrame:
+        """Load the local snapshot of a table as a dataframe."""
+        frames = [pd.read_parquet(path, columns=columns)
+                  for path in self.snapshot_files(table)]
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, ignore_index=True)
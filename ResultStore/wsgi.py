@@ -0,0 +1,14 @@
+"""WSGI entry point of the storage API.
+
+Serve with a pre-forking WSGI server, e.g. `gunicorn -c gunicorn.conf.py
+wsgi:app`; every worker process creates its own database connection pool
+on first use."""
+import os
+from api.StorageApi import app
+
+def create_output_folders():
+    """Create the output folders for CAs and IPMs."""
+    os.makedirs(os.path.join("CT", "CAs"), exist_ok=True)
+    os.makedirs(os.path.join("CT", "IPMs"), exist_ok=True)
+
+create_output_folders()
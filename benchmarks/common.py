@@ -0,0 +1,18 @@
+"""Helpers shared by the benchmarks."""
+from pathlib import Path
+import subprocess
+
+REPO = Path(__file__).resolve().parent.parent
+
+
+def version() -> dict:
+    """Return the git commit of the benchmarked code, if available."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO, check=True,
+                                capture_output=True, text=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                    cwd=REPO, check=True, capture_output=True,
+                                    text=True).stdout.strip())
+        return {"commit": commit, "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
@@ -0,0 +1,271 @@
+"""End-to-end throughput benchmark of the runner, executor and store.
+
+Starts a stub Ollama (see stubs/stub_ollama.py), the real executor and
+ResultStore (on an embedded SQLite database by default) and runs
+meta-runner/src/main.py on the example questions, replicated to the
+requested number of sentences, with a stub PICT (see stubs/pict). All
+three services run with PROFILE_MODE=timing; the result combines their
+section percentiles with the throughput of the whole run and the
+store's insert rate and is written as JSON, e.g.:
+
+    python3 benchmarks/e2e.py --sentences 100 --latency 0.02 -o e2e.json
+
+The runner's dependencies (spaCy with en_core_web_sm, NLTK with
+WordNet) and those of the executor and store must be installed."""
+import argparse
+from datetime import datetime, timezone
+import glob
+import itertools
+import json
+import os
+from pathlib import Path
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import requests
+from prometheus_client.parser import text_string_to_metric_families
+
+BENCHMARKS = Path(__file__).resolve().parent
+REPO = BENCHMARKS.parent
+sys.path.insert(0, str(BENCHMARKS / "stubs"))
+from common import version
+from stub_ollama import ERROR_MODES, StubOllama
+
+QUESTIONS = REPO / "example" / "public_questions.jsonl"
+STUB_PICT = BENCHMARKS / "stubs" / "pict"
+
+
+def free_port() -> int:
+    """Return a TCP port that is currently unused."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url: str, process: subprocess.Popen, timeout: float = 120):
+    """Wait until url responds with 200, failing if process exits first."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{process.args} exited with {process.returncode}")
+        try:
+            response = requests.get(url, timeout=5)
+            if response.status_code == 200:
+                return
+            if response.status_code == 500:
+                raise RuntimeError(f"{url} failed: {response.text}")
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"{url} did not become ready within {timeout}s")
+
+
+def start(args: list, cwd: Path, env: dict, log: Path) -> subprocess.Popen:
+    """Start a service with its output redirected to log."""
+    with open(log, "wb") as fp:
+        return subprocess.Popen(args, cwd=cwd, env=os.environ | env,
+                                stdout=fp, stderr=subprocess.STDOUT)
+
+
+def stop(process: subprocess.Popen, sig=signal.SIGTERM):
+    """Stop a service gracefully, so it dumps its profile."""
+    if process.poll() is None:
+        process.send_signal(sig)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def write_questions(path: Path, sentences: int):
+    """Write the example questions, repeated to the number of sentences."""
+    with open(QUESTIONS, encoding="utf-8") as fp:
+        questions = [line.strip() for line in fp if line.strip()]
+    with open(path, "w", encoding="utf-8") as fp:
+        for line in itertools.islice(itertools.cycle(questions), sentences):
+            fp.write(line + "\n")
+
+
+def merge_sections(profiles: list[dict]) -> dict:
+    """Combine the timing sections of several processes of a service.
+
+    Counts, totals and maxima are exact; percentiles of sections timed
+    in several processes are count-weighted means of the processes'
+    percentiles, i.e. approximations."""
+    merged = {}
+    for profile in profiles:
+        for name, section in profile["sections"].items():
+            merged.setdefault(name, []).append(section)
+    result = {}
+    for name, sections in merged.items():
+        count = sum(s["count"] for s in sections)
+        total = sum(s["total"] for s in sections)
+        result[name] = {
+            "count": count,
+            "total": total,
+            "mean": total / count,
+            **{p: sum(s[p] * s["count"] for s in sections) / count
+               for p in ("p50", "p90", "p99")},
+            "max": max(s["max"] for s in sections),
+        }
+    return result
+
+
+def read_profiles(profile_dir: Path) -> dict:
+    """Return the merged timing sections per service."""
+    services = {}
+    for path in glob.glob(str(profile_dir / "*.timing.json")):
+        with open(path, encoding="utf-8") as fp:
+            profile = json.load(fp)
+        services.setdefault(profile["service"], []).append(profile)
+    return {service: merge_sections(profiles)
+            for service, profiles in services.items()}
+
+
+def store_operations(metrics_text: str) -> dict:
+    """Return count and total duration of the store's database operations."""
+    operations = {}
+    for family in text_string_to_metric_families(metrics_text):
+        if family.name != "store_db_operation_duration_seconds":
+            continue
+        for sample in family.samples:
+            operation = operations.setdefault(sample.labels.get("operation"),
+                                              {"count": 0, "total": 0.0})
+            if sample.name.endswith("_count"):
+                operation["count"] += int(sample.value)
+            elif sample.name.endswith("_sum"):
+                operation["total"] += sample.value
+    return operations
+
+
+def startup_time(log: Path) -> float | None:
+    """Return the startup duration reported by the runner, if any."""
+    with open(log, encoding="utf-8", errors="replace") as fp:
+        for line in fp:
+            match = re.search(r"Startup took ([\d.]+)s", line)
+            if match:
+                return float(match.group(1))
+    return None
+
+
+def run(args, workdir: Path) -> dict:
+    """Run the benchmark in workdir and return its results."""
+    profile_dir = workdir / "profiles"
+    profiling = {"PROFILE_MODE": "timing", "PROFILE_DIR": str(profile_dir),
+                 "PROFILE_DUMP_INTERVAL": "3600"}
+    stub = StubOllama(latency=args.latency, jitter=args.jitter,
+                      error_rate=args.error_rate, error_mode=args.error_mode,
+                      seed=args.seed).start()
+    store_port, executor_port = free_port(), free_port()
+    store_env = {"SERVICE_PORT": str(store_port), "DB_BACKEND": args.backend,
+                 "STORE_WORKERS": str(args.store_workers),
+                 "PROMETHEUS_MULTIPROC_DIR": str(workdir / "store_metrics"),
+                 **profiling}
+    if args.backend == "sqlite":
+        store_env["SQLITE_PATH"] = str(workdir / "store.sqlite3")
+    store = start([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "wsgi:app"],
+                  REPO / "ResultStore", store_env, workdir / "store.log")
+    executor = start([sys.executable, "main.py"], REPO / "pyann-model-executor", {
+        "SERVICE_PORT": str(executor_port), "MODEL_IP": stub.address,
+        "OLLAMA_MODEL": "stub", "PRELOAD": "OLLAMA", "LOG_LEVEL": "WARNING",
+        **profiling}, workdir / "executor.log")
+    try:
+        wait_for(f"http://127.0.0.1:{store_port}/health", store)
+        wait_for(f"http://127.0.0.1:{executor_port}/models", executor)
+        write_questions(workdir / "train.jsonl", args.sentences)
+        runner_env = {
+            "EXECUTOR_HOST": "127.0.0.1", "EXECUTOR_PORT": str(executor_port),
+            "STORAGE_HOST": "127.0.0.1", "STORAGE_PORT": str(store_port),
+            "CONTINUE_RUN": "false", "EXECUTION_NOTE": "benchmark",
+            "MODEL_UNDER_TEST": "OLLAMA", "STRENGTH": str(args.strength),
+            "USE_POSTFIX": "true", "PROMPT_POSTFIX": "? Return a JSON boolean.",
+            "CA_GENERATOR": "PICT", "CA_GENERATOR_PATH": str(STUB_PICT),
+            **profiling}
+        if args.models:
+            runner_env["MODELS_UNDER_TEST"] = args.models
+        started = time.perf_counter()
+        runner = start([sys.executable, str(REPO / "meta-runner" / "src" / "main.py")],
+                       workdir, runner_env, workdir / "runner.log")
+        runner.wait()
+        duration = time.perf_counter() - started
+        if runner.returncode != 0:
+            raise RuntimeError(f"Runner failed with {runner.returncode}, "
+                               f"see {workdir / 'runner.log'}")
+        operations = store_operations(
+            requests.get(f"http://127.0.0.1:{store_port}/metrics", timeout=30).text)
+    finally:
+        stop(executor, signal.SIGINT)  # The Flask server only exits cleanly on SIGINT
+        stop(store)
+        stub.shutdown()
+
+    inserts = operations.get("save_test_query", {"count": 0, "total": 0.0})
+    startup = startup_time(workdir / "runner.log")
+    query_time = duration - (startup or 0.0)
+    return {
+        "benchmark": "e2e",
+        "date": datetime.now(timezone.utc).isoformat(),
+        "version": version(),
+        "config": vars(args),
+        "sentences": args.sentences,
+        "duration": duration,
+        "startup": startup,
+        "queries": inserts["count"],
+        "queries_per_second": inserts["count"] / query_time if query_time > 0 else None,
+        "llm": dict(stub.counts),
+        "store": {
+            "inserts_per_second": inserts["count"] / query_time if query_time > 0 else None,
+            "operations": {name: op | {"mean": op["total"] / op["count"] if op["count"] else None}
+                           for name, op in operations.items()},
+        },
+        "stages": read_profiles(profile_dir),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sentences", type=int, default=27,
+                        help="number of sentences, cycling through the example questions")
+    parser.add_argument("--strength", type=int, default=2)
+    parser.add_argument("--models", default="",
+                        help="MODELS_UNDER_TEST, e.g. OLLAMA:a,OLLAMA:b (default: one model)")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="mean latency of the stub LLM in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="maximum deviation from the mean latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="share of LLM queries that fail")
+    parser.add_argument("--error-mode", choices=ERROR_MODES, default="http")
+    parser.add_argument("--backend", choices=("sqlite", "postgres"), default="sqlite",
+                        help="store backend; postgres uses the DB_* environment variables")
+    parser.add_argument("--store-workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("-o", "--output", help="JSON file to write (default: stdout)")
+    parser.add_argument("--keep", action="store_true",
+                        help="keep the working directory with logs and profiles")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="e2e-benchmark-"))
+    try:
+        results = run(args, workdir)
+    except Exception:
+        print(f"Benchmark failed, logs are in {workdir}", file=sys.stderr)
+        raise
+    if args.keep:
+        print(f"Logs and profiles are in {workdir}", file=sys.stderr)
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fp:
+            fp.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
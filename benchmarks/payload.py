@@ -0,0 +1,264 @@
+"""Microbenchmarks of the meta runner's payload generator.
+
+Measures generate_synonyms(), CA generation with each CaGenerator
+backend, CaGenerator.read() and consume_payload_from_ca() at several
+scales: the 27 example questions with their shipped synonyms and CAs
+(example/synonyms-*.txt and example/ca-*.csv) and synthetic IPMs of up
+to 120 parameters at strength 3 (CaGenerator.ca_filename() limits the
+number of parameters to about 120). CA generators that are not given with
+--cagen, --pict or --acts are replaced by the stubs in stubs/ (whose
+arrays have typical CA sizes, but are not covering arrays).
+
+Times are the best of --repeat runs; peak memory is measured with
+tracemalloc in a separate run and only includes the Python allocations
+of this process, not those of the CA generator processes. The results
+are written as JSON. The meta runner's modules need the shared
+kommkonllm_common package, so install common/ (`pip install ./common`)
+or put it on the PYTHONPATH, e.g.:
+
+    PYTHONPATH=common python3 benchmarks/payload.py --repeat 5 -o payload.json
+
+generate_synonyms() is skipped if spaCy or WordNet are not installed."""
+import argparse
+import ast
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import json
+import os
+from pathlib import Path
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCHMARKS = Path(__file__).resolve().parent
+REPO = BENCHMARKS.parent
+STUBS = BENCHMARKS / "stubs"
+EXAMPLE = REPO / "example"
+sys.path.insert(0, str(REPO / "meta-runner" / "src"))
+from common import version
+from payload_generator.ca_generator import CaGenerator
+from payload_generator.payload_generator import (consume_payload_from_ca,
+                                                 generate_synonyms,
+                                                 load_language_models)
+
+BACKENDS = ("PICT", "CAGEN", "ACTS")
+# Synthetic IPMs: name, cardinalities (synonyms per word) and strength
+SYNTHETIC = (
+    ("k20-v3-t2", [3] * 20, 2),
+    ("k50-v3-t2", [3] * 50, 2),
+    ("k100-v3-t2", [3] * 100, 2),
+    ("k100-v3-t3", [3] * 100, 3),
+    ("k120-v1..4-t3", [1 + i % 4 for i in range(120)], 3),
+)
+
+
+def example_ipms() -> list[list[list[str]]]:
+    """Return the synonyms of the example questions, in ID order."""
+    ipms = []
+    for number in range(1, len(list(EXAMPLE.glob("synonyms-*.txt"))) + 1):
+        with open(EXAMPLE / f"synonyms-{number}.txt", encoding="utf-8") as fp:
+            ipms.append([ast.literal_eval(line) for line in fp if line.strip()])
+    return ipms
+
+
+def synthetic_ipm(cardinalities: list[int]) -> list[list[str]]:
+    """Return synonyms with the given number of alternatives per word."""
+    return [[f"word{i}_{j}" for j in range(values)]
+            for i, values in enumerate(cardinalities)]
+
+
+def scales(names: list[str] | None) -> list[tuple[str, list, int]]:
+    """Return the benchmarked scales: name, list of IPMs and strength."""
+    all_scales = [("example", example_ipms(), 2)]
+    all_scales += [(name, [synthetic_ipm(cardinalities)], strength)
+                   for name, cardinalities, strength in SYNTHETIC]
+    return [scale for scale in all_scales if not names or scale[0] in names]
+
+
+@contextmanager
+def ca_generator(backend: str, path: str | None):
+    """Select a CA generator for CaGenerator.get_generator(), stubbed if no path."""
+    environ = dict(os.environ)
+    os.environ["CA_GENERATOR"] = backend
+    if path:
+        os.environ["CA_GENERATOR_PATH"] = path
+    elif backend == "ACTS":
+        # ActsExecutor runs `java -jar <path>`; the stub replaces java
+        os.environ["CA_GENERATOR_PATH"] = str(STUBS / "java")
+        os.environ["PATH"] = f"{STUBS}{os.pathsep}{os.environ['PATH']}"
+    else:
+        os.environ["CA_GENERATOR_PATH"] = str(STUBS / backend.lower())
+    try:
+        yield CaGenerator.get_generator()
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+
+
+def remove_cas(workdir: Path):
+    """Remove the CAs (and IPM files) generated in workdir."""
+    for path in workdir.iterdir():
+        path.unlink()
+
+
+def measure(function, repeat: int, setup=None) -> dict:
+    """Return the best and mean time and the peak memory of function().
+
+    setup() runs before each call and is not measured; the result of the
+    last call is returned as `result`."""
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    if setup:
+        setup()
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(times), "mean_seconds": sum(times) / len(times),
+            "peak_memory": peak, "result": result}
+
+
+def describe(scale: str, ipms: list, strength: int) -> dict:
+    """Describe the inputs of a scale."""
+    return {"scale": scale, "ipms": len(ipms),
+            "parameters": max(len(ipm) for ipm in ipms),
+            "max_values": max(len(words) for ipm in ipms for words in ipm),
+            "strength": strength}
+
+
+def bench_generate(backend, generator, workdir, scale, ipms, strength, repeat):
+    """Benchmark generating the CAs of all IPMs of a scale from scratch."""
+    def generate():
+        return sum(generator.generate(ipm, strength)[1] for ipm in ipms)
+    measured = measure(generate, repeat, setup=lambda: remove_cas(workdir))
+    return {"function": "CaGenerator.generate", "backend": backend,
+            **describe(scale, ipms, strength), "rows": measured.pop("result"),
+            **measured}
+
+
+def bench_read(generator, scale, ipms, strength, repeat):
+    """Benchmark reading all rows of the (generated) CAs of a scale."""
+    def read():
+        return sum(sum(1 for _ in generator.read(ipm, strength)) for ipm in ipms)
+    measured = measure(read, repeat)
+    return {"function": "CaGenerator.read", **describe(scale, ipms, strength),
+            "rows": measured.pop("result"), **measured}
+
+
+def bench_consume(scale, ipms, strength, repeat):
+    """Benchmark translating the rows of the CAs of a scale to queries."""
+    def consume():
+        return sum(sum(1 for _ in consume_payload_from_ca(ipm, strength)) for ipm in ipms)
+    measured = measure(consume, repeat)
+    return {"function": "consume_payload_from_ca", **describe(scale, ipms, strength),
+            "queries": measured.pop("result"), **measured}
+
+
+def bench_synonyms(repeat) -> list[dict]:
+    """Benchmark loading the language models and generating synonyms."""
+    try:
+        start = time.perf_counter()
+        load_language_models()
+        load = time.perf_counter() - start
+    except (ImportError, LookupError, OSError) as e:
+        return [{"function": "generate_synonyms", "skipped": str(e).strip().splitlines()[0]}]
+    with open(EXAMPLE / "public_questions.jsonl", encoding="utf-8") as fp:
+        questions = [json.loads(line)["question"] for line in fp if line.strip()]
+    results = [{"function": "load_language_models", "seconds": load}]
+    for scale, sentences in (("1 question", questions[:1]), ("example", questions),
+                             ("10x example", questions * 10)):
+        measured = measure(lambda: [generate_synonyms(s) for s in sentences], repeat)
+        synonyms = measured.pop("result")
+        results.append({"function": "generate_synonyms", "scale": scale,
+                        "sentences": len(sentences),
+                        "words": sum(len(s) for s in synonyms), **measured})
+    return results
+
+
+def copy_example_cas(workdir: Path, ipms: list):
+    """Put the shipped example CAs where CaGenerator.read() looks for them."""
+    for number, ipm in enumerate(ipms, start=1):
+        shutil.copy(EXAMPLE / f"ca-{number}.csv",
+                    workdir / CaGenerator.ca_filename(ipm, 2))
+
+
+def run(args, workdir: Path) -> list[dict]:
+    """Run all benchmarks with workdir as working directory."""
+    results = [] if args.skip_synonyms else bench_synonyms(args.repeat)
+    for scale, ipms, strength in scales(args.scales):
+        if scale == "example":
+            # Read the shipped CAs before they are replaced by generated ones
+            remove_cas(workdir)
+            copy_example_cas(workdir, ipms)
+            with ca_generator("PICT", args.pict) as generator:
+                results.append(bench_read(generator, "example (shipped CAs)", ipms,
+                                          strength, args.repeat))
+                results.append(bench_consume("example (shipped CAs)", ipms, strength,
+                                             args.repeat))
+        for backend in args.backends:
+            with ca_generator(backend, getattr(args, backend.lower())) as generator:
+                results.append(bench_generate(backend, generator, workdir, scale, ipms,
+                                              strength, args.repeat))
+                print(f"{backend} {scale}: {results[-1]['seconds']:.3f}s, "
+                      f"{results[-1]['rows']} rows", file=sys.stderr)
+        # Read and consume the CAs of the last backend
+        with ca_generator(args.backends[-1], getattr(args, args.backends[-1].lower())) \
+                as generator:
+            results.append(bench_read(generator, scale, ipms, strength, args.repeat))
+            results.append(bench_consume(scale, ipms, strength, args.repeat))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--backends", type=lambda s: s.upper().split(","),
+                        default=list(BACKENDS), help="comma-separated CA generators")
+    parser.add_argument("--scales", type=lambda s: s.split(","),
+                        help="comma-separated scales (default: all), e.g. example,"
+                        + ",".join(name for name, _, _ in SYNTHETIC))
+    parser.add_argument("--pict", help="PICT executable (default: stub)")
+    parser.add_argument("--cagen", help="CAgen fipo-cli executable (default: stub)")
+    parser.add_argument("--acts", help="ACTS jar (default: stub)")
+    parser.add_argument("--skip-synonyms", action="store_true")
+    parser.add_argument("-o", "--output", help="JSON file to write (default: stdout)")
+    args = parser.parse_args()
+    unknown = set(args.backends) - set(BACKENDS)
+    if unknown:
+        parser.error(f"Unknown CA generators: {', '.join(sorted(unknown))}")
+
+    # CAs are generated in and read from the working directory
+    cwd = os.getcwd()
+    workdir = Path(tempfile.mkdtemp(prefix="payload-benchmark-"))
+    try:
+        os.chdir(workdir)
+        results = run(args, workdir)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    output = json.dumps({
+        "benchmark": "payload_generator",
+        "date": datetime.now(timezone.utc).isoformat(),
+        "version": version(),
+        "config": vars(args),
+        "stubs": [b for b in args.backends if not getattr(args, b.lower())],
+        "results": results,
+    }, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fp:
+            fp.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
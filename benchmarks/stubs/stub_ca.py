@@ -0,0 +1,32 @@
+"""Stand-in covering arrays for benchmarks without the real CA generators.
+
+random_array() returns a random array with roughly as many rows as a
+good covering array of the same parameters, using the asymptotic size
+(t - 1) * ln(k) / ln(v^t / (v^t - 1)) of covering arrays with k
+parameters of at most v values and strength t. The rows are not
+guaranteed to cover all t-way combinations, but cost the same to read,
+store and query as those of a real CA."""
+import math
+import random
+
+
+def array_size(cardinalities: list[int], strength: int) -> int:
+    """Return the number of rows of a typical CA for the cardinalities."""
+    varying = sorted((c for c in cardinalities if c > 1), reverse=True)
+    if not varying:
+        return 1
+    strength = min(strength, len(varying))
+    lower_bound = math.prod(varying[:strength])
+    combinations = varying[0] ** strength
+    if strength < 2 or combinations < 2:
+        return lower_bound
+    asymptotic = ((strength - 1) * math.log(len(varying))
+                  / math.log(combinations / (combinations - 1)))
+    return max(lower_bound, math.ceil(asymptotic))
+
+
+def random_array(cardinalities: list[int], strength: int) -> list[list[int]]:
+    """Return a reproducible random array of array_size() rows."""
+    rng = random.Random(f"{cardinalities}-{strength}")
+    return [[rng.randrange(c) for c in cardinalities]
+            for _ in range(array_size(cardinalities, strength))]
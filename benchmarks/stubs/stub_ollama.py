@@ -0,0 +1,117 @@
+"""Stand-in for the Ollama API with configurable latency and errors.
+
+Implements the endpoints OllamaExecutor uses: /api/create succeeds
+immediately, /api/generate waits for a random latency and answers with
+a JSON boolean and Ollama's token statistics. A share of the generate
+requests fails, either with an HTTP 500 (`http`, which the executor
+passes on as the response text) or by closing the connection without
+a response (`drop`, which makes the executor's query fail).
+
+Run standalone with `python3 stub_ollama.py --port 11434`, or use
+StubOllama in a benchmark."""
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import threading
+import time
+
+ERROR_MODES = ("http", "drop")
+
+
+class StubOllama(ThreadingHTTPServer):
+    """Ollama stand-in serving in a background thread."""
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.05, jitter=0.0, error_rate=0.0,
+                 error_mode="http", seed=None):
+        """Answer after latency +/- jitter seconds, failing error_rate of queries."""
+        if error_mode not in ERROR_MODES:
+            raise ValueError(f"Unknown error mode {error_mode}")
+        super().__init__(("127.0.0.1", port), StubOllamaHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_mode = error_mode
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {"generate": 0, "errors": 0, "create": 0}
+
+    @property
+    def address(self) -> str:
+        """Return the host:port to set as the executor's MODEL_IP."""
+        return f"{self.server_address[0]}:{self.server_address[1]}"
+
+    def start(self):
+        """Serve requests in a daemon thread."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def draw(self) -> tuple[float, bool, bool]:
+        """Return the latency of a query, whether it fails and its answer."""
+        with self.lock:
+            latency = max(0.0, self.rng.uniform(self.latency - self.jitter,
+                                                self.latency + self.jitter))
+            return latency, self.rng.random() < self.error_rate, self.rng.random() < 0.5
+
+    def count(self, key: str):
+        """Count a request or error."""
+        with self.lock:
+            self.counts[key] += 1
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    """Handles the requests to a StubOllama."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *_):
+        pass
+
+    def reply(self, status: int, body: dict):
+        """Send a JSON response."""
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        if self.path == "/api/create":
+            self.server.count("create")
+            return self.reply(200, {"status": "success"})
+        if self.path != "/api/generate":
+            return self.reply(404, {"error": f"unknown endpoint {self.path}"})
+        self.server.count("generate")
+        latency, fail, answer = self.server.draw()
+        time.sleep(latency)
+        if fail:
+            self.server.count("errors")
+            if self.server.error_mode == "drop":
+                self.close_connection = True
+                return None
+            return self.reply(500, {"error": "injected error"})
+        prompt_tokens = len(request.get("prompt", "").split())
+        return self.reply(200, {
+            "model": request.get("model"),
+            "response": json.dumps({"answer": answer}),
+            "done": True,
+            "prompt_eval_count": prompt_tokens,
+            "eval_count": 6,
+            "total_duration": int(latency * 1e9),
+        })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="mean latency of a query in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="maximum deviation from the mean latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-mode", choices=ERROR_MODES, default="http")
+    args = parser.parse_args()
+    StubOllama(args.port, args.latency, args.jitter, args.error_rate,
+               args.error_mode).serve_forever()
@@ -0,0 +1,4 @@
+"""Code shared by the services, installed into each of their images.
+
+* profiling: opt-in profiling of hot paths (PROFILE_MODE etc.);
+* flask_metrics: Prometheus metrics of the requests to a Flask app."""
@@ -0,0 +1,45 @@
+"""Prometheus metrics of the requests to a Flask app.
+
+instrument_requests() counts and times every request to an app with
+metrics (and labels) defined by the service; add_metrics_endpoint()
+serves them at /metrics. Requires Flask and prometheus-client."""
+import time
+from typing import Callable
+from flask import Flask, Response, g
+from prometheus_client import CONTENT_TYPE_LATEST
+
+
+def instrument_requests(app: Flask, requests, latency, in_flight,
+                        labels: Callable[[], tuple],
+                        in_flight_labels: Callable[[], tuple] | None = None):
+    """Record the requests to app in the given metrics.
+
+    labels() returns the label values of the current request for latency
+    and requests, which additionally has the status code as last label;
+    in_flight_labels() (by default labels()) those for the in_flight gauge."""
+    in_flight_labels = in_flight_labels or labels
+
+    @app.before_request
+    def start_request():
+        g.metrics_start = time.perf_counter()
+        in_flight.labels(*in_flight_labels()).inc()
+
+    @app.after_request
+    def count_request(response):
+        label_values = labels()
+        latency.labels(*label_values).observe(time.perf_counter() - g.metrics_start)
+        requests.labels(*label_values, response.status_code).inc()
+        return response
+
+    @app.teardown_request
+    def finish_request(_):
+        if "metrics_start" in g:
+            in_flight.labels(*in_flight_labels()).dec()
+
+
+def add_metrics_endpoint(app: Flask, collect: Callable[[], bytes]):
+    """Serve the metrics returned by collect() at /metrics."""
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        """Expose the metrics in the Prometheus text format."""
+        return Response(collect(), mimetype=CONTENT_TYPE_LATEST)
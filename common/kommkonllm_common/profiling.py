@@ -0,0 +1,281 @@
+"""Opt-in profiling of the services' hot paths.
+
+Each service calls configure() with its name once, before it marks its
+hot paths with profiled() (see its profiling module). PROFILE_MODE
+selects what is recorded; profiling is off by default:
+
+* `timing`: count and time the sections marked with profiled();
+* `cprofile`: time the sections and run the whole process under cProfile;
+* `sample`: time the sections and sample the stacks of all threads every
+  PROFILE_SAMPLE_INTERVAL seconds (default 0.01).
+
+Every PROFILE_DUMP_INTERVAL seconds (default 60) and at exit, each
+process (including forked ones, e.g. gunicorn and process pool workers)
+writes its own profile to PROFILE_DIR (default `profiles`), named after
+the service, start time and PID: `<name>.timing.json` with percentiles
+of the section durations plus, depending on the mode, `<name>.prof`
+(open with pstats or snakeviz) or `<name>.folded` (collapsed stacks for
+flamegraph.pl or speedscope).
+
+`python -m kommkonllm_common.profiling` checks that profiling works in
+process pool workers with every start method, e.g. with
+PROFILE_MODE=cprofile."""
+import atexit
+import cProfile
+from collections import Counter, deque
+from contextlib import contextmanager
+import json
+import logging
+from multiprocessing.util import Finalize
+import os
+from os import getenv
+import sys
+import threading
+import time
+
+MODES = ("timing", "cprofile", "sample")
+# Durations kept per section to compute percentiles from (the most recent)
+MAX_DURATIONS = 10000
+
+SERVICE = "service"
+MODE = ""
+PROFILE_DIR = "profiles"
+DUMP_INTERVAL = 60.0
+SAMPLE_INTERVAL = 0.01
+
+
+def configure(service: str, mode: str | None = None, directory: str | None = None,
+              dump_interval: float | None = None, sample_interval: float | None = None):
+    """Set the service name and the settings, by default from the environment.
+
+    Must be called before the first profiled() section is declared."""
+    global SERVICE, MODE, PROFILE_DIR, DUMP_INTERVAL, SAMPLE_INTERVAL
+    mode = (getenv("PROFILE_MODE", "") if mode is None else mode).lower()
+    if mode and mode not in MODES:
+        raise ValueError(f"Unknown PROFILE_MODE {mode}, use one of {', '.join(MODES)}")
+    SERVICE = service
+    MODE = mode
+    PROFILE_DIR = directory or getenv("PROFILE_DIR", "profiles")
+    DUMP_INTERVAL = dump_interval or float(getenv("PROFILE_DUMP_INTERVAL", "60"))
+    SAMPLE_INTERVAL = sample_interval or float(getenv("PROFILE_SAMPLE_INTERVAL", "0.01"))
+
+
+class Profiler:
+    """Profile of one process, dumped periodically by a background thread."""
+    def __init__(self):
+        self.pid = os.getpid()
+        self.name = f"{SERVICE}-{time.strftime('%Y%m%d-%H%M%S')}-{self.pid}"
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.sections = {}
+        self.stacks = Counter()
+        self.profile = None
+        if MODE == "cprofile":
+            # Since Python 3.12, a profile covers all threads of the process
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        elif MODE == "sample":
+            threading.Thread(target=self.sample, name="profiler-sampler",
+                             daemon=True).start()
+        threading.Thread(target=self.dump_periodically, name="profiler-dump",
+                         daemon=True).start()
+        atexit.register(self.dump)
+        # Worker processes of process pools exit without running atexit
+        Finalize(self, self.dump, exitpriority=10)
+
+    def record(self, name: str, duration: float):
+        """Record the duration of a section."""
+        with self.lock:
+            section = self.sections.get(name)
+            if section is None:
+                section = self.sections[name] = [0, 0.0, deque(maxlen=MAX_DURATIONS)]
+            section[0] += 1
+            section[1] += duration
+            section[2].append(duration)
+
+    def sample(self):
+        """Count the stacks of all other threads until the process exits."""
+        names = {}
+        while True:
+            time.sleep(SAMPLE_INTERVAL)
+            own = threading.get_ident()
+            frames = sys._current_frames()
+            if not names.keys() >= frames.keys():
+                names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_qualname} "
+                                 f"({os.path.basename(code.co_filename)})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, "thread"))
+                with self.lock:
+                    self.stacks[";".join(reversed(stack))] += 1
+
+    def timing_summary(self) -> dict:
+        """Return count, total and percentiles of the section durations."""
+        with self.lock:
+            sections = {name: (count, total, sorted(durations))
+                        for name, (count, total, durations) in self.sections.items()}
+        summary = {}
+        for name, (count, total, durations) in sections.items():
+            summary[name] = {
+                "count": count,
+                "total": total,
+                "mean": total / count,
+                **{f"p{p}": durations[min(len(durations) - 1,
+                                          len(durations) * p // 100)]
+                   for p in (50, 90, 99)},
+                "max": durations[-1],
+            }
+        return {"service": SERVICE, "pid": self.pid, "mode": MODE,
+                "started": self.started, "dumped": time.time(),
+                "sections": summary}
+
+    def dump(self):
+        """Write the profile to PROFILE_DIR; errors are only logged."""
+        if self.pid != os.getpid():
+            return  # Inherited by a forked process, which has its own
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, self.name)
+            write_atomically(f"{path}.timing.json",
+                             lambda fp: json.dump(self.timing_summary(), fp, indent=1))
+            if self.profile is not None:
+                with self.lock:
+                    self.profile.disable()
+                    try:
+                        self.profile.dump_stats(f"{path}.prof.tmp")
+                    finally:
+                        self.profile.enable()
+                os.replace(f"{path}.prof.tmp", f"{path}.prof")
+            if MODE == "sample":
+                with self.lock:
+                    stacks = list(self.stacks.items())
+                write_atomically(f"{path}.folded", lambda fp: fp.writelines(
+                    f"{stack} {count}\n" for stack, count in stacks))
+        except OSError as e:
+            logging.warning("Could not write profile to %s: %s", PROFILE_DIR, e)
+
+    def dump_periodically(self):
+        """Dump the profile every DUMP_INTERVAL seconds."""
+        while True:
+            time.sleep(DUMP_INTERVAL)
+            self.dump()
+
+
+def write_atomically(path: str, write):
+    """Call write with a text file replacing path when it is complete."""
+    with open(f"{path}.tmp", "w", encoding="utf-8") as fp:
+        write(fp)
+    os.replace(f"{path}.tmp", path)
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+def profiler() -> Profiler:
+    """Return the Profiler of this process, starting it on first use."""
+    global _profiler
+    if _profiler is None:
+        with _profiler_lock:
+            if _profiler is None:
+                _profiler = Profiler()
+    return _profiler
+
+def _after_fork():
+    """Drop the parent's Profiler in a forked child, which starts its own.
+
+    The child inherits the parent's active cProfile profile, which would
+    make enabling its own fail ("Another profiling tool is already
+    active" since Python 3.12), and possibly locks held by threads that
+    do not exist in the child."""
+    global _profiler, _profiler_lock
+    if _profiler is not None and _profiler.profile is not None:
+        _profiler.profile.disable()
+    _profiler = None
+    _profiler_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_after_fork)
+
+@contextmanager
+def section(name: str):
+    """Time a section of code for the profiler."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler().record(name, time.perf_counter() - start)
+
+
+class Disabled:
+    """Stand-in for section() if profiling is off; adds no overhead."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+    def __call__(self, function):
+        return function
+
+DISABLED = Disabled()
+
+def profiled(name: str):
+    """Return a context manager (or decorator) timing a hot path."""
+    return section(name) if MODE else DISABLED
+
+def profiled_iter(name: str, iterable):
+    """Yield from iterable, timing each item's computation as a section."""
+    if not MODE:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    while True:
+        with section(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+def start():
+    """Start profiling the process now instead of in its first section."""
+    if MODE:
+        profiler()
+
+
+def _check_section(value: int) -> int:
+    """Profiled function for check()."""
+    with profiled("check"):
+        return value
+
+def check():
+    """Profile sections in process pool workers with all start methods.
+
+    Raises if a worker fails or did not write its profile."""
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+    import tempfile
+    with tempfile.TemporaryDirectory() as directory:
+        # Workers started by spawn or forkserver configure themselves
+        os.environ.setdefault("PROFILE_MODE", "cprofile")
+        os.environ["PROFILE_DIR"] = directory
+        configure("check")
+        start()
+        for method in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context(method)
+            with ProcessPoolExecutor(2, mp_context=context) as pool:
+                assert list(pool.map(_check_section, range(10))) == list(range(10))
+            print(f"{method}: ok")
+        profiles = [name for name in os.listdir(directory) if name.endswith(".timing.json")]
+        # This process and at least one worker per start method
+        assert len(profiles) > len(multiprocessing.get_all_start_methods()), profiles
+        print(f"{len(profiles)} profiles written in {MODE or 'disabled'} mode")
+
+configure(SERVICE)
+
+if __name__ == "__main__":
+    check()
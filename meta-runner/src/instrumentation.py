@@ -0,0 +1,55 @@
+"""Prometheus metrics of the meta runner.
+
+stage() times the stages of testing a sentence: generating synonyms,
+generating the CA, querying the LLMs and storing the results. Set
+METRICS_PORT to expose the metrics via HTTP while the runner is
+running, and/or PUSHGATEWAY_URL to push them to a Prometheus
+Pushgateway after every sentence, since a run may end before it is
+scraped."""
+import logging
+from os import getenv
+from prometheus_client import (REGISTRY, Counter, Gauge, Histogram,
+                               push_to_gateway, start_http_server)
+
+STAGES = ("synonyms", "ca_generation", "query", "store")
+STAGE_DURATION = Histogram(
+    "runner_stage_duration_seconds", "Duration of the test stages by stage",
+    ["stage"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160,
+             float("inf")))
+SENTENCES = Counter("runner_sentences_total", "Tested sentences")
+STARTUP_DURATION = Gauge("runner_startup_duration_seconds",
+                         "Duration of the startup phases by phase", ["phase"])
+QUERIES = Counter("runner_queries_total",
+                  "Executor queries by outcome (ok, error or unreachable)",
+                  ["outcome"])
+
+def stage(name: str):
+    """Return a context manager (or decorator) timing a stage."""
+    if name not in STAGES:
+        raise ValueError(f"Unknown stage {name}")
+    return STAGE_DURATION.labels(name).time()
+
+def count_queries(outcome: str, queries: int = 1):
+    """Count executor queries with the given outcome."""
+    QUERIES.labels(outcome).inc(queries)
+
+def start_server():
+    """Expose the metrics on METRICS_PORT, if set."""
+    port = getenv("METRICS_PORT")
+    if port:
+        start_http_server(int(port))
+        logging.info("Serving metrics on port %s", port)
+
+def push():
+    """Push the metrics to the Pushgateway at PUSHGATEWAY_URL, if set.
+
+    Failures are logged only, so an unavailable gateway never stops a run."""
+    url = getenv("PUSHGATEWAY_URL")
+    if not url:
+        return
+    try:
+        push_to_gateway(url, job=getenv("METRICS_JOB", "meta-runner"),
+                        registry=REGISTRY, timeout=16)
+    except Exception as e:
+        logging.warning("Could not push metrics to %s: %s", url, e)
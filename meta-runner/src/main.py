@@ -4,22 +4,41 @@ This is the primary entrypoint that conducts the process of LLM consistency
 testing. It loads sentences (questions) to be tested, generates mutated
 versions of these questions and submits them to a LLM, then stores
 the responses."""
+import hashlib
+import itertools
 import json
 import logging
 from os import getenv
 import time
 import sys
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Start of the startup report, whose "imports" phase covers the imports
+# below; they load the (slow) third-party packages
+STARTED = time.perf_counter()
+
+import requests
+from requests.models import PreparedRequest
+
+from instrumentation import (count_queries, push, stage, start_server,
+                             SENTENCES, STARTUP_DURATION)
 from payload_generator.payload_generator import (
     generate_synonyms,
     consume_payload_from_ca,
     generate_ca,
+    load_language_models,
 )
-from requests.models import PreparedRequest
-import requests
-from bs4 import BeautifulSoup
+import profiling
+from profiling import profiled, profiled_iter
 
 logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 
+# Timing and token statistics the executor returns with each response
+QUERY_DETAILS = ("wall_time", "eval_count", "prompt_eval_count",
+                 "total_duration", "cache_hit")
+
 def prepare_prompt(query):
     """Prepare the prompt by surrounding the query with postfix/prefix."""
     prompt_prefix = ""
@@ -30,67 +49,228 @@ def prepare_prompt(query):
         prompt_postfix = getenv("PROMPT_POSTFIX")
     return prompt_prefix + query + prompt_postfix
 
-def store_result(prompt, result):
-    """Store a LLM response."""
+@stage("store")
+@profiled("store_result")
+def store_result(prompt, result, sentence_id, details=None, trace_id=None):
+    """Store a LLM response for the test sentence with the given ID.
+
+    details are the timing and token statistics of the response returned
+    by the executor (see QUERY_DETAILS), trace_id identifies the query in
+    the logs of the runner, executor and store."""
+    details = details or {}
     return requests.post(
         f"http://{getenv('STORAGE_HOST')}:{getenv('STORAGE_PORT')}/"
         "store/test_query",
         json={
+            "sentence_id": sentence_id,
             "modified_question": prompt,
-            "new_response": result
+            "new_response": result,
+            **{key: details.get(key) for key in QUERY_DETAILS},
+            "trace_id": trace_id
         },
-        headers={"Content-Type": "application/json"},
+        headers={"Content-Type": "application/json",
+                 "X-Trace-Id": trace_id or ""},
         timeout=64
     )
 
-def perform_query(query):
+@stage("store")
+def upload_blob(content: bytes) -> str:
+    """Upload a CA or IPM to the store unless it is stored already.
+
+    Blobs are addressed by the SHA-256 of their content, so identical
+    CAs (e.g. of sentences with the same cardinalities) are only
+    transferred and stored once. Returns the hash of the blob."""
+    blob_hash = hashlib.sha256(content).hexdigest()
+    url = (f"http://{getenv('STORAGE_HOST')}:{getenv('STORAGE_PORT')}/"
+           f"blob/{blob_hash}")
+    if requests.head(url, timeout=64).status_code == 404:
+        logging.debug("Uploading blob %s (%d bytes)", blob_hash, len(content))
+        requests.put(url, data=zlib.compress(content),
+                     headers={"Content-Encoding": "deflate"},
+                     timeout=64).raise_for_status()
+    return blob_hash
+
+def call_executor(method, url, **kwargs):
+    """Send a request to the executor, retrying up to 10 times on failure."""
+    kwargs.setdefault("timeout", 64)
+    for _ in range(10):
+        try:
+            return requests.request(method, url, **kwargs)
+        except Exception:
+            logging.info('Request %s failed, retrying in 10s', url)
+            time.sleep(10)
+    return None
+
+@profiled("perform_query")
+def perform_query(query, sentence_id, executor_model):
     """Query a LLM and store its response."""
     prompt = prepare_prompt(query)
+    trace_id = uuid.uuid4().hex
     executor_req = PreparedRequest()
     executor_req.prepare_url(
         f"http://{getenv('EXECUTOR_HOST')}:{getenv('EXECUTOR_PORT')}/query/"
-        f"{getenv('MODEL_UNDER_TEST')}", {"prompt": prompt})
-    logging.debug("perform_query() Calling executor via: %s", executor_req.url)
-    request_successful = False
-    retry_counter = 0
-    execute_res = None
-
-    while (not request_successful) and retry_counter < 10:
-        try:
-            execute_res = requests.get(executor_req.url, timeout=64)
-            request_successful = True
-        except Exception:
-            logging.info('Request %s failed, retrying in 10s', executor_req.url)
-            time.sleep(10)
-            retry_counter += 1
-            continue
+        f"{executor_model}", {"prompt": prompt, "details": "true"})
+    logging.debug("[%s] perform_query() Calling executor via: %s", trace_id,
+                  executor_req.url)
+    with stage("query"):
+        execute_res = call_executor("GET", executor_req.url,
+                                    headers={"X-Trace-Id": trace_id})
     if execute_res and execute_res.status_code == 200:
-        logging.debug('Storing result: %s => %s', prompt, execute_res.text)
-        store_result(prompt, execute_res.text)
+        count_queries("ok")
+        details = execute_res.json()
+        logging.debug('[%s] Storing result: %s => %s', trace_id, prompt,
+                      details["response"])
+        store_result(prompt, details["response"], sentence_id, details,
+                     trace_id)
+    elif execute_res is None:
+        count_queries("unreachable")
+        logging.error("Executor could not be reached (%s)", executor_req.url)
     else:
+        count_queries("error")
         logging.error(
             "Executor responded with status code %s and response %s (%s)",
             execute_res.status_code, execute_res.text, executor_req.url
         )
 
+def settings_grid() -> list[dict]:
+    """Return all combinations of model settings to sweep.
+
+    The SETTINGS_SWEEP environment variable is a JSON object mapping
+    model settings to lists of values, e.g.
+    `{"temperature": [0.1, 0.7], "seed": [1, 2]}`; without it, the grid
+    only contains the executor's default settings (an empty dict)."""
+    sweep = json.loads(getenv("SETTINGS_SWEEP", "") or "{}")
+    return [dict(zip(sweep, values))
+            for values in itertools.product(*sweep.values())]
+
+@stage("store")
+def store_model_parameters(sentence_id, settings):
+    """Store the model settings a test sentence was tested with."""
+    requests.post(
+        f"http://{getenv('STORAGE_HOST')}:{getenv('STORAGE_PORT')}/"
+        "store/model_parameters",
+        json={
+            "sentence_id": sentence_id,
+            "parameters": [[k, str(v)] for k, v in settings.items()]
+        },
+        headers={"Content-Type": "application/json"},
+        timeout=64
+    ).raise_for_status()
+
+def models_under_test() -> list[tuple[str, dict]]:
+    """Return the models to test, each with the settings selecting it.
+
+    MODELS_UNDER_TEST is a comma-separated list of executor models, each
+    optionally followed by the name of an Ollama model, e.g.
+    `OLLAMA:mistral,OLLAMA:llama3.1,OLLAMA:starling-lm`; the Ollama model
+    is sent as the `model` setting. It defaults to MODEL_UNDER_TEST."""
+    models = []
+    for entry in getenv("MODELS_UNDER_TEST", getenv("MODEL_UNDER_TEST", "")).split(","):
+        executor_model, _, ollama_model = entry.strip().partition(":")
+        models.append((executor_model,
+                       {"model": ollama_model} if ollama_model else {}))
+    return models
+
+def model_label(executor_model: str, settings: dict) -> str:
+    """Name a model under test like MODELS_UNDER_TEST does, e.g. `OLLAMA:mistral`."""
+    if settings.get("model"):
+        return f"{executor_model}:{settings['model']}"
+    return executor_model
+
+@profiled("perform_batch_query")
+def perform_batch_query(prompt, executor_model, targets, trace_id):
+    """Query an executor model under several settings concurrently.
+
+    targets is a list of (settings, sentence ID) pairs; the response for
+    each settings is stored for its sentence ID."""
+    url = (f"http://{getenv('EXECUTOR_HOST')}:{getenv('EXECUTOR_PORT')}/query/"
+           f"{executor_model}/batch")
+    logging.debug("[%s] perform_batch_query() Calling %s for %d settings: %s",
+                  trace_id, executor_model, len(targets), prompt)
+    with stage("query"):
+        execute_res = call_executor(
+            "POST", url, timeout=64 * len(targets),
+            headers={"X-Trace-Id": trace_id},
+            json={"queries": [{"prompt": prompt, "settings": settings}
+                              for settings, _ in targets]})
+    if execute_res and execute_res.status_code == 200:
+        for result, (_, sentence_id) in zip(execute_res.json(), targets):
+            if result.get("error"):
+                # Like a failed single query, a failed query is not stored
+                count_queries("error")
+                logging.error("[%s] Query failed (%s): %s", trace_id,
+                              result["settings"], result["error"])
+                continue
+            count_queries("ok")
+            logging.debug('[%s] Storing result: %s (%s) => %s', trace_id,
+                          prompt, result["settings"], result["response"])
+            store_result(prompt, result["response"], sentence_id, result,
+                         trace_id)
+    elif execute_res is None:
+        count_queries("unreachable", len(targets))
+        logging.error("Executor could not be reached (%s)", url)
+    else:
+        count_queries("error", len(targets))
+        logging.error(
+            "Executor responded with status code %s and response %s (%s)",
+            execute_res.status_code, execute_res.text, url
+        )
+
+def perform_fanout_query(query, targets, pool):
+    """Send a query to all models and settings under test concurrently.
+
+    targets is a list of (executor model, settings, sentence ID) tuples.
+    Each executor model receives one batch request; the requests to
+    different executor models run in parallel in the given thread pool.
+    All responses to the prompt share one trace ID."""
+    prompt = prepare_prompt(query)
+    trace_id = uuid.uuid4().hex
+    by_executor = {}
+    for executor_model, settings, sentence_id in targets:
+        by_executor.setdefault(executor_model, []).append((settings, sentence_id))
+    futures = [pool.submit(perform_batch_query, prompt, executor_model, batch,
+                           trace_id)
+               for executor_model, batch in by_executor.items()]
+    for future in futures:
+        future.result()
+
+def wait_for_executor():
+    """Wait until the executor reports its (preloaded) models as ready.
+
+    Gives up waiting after EXECUTOR_READY_TIMEOUT seconds, and raises a
+    RuntimeError if the executor could not prepare its models."""
+    url = f"http://{getenv('EXECUTOR_HOST')}:{getenv('EXECUTOR_PORT')}/models"
+    deadline = time.monotonic() + int(getenv("EXECUTOR_READY_TIMEOUT", "3600"))
+    while time.monotonic() < deadline:
+        try:
+            res = requests.get(url, timeout=16)
+        except Exception:
+            logging.info("Executor not reachable yet")
+        else:
+            if res.status_code == 200:
+                return
+            if res.status_code == 500:
+                raise RuntimeError(f"Executor could not prepare its models: {res.text}")
+            logging.info("Executor not ready yet: %s", res.text)
+        time.sleep(5)
+    logging.warning("Executor still not ready, starting anyway")
+
 def find_last_sentence():
     """Identify the last tested sentence (in its non-mutated form)."""
     try:
         stored_sentences = requests.get(
             f"http://{getenv('STORAGE_HOST')}:{getenv('STORAGE_PORT')}/"
-            "load/test_sentences", timeout=64)
-        stored_sentences_soup = BeautifulSoup(
-            stored_sentences.text, features='html.parser')
-        last_tr = stored_sentences_soup.find_all("tr")[-1]
-        last_td = last_tr.find_all("td")[1]
-        return last_td.text
+            "load/test_sentences", params={"return_type": "json"}, timeout=64)
+        stored_sentences.raise_for_status()
+        return max(stored_sentences.json(), key=lambda s: s["id"])["sentence"]
     except Exception as e:
         logging.error(
             "Could not find a sentence to continue from "
             "(maybe this is the first run?): %s", e)
     return None
 
-def create_test_sentence_data(question, answer, passage, strength):
+def create_test_sentence_data(question, answer, passage, strength,
+                              model_name, note):
     """Prepare test sentence data for DB storage."""
     return {
         "sentence": question,
@@ -98,22 +278,52 @@ def create_test_sentence_data(question, answer, passage, strength):
         "correct_answer_label": answer,
         "ipm_vector_notation": "",
         "source_data_name": "",
-        "model_name": getenv("MODEL_UNDER_TEST"),
-        "ca_file": "",
-        "ipm_file": "",
+        "model_name": model_name,
+        "ca_hash": None,
+        "ipm_hash": None,
         "ipm_description_file": "",
         "strength": strength,
-        "note": getenv("EXECUTION_NOTE", ""),
+        "note": note,
     }
 
+def timed(function, *args):
+    """Call function and return its result and duration in seconds."""
+    start = time.perf_counter()
+    return function(*args), time.perf_counter() - start
+
+def report_startup(durations: dict):
+    """Log and record the duration of each startup phase."""
+    durations["total"] = time.perf_counter() - STARTED
+    for phase, duration in durations.items():
+        STARTUP_DURATION.labels(phase).set(duration)
+    logging.info("Startup took %.2fs (%s)", durations.pop("total"),
+                 ", ".join(f"{phase} {duration:.2f}s"
+                           for phase, duration in durations.items()))
+
 if __name__ == "__main__":
     # Main functionality
+    startup = {"imports": time.perf_counter() - STARTED}
+    start_server()
+    profiling.start()
+    # Load spaCy and WordNet while waiting for the executor
+    language_models = ThreadPoolExecutor(max_workers=1).submit(
+        timed, load_language_models)
+    _, startup["executor"] = timed(wait_for_executor)
+
     # If we want to continue a previous run, first find the last tested sentence
     last_sentence = None
     reached_last_stop = False
     if getenv("CONTINUE_RUN", "").lower() == "true":
-        last_sentence = find_last_sentence()
+        last_sentence, startup["resume"] = timed(find_last_sentence)
+    _, startup["language_models"] = language_models.result()
+    report_startup(startup)
     strength = int(getenv("STRENGTH", "2"))
+    # Every model is tested under every settings of the sweep grid
+    targets = [(executor_model, model_settings | settings)
+               for executor_model, model_settings in models_under_test()
+               for settings in settings_grid()]
+    fan_out = len(targets) > 1 or bool(targets[0][1])
+    pool = ThreadPoolExecutor(max_workers=len(targets))
 
     # Open the list of questions, with one JSON object per line
     # Each object should have the following properties:
@@ -130,31 +340,53 @@ if __name__ == "__main__":
                     continue
                 reached_last_stop = True
 
-            # Create test sentence data and available synonyms
+            # Create available synonyms, shared by all models under test
             logging.debug("Starting test sentence '%s'", str(obj["question"]))
-            test_sentence_data = create_test_sentence_data(obj["question"],
-                                                           obj["answer"],
-                                                           obj["passage"],
-                                                           strength)
-            synonyms = generate_synonyms(obj["question"])
-            test_sentence_data["ipm_file"] = json.dumps(synonyms)
+            with stage("synonyms"):
+                synonyms = generate_synonyms(obj["question"])
+            ipm_hash = upload_blob(json.dumps(synonyms).encode("utf-8"))
 
             # Generate a covering array (CA) as the LLM test set
-            ca_filename, ca_size = generate_ca(synonyms, strength)
-            with open(ca_filename, 'r', encoding='utf-8') as fp:
-                test_sentence_data["ca_file"] = fp.read()
-
-            # Store the test sentence in the database
-            res = requests.post(
-                f"http://{getenv('STORAGE_HOST')}:{getenv('STORAGE_PORT')}/"
-                "store/test_sentence",
-                json=test_sentence_data,
-                headers={"Content-Type": "application/json"},
-                timeout=64
-            )
+            with stage("ca_generation"):
+                ca_filename, ca_size = generate_ca(synonyms, strength)
+            with open(ca_filename, 'rb') as fp:
+                ca_hash = upload_blob(fp.read())
+
+            # Store the test sentence in the database, once per model and
+            # settings under test together with these settings; all of
+            # them reference the same CA and IPM blobs
+            sentence_targets = []
+            for executor_model, settings in targets:
+                test_sentence_data = create_test_sentence_data(
+                    obj["question"], obj["answer"], obj["passage"], strength,
+                    model_label(executor_model, settings),
+                    getenv("EXECUTION_NOTE", "").replace(
+                        "{model}", settings.get("model", executor_model)))
+                test_sentence_data["ipm_hash"] = ipm_hash
+                test_sentence_data["ca_hash"] = ca_hash
+                with stage("store"):
+                    res = requests.post(
+                        f"http://{getenv('STORAGE_HOST')}:{getenv('STORAGE_PORT')}/"
+                        "store/test_sentence",
+                        json=test_sentence_data,
+                        headers={"Content-Type": "application/json"},
+                        timeout=64
+                    )
+                res.raise_for_status()
+                sentence_id = res.json()["id"]
+                if settings:
+                    store_model_parameters(sentence_id, settings)
+                sentence_targets.append((executor_model, settings, sentence_id))
 
             # Translate each row in the CA to a natural language query
-            # and submit it to the LLM
-            for ca_line in consume_payload_from_ca(synonyms, strength):
+            # and submit it to the LLM(s)
+            for ca_line in profiled_iter("consume_payload_from_ca",
+                                         consume_payload_from_ca(synonyms, strength)):
                 logging.debug("Starting test query '%s'", ca_line)
-                perform_query(ca_line)
+                if fan_out:
+                    perform_fanout_query(ca_line, sentence_targets, pool)
+                else:
+                    executor_model, _, sentence_id = sentence_targets[0]
+                    perform_query(ca_line, sentence_id, executor_model)
+            SENTENCES.inc()
+            push()
@@ -100,7 +100,7 @@ class CaGenExecutor(CaGenerator):
             num_rows = int(re.search(r'\d+', errs).group())
             return path, num_rows
         # Otherwise just open the file and count the lines
-        return path, len([self.read(synonyms, strength)])
+        return path, sum(1 for _ in self.read(synonyms, strength))
 
 class PictExecutor(CaGenerator):
     """Wrap PICT for CA generation."""
@@ -140,7 +140,7 @@ class PictExecutor(CaGenerator):
             return path, num_rows
 
         # Just return information about the cached CA
-        return path, len([self.read(synonyms, strength)])
+        return path, sum(1 for _ in self.read(synonyms, strength))
 
 class ActsExecutor(CaGenerator):
     """Wrap ACTS for CA generation."""
@@ -192,4 +192,4 @@ class ActsExecutor(CaGenerator):
             return path, num_rows
 
         # Just return information about the cached CA
-        return path, len([self.read(synonyms, strength)])
+        return path, sum(1 for _ in self.read(synonyms, strength))
@@ -1,15 +1,40 @@
 """Payload generator module.
 
 This module contains functionality to create synonyms (which form the
-basis of IPMs) and subsequently covering arrays, which represent test sets."""
+basis of IPMs) and subsequently covering arrays, which represent test sets.
+
+spaCy and NLTK are only imported when synonyms are first generated (or
+load_language_models() is called), and their models are loaded from
+local files only: the spaCy model SPACY_MODEL (a package name or path,
+by default `en_core_web_sm`) and WordNet from the NLTK data path (see
+NLTK_DATA), both installed by the Dockerfile."""
+from functools import cache
+from os import getenv
 from pathlib import Path
 from typing import Generator
-import nltk
-from nltk.corpus import wordnet
-import spacy
+from profiling import profiled
 from .ca_generator import CaGenerator
 
-nltk.download('wordnet')
+# WordNet parts of speech (wordnet.NOUN etc.) of the spaCy token types
+WORDNET_POS = {'PROPN': 'n', 'NOUN': 'n', 'VERB': 'v', 'ADJ': 'a'}
+
+@cache
+def spacy_model():
+    """Load the spaCy pipeline once per process."""
+    import spacy
+    return spacy.load(getenv('SPACY_MODEL', 'en_core_web_sm'))
+
+@cache
+def wordnet_corpus():
+    """Load the local WordNet corpus once per process, without downloads."""
+    from nltk.corpus import wordnet
+    wordnet.ensure_loaded()  # Fail early if WordNet is not installed
+    return wordnet
+
+def load_language_models():
+    """Load the spaCy model and WordNet ahead of the first sentence."""
+    spacy_model()
+    wordnet_corpus()
 
 def accept_token(token) -> bool:
     """Return true if token should be replaced with synonyms.
@@ -19,12 +44,9 @@ def accept_token(token) -> bool:
 
 def convert_type(token):
     """Convert spaCy token types to wordnet token types."""
-    if token.pos_ in frozenset(['PROPN', 'NOUN']):
-        return wordnet.NOUN
-    if token.pos_ in frozenset(['VERB']):
-        return wordnet.VERB
-    return wordnet.ADJ
+    return WORDNET_POS.get(token.pos_, WORDNET_POS['ADJ'])
 
+@profiled('generate_synonyms')
 def generate_synonyms(sentence: str, number_of_synonyms : int = 3) -> list[list[str]]:
     """Generate synonyms for each word in a sentence.
 
@@ -36,7 +58,8 @@ def generate_synonyms(sentence: str, number_of_synonyms : int = 3) -> list[list[
 
     The resulting list has all synonyms for the i-th word in the
     sentence at the i-th position."""
-    nlp = spacy.load("en_core_web_sm")
+    nlp = spacy_model()
+    wordnet = wordnet_corpus()
     synonyms = []
     for (i, token) in enumerate(nlp(sentence)):
         synonyms.append([token.text])
@@ -51,6 +74,7 @@ def generate_synonyms(sentence: str, number_of_synonyms : int = 3) -> list[list[
         ]))[:number_of_synonyms] # remove duplicates
     return synonyms
 
+@profiled('CaGenerator.generate')
 def generate_ca(synonyms: list[list[str]], strength: int = 2) -> tuple[Path, int]:
     """Generate a CA for the given list of synonyms and a particular strength."""
     return CaGenerator.get_generator().generate(synonyms, strength)
@@ -0,0 +1,9 @@
+"""Opt-in profiling of the meta runner's hot paths.
+
+The sections marked with profiled() and profiled_iter() are generating
+synonyms and CAs and querying the executor and store. See
+kommkonllm_common.profiling for the PROFILE_* environment variables and
+the files written."""
+from kommkonllm_common.profiling import configure, profiled, profiled_iter, start
+
+configure("meta-runner")
@@ -0,0 +1,69 @@
+"""Prometheus metrics of the model executor, served at /metrics.
+
+instrument() counts and times every HTTP request per endpoint and
+model; model_timer() times the queries to the LLMs themselves, so
+queueing in the executor (e.g. in batch requests) shows up as the
+difference between both."""
+
+from contextlib import contextmanager
+import time
+from flask import Flask, request
+from kommkonllm_common import flask_metrics
+from prometheus_client import Counter, Gauge, Histogram, generate_latest
+
+# LLM responses take from milliseconds (cached/small models) to minutes
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160, float('inf'))
+
+REQUESTS = Counter('executor_requests_total', 'HTTP requests by endpoint, model and status',
+                   ['endpoint', 'model', 'status'])
+REQUEST_LATENCY = Histogram('executor_request_duration_seconds',
+                            'HTTP request latency by endpoint and model',
+                            ['endpoint', 'model'], buckets=LATENCY_BUCKETS)
+IN_FLIGHT = Gauge('executor_requests_in_flight', 'HTTP requests being processed',
+                  ['endpoint', 'model'])
+MODEL_QUERIES = Counter('executor_model_queries_total', 'LLM queries by model and outcome',
+                        ['model', 'outcome'])
+MODEL_LATENCY = Histogram('executor_model_query_duration_seconds',
+                          'Latency of LLM queries by model',
+                          ['model'], buckets=LATENCY_BUCKETS)
+CACHE_LOOKUPS = Counter('executor_cache_lookups_total',
+                        'Response cache lookups by model and result (hit or miss)',
+                        ['model', 'result'])
+MODEL_IN_FLIGHT = Gauge('executor_model_queries_in_flight', 'LLM queries being processed',
+                        ['model'])
+
+def model_label(model: str, settings: dict | None = None) -> str:
+    """Name a model like MODELS_UNDER_TEST does, e.g. `OLLAMA:mistral`."""
+    if settings and settings.get('model'):
+        return f'{model}:{settings["model"]}'
+    return model
+
+@contextmanager
+def model_timer(model: str, settings: dict | None = None):
+    """Record the latency and outcome of a LLM query in a `with` block."""
+    label = model_label(model, settings)
+    MODEL_IN_FLIGHT.labels(label).inc()
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        MODEL_LATENCY.labels(label).observe(time.perf_counter() - start)
+        MODEL_QUERIES.labels(label, outcome).inc()
+        MODEL_IN_FLIGHT.labels(label).dec()
+
+def count_cache_lookup(model: str, settings: dict | None, hit: bool):
+    """Count a lookup in the response cache."""
+    CACHE_LOOKUPS.labels(model_label(model, settings), 'hit' if hit else 'miss').inc()
+
+def request_labels() -> tuple[str, str]:
+    """Return the endpoint (URL rule) and model of the current request."""
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    return endpoint, (request.view_args or {}).get('model', '')
+
+def instrument(app: Flask):
+    """Record metrics of all requests to app and add the /metrics endpoint."""
+    flask_metrics.instrument_requests(app, REQUESTS, REQUEST_LATENCY, IN_FLIGHT,
+                                      request_labels)
+    flask_metrics.add_metrics_endpoint(app, generate_latest)
@@ -5,26 +5,118 @@ Developers who have implemented a new LLM interface should add it to the
 
 import logging
 import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from os import getenv
-from flask import Flask, Response, request
-from models import T5Executor, LlamaExecutor, OllamaExecutor
+from flask import Flask, Response, g, request
+from models import OLLAMA_STATS, T5Executor, LlamaExecutor, OllamaExecutor
+from response_cache import ResponseCache
+import instrumentation
+import profiling
 
 logging.basicConfig()
 logger = logging.getLogger(__name__)
 logger.setLevel(getenv('LOG_LEVEL', default='DEBUG'))
 logger.propagate = True
 models = {'LLAMA': LlamaExecutor(), 'T5': T5Executor(), 'OLLAMA': OllamaExecutor()}
+batch_pool = ThreadPoolExecutor(max_workers=int(getenv('BATCH_WORKERS', default='8')))
+response_cache = ResponseCache(int(getenv('RESPONSE_CACHE_SIZE', default='0')))
+
+def preloaded_models() -> list[str]:
+    """Return the models to prepare at startup, listed in PRELOAD, e.g. OLLAMA."""
+    names = [name.strip().upper() for name in getenv('PRELOAD', default='').split(',')]
+    names = [name for name in names if name]
+    unknown = [name for name in names if name not in models]
+    if unknown:
+        raise ValueError(f'Unknown models in PRELOAD: {", ".join(unknown)}; '
+                         f'valid models are {", ".join(models)}')
+    return names
+
+# /models reports 503 until the preloaded models are ready
+preloaded = preloaded_models()
+for name in preloaded:
+    models[name].start_preload()
 app = Flask(__name__)
+instrumentation.instrument(app)
+profiling.start()
+
+@app.before_request
+def start_trace():
+    """Adopt the caller's X-Trace-Id (or create one) to correlate logs."""
+    g.trace_id = request.headers.get('X-Trace-Id') or uuid.uuid4().hex
+
+@app.after_request
+def return_trace(response):
+    """Return the trace ID, so callers can pass it on to the store."""
+    if 'trace_id' in g:
+        response.headers['X-Trace-Id'] = g.trace_id
+    return response
+
+def parse_settings(settings) -> dict:
+    """Parse per-query settings, given as a JSON object or its string."""
+    if settings is None:
+        return {}
+    if isinstance(settings, str):
+        settings = json.loads(settings)
+    if not isinstance(settings, dict):
+        raise ValueError('Settings must be a JSON object')
+    return settings
+
+def run_query(model: str, prompt: str, query_settings: dict, trace_id: str) -> dict:
+    """Query a LLM (or the response cache) and time the query.
+
+    Returns a dict with the `response`, the `wall_time` of the query in
+    seconds, the statistics reported by the LLM (OLLAMA_STATS, None if
+    unknown) and whether the response was a `cache_hit`."""
+    start = time.perf_counter()
+    key = ResponseCache.key(model, prompt, query_settings)
+    cached = response_cache.get(key) if response_cache.enabled else None
+    if response_cache.enabled:
+        instrumentation.count_cache_lookup(model, query_settings, cached is not None)
+    if cached is None:
+        with instrumentation.model_timer(model, query_settings), \
+                profiling.profiled('model_query'):
+            response, stats = models[model].query_with_stats(prompt, query_settings)
+        response_cache.put(key, (response, stats))
+    else:
+        response, stats = cached
+    wall_time = time.perf_counter() - start
+    logging.debug('[%s] %s answered in %.3fs (cache hit: %s, stats %s)', trace_id,
+                  model, wall_time, cached is not None, stats)
+    return {'response': response, 'wall_time': wall_time,
+            **dict.fromkeys(OLLAMA_STATS), **stats, 'cache_hit': cached is not None}
+
+def response_text(response) -> str:
+    """Convert a model response to text as returned by /query."""
+    return response if isinstance(response, str) else json.dumps(response)
 
 @app.route('/models', methods=['GET'])
 def show_models():
-    """List available models."""
+    """List available models.
+
+    Responds with 503 while preloaded models are still being prepared,
+    so clients can use this endpoint as a readiness check, and with 500
+    if preparing them failed for good."""
+    errors = [models[name].preload_error() for name in preloaded
+              if models[name].preload_error()]
+    if errors:
+        return Response('\n'.join(errors), status=500, mimetype='text/plain')
+    loading = [name for name in preloaded if not models[name].is_ready()]
+    if loading:
+        return Response(f'Loading models: {", ".join(loading)}', status=503,
+                        mimetype='text/plain')
     model_names = '\n'.join([f'<li>{k}</li>' for k in models])
     return f'<h1>Available models:</h1>\n<ul>{model_names}</ul>'
 
 @app.route('/query/<model>', methods=['GET'])
 def query(model: str):
-    """Query a LLM with the input provided as the `prompt` GET parameter."""
+    """Query a LLM with the input provided as the `prompt` GET parameter.
+
+    The optional `settings` GET parameter is a JSON object overriding
+    model settings for this query only. With the `details` GET parameter
+    set to `true`, the response is a JSON object with the `response`
+    (text), timing and token statistics, see run_query()."""
     if not model in models:
         logging.error('Trying to query nonexistent model %s', model)
         return Response('Model does not exist.', status=400, mimetype='text/plain')
@@ -33,11 +125,60 @@ def query(model: str):
     if not prompt:
         logging.error('Received prompt-less query to model %s', model)
         return Response('Please specify a prompt.', status=400, mimetype='text/plain')
+    try:
+        query_settings = parse_settings(request.args.get('settings'))
+    except ValueError as e:
+        return Response(f'Invalid settings: {e}', status=400, mimetype='text/plain')
+
+    logging.debug('[%s] Prompt for %s: %s (settings %s)', g.trace_id, model, prompt,
+                  query_settings)
+    res = run_query(model, prompt, query_settings, g.trace_id)
+    logging.debug('[%s] Sending response %s', g.trace_id, res['response'])
+    if request.args.get('details', '').lower() == 'true':
+        return res | {'response': response_text(res['response'])}
+    return res['response']
+
+@app.route('/query/<model>/batch', methods=['POST'])
+def query_batch(model: str):
+    """Query a LLM with several prompts and/or settings concurrently.
+
+    The request body is a JSON object with a `queries` list of objects
+    with a `prompt` and optional `settings` property; a top-level
+    `settings` object applies to all queries. Returns a list with the
+    `prompt`, `settings` and `response` (text) of each query, in order,
+    together with its timing and token statistics, see run_query(). A
+    failed query does not fail the batch: its `error` is set instead of
+    its `response` and statistics."""
+    if not model in models:
+        logging.error('Trying to query nonexistent model %s', model)
+        return Response('Model does not exist.', status=400, mimetype='text/plain')
+
+    body = request.get_json(force=True)
+    try:
+        shared_settings = parse_settings(body.get('settings'))
+        queries = [(q['prompt'], shared_settings | parse_settings(q.get('settings')))
+                   for q in body['queries']]
+    except (KeyError, TypeError, ValueError) as e:
+        return Response(f'Invalid batch: {e}', status=400, mimetype='text/plain')
+    if not all(prompt for prompt, _ in queries):
+        return Response('Please specify a prompt for each query.', status=400,
+                        mimetype='text/plain')
+
+    logging.debug('[%s] Batch of %d queries for %s', g.trace_id, len(queries), model)
+    futures = [batch_pool.submit(run_query, model, prompt, query_settings, g.trace_id)
+               for prompt, query_settings in queries]
+    return [{'prompt': prompt, 'settings': query_settings, **batch_result(future)}
+            for (prompt, query_settings), future in zip(queries, futures)]
 
-    logging.debug('Prompt for %s: %s', model, prompt)
-    res = models[model].query(prompt)
-    logging.debug('Sending response %s', res)
-    return res
+def batch_result(future) -> dict:
+    """Return the result of a query in a batch, or its `error` if it failed."""
+    try:
+        res = future.result()
+    except Exception as e:
+        logging.exception('[%s] Query in batch failed', g.trace_id)
+        return {'response': None, 'wall_time': None, **dict.fromkeys(OLLAMA_STATS),
+                'cache_hit': None, 'error': str(e) or type(e).__name__}
+    return res | {'response': response_text(res['response']), 'error': None}
 
 @app.route('/<model>/settings', methods=['POST'])
 def settings(model: str):
@@ -47,6 +188,7 @@ def settings(model: str):
         return Response('Model does not exist.', status=400, mimetype='text/plain')
 
     ret = models[model].set_settings(request.get_json(force=True))
+    response_cache.clear()  # Cached responses may be based on other settings
     return json.dumps(ret)
 
 if __name__ == '__main__':
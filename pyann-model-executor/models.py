@@ -10,8 +10,13 @@ ModelExecutor and implement at least the query() method."""
 from os import getenv
 import json
 import logging
+import queue
+import threading
+import time
+import uuid
 import requests
 import socketio
+from profiling import profiled
 
 # Logger configuration
 logging.basicConfig()
@@ -22,17 +27,42 @@ requests_log = logging.getLogger("requests.packages.urllib3")
 requests_log.setLevel(logging.DEBUG)
 requests_log.propagate = True
 
+# Statistics of a query reported by Ollama: the number of generated and
+# prompt tokens and the total processing time in nanoseconds
+OLLAMA_STATS = ('eval_count', 'prompt_eval_count', 'total_duration')
+
 class ModelExecutor:
     """Model executor abstract class.
 
     Allows callers to query a LLM and update/retrieve its settings.
     Do not use this class directly, except when implementing subclasses."""
-    def query(self, prompt: str) -> str | bool:
-        """Query the model with the given string."""
+    def query(self, prompt: str, settings: dict | None = None) -> str | bool:
+        """Query the model with the given string.
+
+        settings optionally overrides some model settings for this query
+        only, see merge_settings()."""
         raise NotImplementedError(
             "ModelExecutor::query() must not be accessed directly"
         )
 
+    def query_with_stats(self, prompt: str,
+                         settings: dict | None = None) -> tuple[str | bool, dict]:
+        """Query the model and return its response and statistics.
+
+        The statistics are those reported by the LLM, i.e. any of
+        OLLAMA_STATS; executors whose LLM reports none return an empty
+        dict."""
+        return self.query(prompt, settings), {}
+
+    def merge_settings(self, settings: dict | None = None) -> dict:
+        """Return a copy of the model settings updated with per-query settings.
+
+        The shared settings are never modified, so concurrent queries with
+        different settings do not interfere."""
+        merged = dict(self.get_settings())
+        merged.update(settings or {})
+        return merged
+
     def set_settings(self, settings: dict) -> dict:
         """Update the model settings."""
         return {}
@@ -41,12 +71,33 @@ class ModelExecutor:
         """Retrieve the current model settings."""
         return {}
 
+    def preload(self):
+        """Prepare the model for queries (called at startup if enabled)."""
+
+    def start_preload(self):
+        """Run preload() in a background thread."""
+        threading.Thread(target=self.preload, name=f'preload-{type(self).__name__}',
+                         daemon=True).start()
+
+    def is_ready(self) -> bool:
+        """Return True if the model is ready to answer queries quickly."""
+        return True
+
+    def preload_error(self) -> str | None:
+        """Return why preload() failed for good, or None."""
+        return None
+
 class OllamaExecutor(ModelExecutor):
     """Executor for Ollama models.
 
     Ollama offers a common interface to multiple LLMs.
     You can choose which LLM to use by setting the OLLAMA_MODEL environment
-    variable."""
+    variable; a `model` setting selects a different LLM for a query.
+
+    preload() creates and warms up the models listed in
+    OLLAMA_PRELOAD_MODELS (OLLAMA_MODEL by default). All requests ask
+    Ollama to keep the model loaded for OLLAMA_KEEP_ALIVE (a duration
+    such as `30m`, or `-1` to never unload it)."""
     def __init__(self):
         """Set model parameters and default values."""
         self.settings = {
@@ -57,56 +108,133 @@ class OllamaExecutor(ModelExecutor):
         self.endpoint = getenv('MODEL_IP', default='ollama:11434')
         self.enabled_models = []
         self.model_prefix = 'test-'
+        self.preload_models = getenv('OLLAMA_PRELOAD_MODELS',
+                                     default=self.model).split(',')
+        keep_alive = getenv('OLLAMA_KEEP_ALIVE', default='-1')
+        self.keep_alive = int(keep_alive) if keep_alive.lstrip('-').isdigit() else keep_alive
+        self.warmup_prompt = getenv('OLLAMA_WARMUP_PROMPT',
+                                    default='Is this a warm-up query? Return a JSON boolean.')
+        self.load_timeout = int(getenv('OLLAMA_LOAD_TIMEOUT', default='600'))
+        self.setup_lock = threading.Lock()
+        self.ready = threading.Event()
+        self.error = None
+
+    def query(self, prompt: str, settings: dict | None = None) -> str:
+        """Query the model with the given string (and per-query settings)."""
+        return self.query_with_stats(prompt, settings)[0]
 
-    def query(self, prompt: str) -> str:
-        """Query the model with the given string."""
-        if self.model not in self.enabled_models:
-            self.setup()
-        model = self.model_prefix + self.model
+    def query_with_stats(self, prompt: str,
+                         settings: dict | None = None) -> tuple[str, dict]:
+        """Query the model and return its response and token statistics."""
+        options = self.merge_settings(settings)
+        base_model = options.pop('model', self.model)
+        if base_model not in self.enabled_models:
+            self.setup(base_model)
+        model = self.model_prefix + base_model
         params = {
             'model': model,
             'prompt': prompt,
             'format': 'json',
             'stream': False,
-            'options': self.settings.copy()
+            'keep_alive': self.keep_alive,
+            'options': options
         }
-        response = requests.post(f'http://{self.endpoint}/api/generate',
-                                 json=params, timeout=64).text
+        with profiled('ollama.generate'):
+            response = requests.post(f'http://{self.endpoint}/api/generate',
+                                     json=params, timeout=64).text
         try:
             # Try to decode as JSON; return as-is otherwise
             decoded = json.loads(response)
         except:
-            return response
+            return response, {}
+        stats = {key: decoded[key] for key in OLLAMA_STATS
+                 if isinstance(decoded, dict) and key in decoded}
         try:
             # Try to extract response property from JSON;else return full object
             resp = decoded['response']
         except:
-            return decoded
+            return decoded, stats
         try:
             # Try to decode inner JSON; return full property otherwise
             decoded_inner = json.loads(resp)
         except:
-            return resp
+            return resp, stats
         for _, val in decoded_inner.items():
             # Find the first boolean property and return it.
             if isinstance(val, bool):
-                return str(val)
+                return str(val), stats
         # There was no boolean property, return entire object
-        return decoded_inner
-
-    def setup(self):
-        """Enable the requested model"""
-        if self.model in self.enabled_models:
-            logging.debug('Model %s already enabled, skipping.', self.model)
-            return # Already done
-        output_model = self.model_prefix + self.model
-        params = {"model": output_model, "from": self.model}
-        logging.info('Creating local model %s from %s...', output_model, self.model)
-        response = requests.post(f'http://{self.endpoint}/api/create',
-                                 json=params, timeout=32).text
-        logging.debug('Ollama create response: %s', response)
-        self.enabled_models.append(self.model)
-        logging.debug('Enabled model %s.', output_model)
+        return decoded_inner, stats
+
+    def setup(self, model: str | None = None):
+        """Enable the requested model (OLLAMA_MODEL by default)
+
+        Concurrent callers wait for a single creation of the model."""
+        model = model or self.model
+        with self.setup_lock:
+            if model in self.enabled_models:
+                logging.debug('Model %s already enabled, skipping.', model)
+                return # Already done
+            output_model = self.model_prefix + model
+            params = {"model": output_model, "from": model}
+            logging.info('Creating local model %s from %s...', output_model, model)
+            response = requests.post(f'http://{self.endpoint}/api/create',
+                                     json=params, timeout=self.load_timeout)
+            response.raise_for_status()
+            logging.debug('Ollama create response: %s', response.text)
+            self.enabled_models.append(model)
+            logging.debug('Enabled model %s.', output_model)
+
+    def warm_up(self, model: str):
+        """Load a model into memory by answering the warm-up prompt."""
+        logging.info('Warming up model %s...', model)
+        started = time.monotonic()
+        requests.post(f'http://{self.endpoint}/api/generate', json={
+            'model': self.model_prefix + model,
+            'prompt': self.warmup_prompt,
+            'format': 'json',
+            'stream': False,
+            'keep_alive': self.keep_alive,
+            'options': self.get_settings(),
+        }, timeout=self.load_timeout).raise_for_status()
+        logging.info('Model %s warmed up in %.1fs', model, time.monotonic() - started)
+
+    def preload(self):
+        """Create and warm up all preloaded models, then report readiness.
+
+        Failures (e.g. while Ollama is still starting) are retried for up
+        to OLLAMA_LOAD_TIMEOUT seconds per model. Errors reported by
+        Ollama (HTTP 4xx, e.g. for an unknown model) and failures after
+        this deadline are permanent; they are kept in `error`."""
+        for model in self.preload_models:
+            deadline = time.monotonic() + self.load_timeout
+            while True:
+                try:
+                    self.setup(model)
+                    self.warm_up(model)
+                    break
+                except Exception as e:
+                    permanent = (isinstance(e, requests.HTTPError)
+                                 and e.response is not None
+                                 and 400 <= e.response.status_code < 500)
+                    if permanent or time.monotonic() + 10 > deadline:
+                        detail = e.response.text if permanent else e
+                        self.error = f'Preloading {model} failed: {detail}'
+                        logging.error(self.error)
+                        return
+                    logging.warning('Preloading %s failed (%s), retrying in 10s',
+                                    model, e)
+                    time.sleep(10)
+        self.ready.set()
+        logging.info('Preloaded models: %s', ', '.join(self.preload_models))
+
+    def is_ready(self) -> bool:
+        """Return True once preload() has finished."""
+        return self.ready.is_set()
+
+    def preload_error(self) -> str | None:
+        """Return why preload() failed for good, or None."""
+        return self.error
 
     def set_settings(self, settings: dict) -> dict:
         """Update the model settings."""
@@ -131,9 +259,9 @@ class T5Executor(ModelExecutor):
         }
         self.endpoint = getenv('MODEL_IP', default='t5:5069')
 
-    def query(self, prompt: str) -> str:
-        """Query the model with the given string."""
-        params = self.settings.copy()
+    def query(self, prompt: str, settings: dict | None = None) -> str:
+        """Query the model with the given string (and per-query settings)."""
+        params = self.merge_settings(settings)
         params['prompt'] = prompt
         return requests.get(f'http://{self.endpoint}/query',
                             params=params, timeout=16).text
@@ -150,6 +278,17 @@ class T5Executor(ModelExecutor):
 class LlamaExecutor(ModelExecutor):
     """Executor for a self-hosted Llama instance (deprecated).
 
+    Queries are sent over a pool of LLAMA_POOL_SIZE socket.io connections,
+    so several prompts can be processed in parallel. Each request carries
+    a `request_id`, and only a response echoing it is returned; others
+    (e.g. the late answer to a request that timed out) are discarded. For
+    servers that do not echo the ID, set LLAMA_ACCEPT_UNTAGGED=true to
+    accept responses without one; since a connection carries one request
+    at a time and is closed after a timeout, such a response still
+    belongs to the pending request. If the connection breaks, it is
+    re-established and the request is sent once more; a request that
+    times out after LLAMA_TIMEOUT seconds is not repeated.
+
     Future developments should use Ollama instead."""
     def __init__(self):
         """Set model parameters and default values."""
@@ -165,22 +304,53 @@ class LlamaExecutor(ModelExecutor):
             'repeat_penalty': 1.3,
             'models': ['13B', '30B', '65B', '7B'],
         }
-        self.socket = socketio.SimpleClient()
-        self.model_ip = getenv('SELF.MODEL_IP')
+        self.model_ip = getenv('MODEL_IP')
+        self.timeout = int(getenv('LLAMA_TIMEOUT', default='64'))
+        self.accept_untagged = getenv('LLAMA_ACCEPT_UNTAGGED',
+                                      default='false').lower() == 'true'
+        # Connections are opened on first use; LIFO keeps few of them busy
+        self.clients = queue.LifoQueue()
+        for _ in range(int(getenv('LLAMA_POOL_SIZE', default='4'))):
+            self.clients.put(socketio.SimpleClient())
 
-    def query(self, prompt: str) -> str:
-        """Query the model with the given string."""
+    def query(self, prompt: str, settings: dict | None = None) -> str:
+        """Query the model with the given string (and per-query settings)."""
+        params = self.merge_settings(settings)
+        params['prompt'] = prompt
+        params['request_id'] = uuid.uuid4().hex
+        client = self.clients.get()
+        try:
+            try:
+                return self.exchange(client, params)
+            except (socketio.exceptions.ConnectionError,
+                    socketio.exceptions.DisconnectedError) as e:
+                logging.warning('Llama request %s failed (%s), reconnecting',
+                                params['request_id'], e)
+                client.disconnect()
+                return self.exchange(client, params)
+        except socketio.exceptions.SocketIOError:
+            client.disconnect()  # Do not hand out a connection in an unknown state
+            raise
+        finally:
+            self.clients.put(client)
 
-        # XXX Dirty, socketio.SimpleClient does not expose its `connected` property publicly
-        if not self.socket.connected:
-            self.socket.connect(f'http://{self.model_ip}', transports=['websocket'])
+    def exchange(self, client: socketio.SimpleClient, params: dict):
+        """Send a request over a (re)connected client and await its response."""
+        if not client.connected:
+            client.connect(f'http://{self.model_ip}', transports=['websocket'])
             logging.debug('Connected to Llama at %s', self.model_ip)
-
-        params = self.settings.copy()
-        params['prompt'] = prompt
-        self.socket.emit('request', params)
-        logging.debug('Sent request to Llama')
-        event = self.socket.receive()
+        client.emit('request', params)
+        logging.debug('Sent request %s to Llama', params['request_id'])
+        deadline = time.monotonic() + self.timeout
+        while True:
+            event = client.receive(timeout=max(0.0, deadline - time.monotonic()))
+            response_id = next((arg['request_id'] for arg in event[1:]
+                                if isinstance(arg, dict) and 'request_id' in arg),
+                               None)
+            if response_id == params['request_id'] or (
+                    response_id is None and self.accept_untagged):
+                break
+            logging.debug('Discarding Llama response to request %s', response_id)
         logging.debug('Received response from Llama: "%s" with arguments %s}',
                       event[0], event[1:])
         return event[1:]
@@ -0,0 +1,8 @@
+"""Opt-in profiling of the model executor's hot paths.
+
+The sections marked with profiled() are the queries to the LLMs and the
+decoding of their responses. See kommkonllm_common.profiling for the
+PROFILE_* environment variables and the files written."""
+from kommkonllm_common.profiling import configure, profiled, start
+
+configure('executor')
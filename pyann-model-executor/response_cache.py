@@ -0,0 +1,53 @@
+"""Optional LRU cache of LLM responses.
+
+Identical prompts occur regularly in a run, e.g. when several CA rows
+select the same synonyms or a run is repeated with the same settings.
+With RESPONSE_CACHE_SIZE set to a positive number, the executor answers
+such queries from memory. Only enable it for deterministic settings
+(e.g. a fixed seed): a cached response hides the variance of repeated
+queries."""
+
+from collections import OrderedDict
+import json
+import threading
+
+class ResponseCache:
+    """Thread-safe cache of the most recently used responses."""
+    def __init__(self, size: int):
+        """Keep up to size responses; a size of 0 disables the cache."""
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """Return True if responses are cached at all."""
+        return self.size > 0
+
+    @staticmethod
+    def key(model: str, prompt: str, settings: dict) -> str:
+        """Return the cache key of a query."""
+        return json.dumps([model, prompt, settings], sort_keys=True, default=str)
+
+    def get(self, key: str):
+        """Return the cached value for key or None."""
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value):
+        """Cache a value, evicting the least recently used one if full."""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        """Drop all cached responses, e.g. after the model settings changed."""
+        with self.lock:
+            self.entries.clear()
@@ -2,7 +2,9 @@
 
 import logging
 from os import getenv
+import time
 from flask import Flask, request, Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
 from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
 import torch
 
@@ -14,6 +16,11 @@ TOKENIZER = None
 MODEL = None
 device = torch.device("cpu")
 
+QUERIES = Counter("t5_queries_total", "Queries by status", ["status"])
+QUERY_LATENCY = Histogram("t5_query_duration_seconds", "Latency of the T5 model",
+                          buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, float("inf")))
+IN_FLIGHT = Gauge("t5_queries_in_flight", "Queries being processed")
+
 app = Flask(__name__)
 
 def init_model():
@@ -72,10 +79,24 @@ def query():
     num_beams = request.args.get("numBeams", default=2, type=int)
     early_stopping = request.args.get("earlyStopping", default=True, type=bool)
 
-    ret = query_t5(request.args.get("prompt", default=""), max_length, num_beams, early_stopping)
+    start = time.perf_counter()
+    status = "error"
+    try:
+        with IN_FLIGHT.track_inprogress():
+            ret = query_t5(request.args.get("prompt", default=""), max_length,
+                           num_beams, early_stopping)
+        status = "ok"
+    finally:
+        QUERY_LATENCY.observe(time.perf_counter() - start)
+        QUERIES.labels(status).inc()
     LOG.debug('T5 returning result "%s"', ret)
     return ret
 
+@app.route("/metrics")
+def metrics():
+    """Expose query counts and latencies in the Prometheus text format."""
+    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+
 
 if __name__ == "__main__":
     # Initialize the model and start the HTTP server